@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""Throughput/size benchmark of TIFF compression options for projection images.
+
+Usage:
+    python scripts/benchmark_compression.py [--size 2048] [--frames 8] [--json out.json]
+
+Writes synthetic uint16 microscopy-like MIPs (dim background, Gaussian cells,
+Poisson shot noise) with every available codec/level/predictor combination
+and reports write MB/s, read MB/s (uncompressed bytes per second) and the
+compression ratio. Codecs that need imagecodecs are skipped if it is missing.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+import tifffile as tiff
+
+from microglia_pipeline.preprocess import tiff_options, write_mip
+
+CASES = [
+    ("none", None, False),
+    ("zlib", 1, False), ("zlib", 1, True), ("zlib", 6, True),
+    ("zstd", 1, True), ("zstd", 9, True),
+    ("lzw", None, True),
+]
+
+
+def synthetic_mip(size: int, seed: int, n_cells: int = 60) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    img = np.full((size, size), 300.0, dtype=np.float32)
+    img += 80.0 * np.sin(xx / size * np.pi)  # uneven illumination
+    for _ in range(n_cells):
+        cy, cx = rng.uniform(0, size, 2)
+        sigma = rng.uniform(size / 200, size / 60)
+        amp = rng.uniform(800, 3000)
+        r2 = (yy - cy) ** 2 + (xx - cx) ** 2
+        img += amp * np.exp(-r2 / (2 * sigma ** 2))
+    return np.clip(rng.poisson(img), 0, 65535).astype(np.uint16)
+
+
+def bench(frames, opts, workdir: Path):
+    paths = [workdir / f"f{i:03d}.tif" for i in range(len(frames))]
+    raw = sum(f.nbytes for f in frames)
+    t0 = time.perf_counter()
+    for p, f in zip(paths, frames):
+        write_mip(p, f, opts)
+    t_write = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for p, f in zip(paths, frames):
+        if not np.array_equal(tiff.imread(p), f):
+            raise RuntimeError("round-trip mismatch")
+    t_read = time.perf_counter() - t0
+    on_disk = sum(p.stat().st_size for p in paths)
+    for p in paths:
+        p.unlink()
+    return dict(write_mb_s=raw / t_write / 1e6, read_mb_s=raw / t_read / 1e6, ratio=raw / on_disk, bytes=on_disk)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", type=int, default=2048, help="frame edge length in pixels")
+    ap.add_argument("--frames", type=int, default=8)
+    ap.add_argument("--dir", type=Path, default=None, help="directory to write into (default: temp dir)")
+    ap.add_argument("--json", type=Path, default=None, help="also write results as JSON")
+    args = ap.parse_args(argv)
+
+    frames = [synthetic_mip(args.size, seed) for seed in range(args.frames)]
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        print(f"{'compression':<12} {'level':>5} {'pred':>5} {'write MB/s':>11} {'read MB/s':>10} {'ratio':>6}")
+        for comp, level, pred in CASES:
+            try:
+                opts = tiff_options(comp, level, pred)
+            except ValueError as e:
+                print(f"{comp:<12} {str(level):>5} {str(pred):>5}  skipped: {e}")
+                continue
+            r = bench(frames, opts, Path(tmp))
+            results.append(dict(compression=comp, level=level, predictor=pred, **r))
+            print(f"{comp:<12} {str(level):>5} {str(pred):>5} {r['write_mb_s']:>11.1f} {r['read_mb_s']:>10.1f} {r['ratio']:>6.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(dict(size=args.size, frames=args.frames, results=results), indent=1))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""Synthetic-data benchmark suite for the projection pipeline (no ND2 files needed).
+
+Usage:
+    python scripts/benchmark_pipeline.py [--positions 4] [--z 20] [--size 1024] [--channels 3]
+                                         [--dtype uint16] [--repeat 3] [--json results.json]
+
+A local stand-in for nd2.ND2File (microglia_pipeline.synthetic) serves
+synthetic (P, Z, C, Y, X) stacks. Stages measured (best of --repeat runs):
+
+  read_project:<reader>/<mode>  io_nd2.read_positions (channel read + Z max)
+  read_project+qc:<reader>/stream  the same with QC metrics (qc.QCAccumulator)
+  reduce:<reductions>           preprocess.project_z on an in-memory stack
+  write_tiff                    preprocess.write_mip of every MIP
+  end_to_end                    read_positions + save_flat_projections via BackgroundWriter
+
+Each stage reports seconds, planes/s, MB/s of input data and the tracemalloc
+peak in MB. --json writes the results plus environment details (git commit,
+versions) so runs can be compared across commits.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import traceback
+
+import numpy as np
+
+from microglia_pipeline.io_nd2 import read_positions
+from microglia_pipeline.preprocess import BackgroundWriter, project_z, save_flat_projections, write_mip
+from microglia_pipeline.synthetic import SyntheticND2File, SyntheticSpec, synthetic_nd2
+
+EGFP, NUC = ["egfp"], ["dapi"]
+
+
+def _measure(fn, repeat: int):
+    """Best wall time over `repeat` runs and the tracemalloc peak of the last run."""
+    best = None
+    peak = 0
+    for _ in range(max(1, repeat)):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        fn()
+        dt = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        best = dt if best is None else min(best, dt)
+    return best, peak
+
+
+def _row(stage: str, secs: float, planes: int, nbytes: int, peak: int) -> dict:
+    return dict(stage=stage, seconds=secs, planes_per_s=planes / secs, mb_per_s=nbytes / secs / 1e6,
+                peak_mb=peak / 1e6)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(spec: SyntheticSpec, repeat: int, workdir: Path) -> list:
+    path = workdir / "synthetic.nd2"
+    path.write_bytes(b"")
+    n_planes = spec.positions * spec.z * 2  # EGFP + nuclei planes actually read
+    sel_bytes = n_planes * spec.y * spec.x * np.dtype(spec.dtype).itemsize
+    rows = []
+    with synthetic_nd2({path.name: spec}):
+        for reader in ("dask", "frames"):
+            for mode in ("volume", "stream"):
+                secs, peak = _measure(lambda: [None for _ in read_positions(path, EGFP, NUC, mode=mode, reader=reader)],
+                                      repeat)
+                rows.append(_row(f"read_project:{reader}/{mode}", secs, n_planes, sel_bytes, peak))
+            # same read with QC metrics folded in (compare with read_project:<reader>/stream)
+            secs, peak = _measure(lambda: [None for _ in read_positions(path, EGFP, NUC, mode="stream", reader=reader,
+                                                                        qc={})], repeat)
+            rows.append(_row(f"read_project+qc:{reader}/stream", secs, n_planes, sel_bytes, peak))
+
+        stack = SyntheticND2File(spec).asarray()[0][:, :2]  # one position, (Z, 2, Y, X)
+        for reductions in (["max"], ["max", "mean", "std"], ["p90"]):
+            secs, peak = _measure(lambda: project_z([stack], reductions, spec.z, stack.dtype, axis=0), repeat)
+            rows.append(_row(f"reduce:{'+'.join(reductions)}", secs, stack.shape[0] * 2, stack.nbytes, peak))
+
+        mips = [(it["egfp_mip"], it["nuc_mip"]) for it in read_positions(path, EGFP, NUC)]
+        out = workdir / "tiff"
+        out.mkdir()
+
+        def _write():
+            for i, (e, n) in enumerate(mips):
+                write_mip(out / f"e{i}.tif", e)
+                write_mip(out / f"n{i}.tif", n)
+        mip_bytes = sum(e.nbytes + n.nbytes for e, n in mips)
+        secs, peak = _measure(_write, repeat)
+        rows.append(_row("write_tiff", secs, 2 * len(mips), mip_bytes, peak))
+
+        def _end_to_end():
+            with BackgroundWriter(2) as writer:
+                for it in read_positions(path, EGFP, NUC, mode="stream"):
+                    save_flat_projections(workdir / "e2e", path.stem, it["xy_index"], it["projections"], writer=writer)
+        secs, peak = _measure(_end_to_end, repeat)
+        rows.append(_row("end_to_end", secs, n_planes, sel_bytes, peak))
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--positions", type=int, default=4)
+    ap.add_argument("--z", type=int, default=20)
+    ap.add_argument("--size", type=int, default=1024, help="Y and X size in pixels")
+    ap.add_argument("--channels", type=int, default=3)
+    ap.add_argument("--dtype", default="uint16")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", type=Path, default=None, help="write machine-readable results here")
+    args = ap.parse_args(argv)
+
+    names = (["DAPI", "EGFP"] + [f"C{i}" for i in range(2, args.channels)])[:max(2, args.channels)]
+    spec = SyntheticSpec(positions=args.positions, z=args.z, channel_names=names, y=args.size, x=args.size,
+                         dtype=args.dtype)
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = run(spec, args.repeat, Path(tmp))
+
+    print(f"{'stage':<28} {'seconds':>9} {'planes/s':>10} {'MB/s':>9} {'peak MB':>9}")
+    for r in rows:
+        print(f"{r['stage']:<28} {r['seconds']:>9.3f} {r['planes_per_s']:>10.1f} {r['mb_per_s']:>9.1f} {r['peak_mb']:>9.1f}")
+    if args.json:
+        report = dict(
+            commit=_git_commit(),
+            python=platform.python_version(),
+            numpy=np.__version__,
+            platform=platform.platform(),
+            spec=dict(positions=spec.positions, z=spec.z, channels=len(names), y=spec.y, x=spec.x, dtype=spec.dtype),
+            repeat=args.repeat,
+            stages=rows,
+        )
+        args.json.write_text(json.dumps(report, indent=1))
+        print(f"[bench] wrote {args.json}")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
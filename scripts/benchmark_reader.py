@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Compare the 'dask' and 'frames' ND2 reader backends of io_nd2.read_positions.
+
+Usage:
+    python scripts/benchmark_reader.py FILE.nd2 [FILE.nd2 ...] [--mode volume|stream] [--repeat N]
+
+For each file and backend, reports wall time, positions/s and MB/s of channel
+data read (best of N runs), and checks both backends produce identical MIPs.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import sys
+import time
+import traceback
+
+import numpy as np
+
+from microglia_pipeline.config import ChannelsConfig
+from microglia_pipeline.io_nd2 import read_positions
+
+BACKENDS = ("dask", "frames")
+
+
+def _run(path: Path, backend: str, mode: str, chans: ChannelsConfig):
+    t0 = time.perf_counter()
+    nbytes = 0
+    mips = []
+    for item in read_positions(path, chans.egfp_keywords, chans.nuc_keywords, mode=mode, reader=backend):
+        nbytes += item["meta"]["bytes_read"]
+        mips.append((item["egfp_mip"], item["nuc_mip"]))
+    return time.perf_counter() - t0, nbytes, mips
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("files", nargs="+", type=Path)
+    ap.add_argument("--mode", default="volume", choices=("volume", "stream"))
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+    chans = ChannelsConfig()
+
+    print(f"{'file':<32} {'backend':<8} {'seconds':>9} {'pos/s':>8} {'MB/s':>9}")
+    for path in args.files:
+        results = {}
+        for backend in BACKENDS:
+            best = None
+            for _ in range(max(1, args.repeat)):
+                run = _run(path, backend, args.mode, chans)
+                if best is None or run[0] < best[0]:
+                    best = run
+            results[backend] = best
+            secs, nbytes, mips = best
+            print(f"{path.name[:32]:<32} {backend:<8} {secs:>9.3f} {len(mips) / secs:>8.1f} {nbytes / secs / 1e6:>9.1f}")
+        ref, other = (results[b][2] for b in BACKENDS)
+        same = all(np.array_equal(a, b) for pa, pb in zip(ref, other) for a, b in zip(pa, pb))
+        speedup = results["dask"][0] / results["frames"][0]
+        print(f"{'':<32} frames speedup x{speedup:.2f}; outputs {'identical' if same else 'DIFFER'}")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Cold-start import time of the pipeline's entry points.
+
+Usage:
+    python scripts/benchmark_startup.py [--repeat 5] [--json out.json] [--check]
+
+Each entry point is imported in a fresh interpreter (best of --repeat runs,
+minus bare interpreter startup) and the heavy optional stacks it pulled in
+are listed. --check exits non-zero when a lightweight entry point (config,
+projection, aggregation, the generate/merge scripts) loads napari, npe2 or
+Qt, which costs seconds per worker process and fails on headless nodes.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import subprocess
+import sys
+import traceback
+
+SCRIPTS = Path(__file__).resolve().parent
+
+# name -> (import statement, must stay free of the GUI/plugin stack)
+ENTRY_POINTS = {
+    "config": ("import microglia_pipeline.config", True),
+    "io_nd2": ("import microglia_pipeline.io_nd2", True),
+    "parallel": ("import microglia_pipeline.parallel", True),
+    "manifest": ("import microglia_pipeline.manifest", True),
+    "catalog": ("import microglia_pipeline.catalog", True),
+    "aggregate": ("import microglia_pipeline.aggregate", True),
+    "sharding": ("import microglia_pipeline.sharding", True),
+    "orchestrate": ("import microglia_pipeline.orchestrate", True),
+    "generate_projections.py": ("import generate_projections", True),
+    "merge_shards.py": ("import merge_shards", True),
+    "plugin_runner": ("import microglia_pipeline.plugin_runner", False),
+    "headless": ("import microglia_pipeline.headless", False),
+}
+GUI_MODULES = ("napari", "npe2", "qtpy", "PyQt5", "PyQt6", "PySide2", "PySide6", "vispy")
+HEAVY_MODULES = GUI_MODULES + ("nd2", "dask", "pandas", "pyarrow", "zarr", "tifffile")
+
+_PROBE = """
+import sys, time, json
+sys.path.insert(0, {scripts!r})
+t0 = time.perf_counter()
+{stmt}
+dt = time.perf_counter() - t0
+print(json.dumps(dict(seconds=dt, loaded=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+def probe(stmt: str, repeat: int) -> dict:
+    """Best-of-repeat in-process import time and heavy modules loaded, each run in a fresh interpreter."""
+    best = None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", _PROBE.format(scripts=str(SCRIPTS), stmt=stmt,
+                                                                  heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            return dict(seconds=None, loaded=[], error=out.stderr.strip().splitlines()[-1])
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        if best is None or res["seconds"] < best["seconds"]:
+            best = res
+    return best
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", type=Path, default=None, help="also write results as JSON")
+    ap.add_argument("--check", action="store_true", help="fail if a lightweight entry point loads napari/npe2/Qt")
+    args = ap.parse_args(argv)
+
+    results = {}
+    violations = []
+    print(f"{'entry point':<26} {'import s':>9}  heavy modules loaded")
+    for name, (stmt, light) in ENTRY_POINTS.items():
+        res = probe(stmt, max(1, args.repeat))
+        results[name] = dict(res, light=light)
+        if res.get("error"):
+            print(f"{name:<26} {'-':>9}  failed: {res['error']}")
+            continue
+        gui = [m for m in res["loaded"] if m in GUI_MODULES]
+        if light and gui:
+            violations.append((name, gui))
+        print(f"{name:<26} {res['seconds']:>9.3f}  {', '.join(res['loaded']) or '-'}")
+
+    if args.json:
+        args.json.write_text(json.dumps(dict(python=sys.version.split()[0], results=results), indent=1))
+    if violations:
+        for name, gui in violations:
+            print(f"[startup] {name} loads {', '.join(gui)} at import time", file=sys.stderr)
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
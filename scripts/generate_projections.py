@@ -1,70 +1,341 @@
 #!/usr/bin/env python
 from __future__ import annotations
 from pathlib import Path
+import argparse
 import sys
 import traceback
+from microglia_pipeline import instrument
+from microglia_pipeline.catalog import CATALOG_NAME, Catalog, collect_nd2_paths
 from microglia_pipeline.config import load_config
-from microglia_pipeline.io_nd2 import read_positions
-from microglia_pipeline.preprocess import ensure_dir
-import tifffile as tiff
-import numpy as np
-
-
-def _collect_nd2_paths(inputs):
-    from pathlib import Path
-    import glob
-    out = []
-    for patt in inputs:
-        p = Path(patt)
-        if p.is_dir():
-            out.extend(sorted(p.glob('*.nd2')))
-        else:
-            matches = [Path(m) for m in glob.glob(patt, recursive=True)]
-            for m in matches:
-                if m.is_dir():
-                    out.extend(sorted(m.glob('*.nd2')))
-                elif m.suffix.lower() == '.nd2':
-                    out.append(m)
-    # de-duplicate
-    seen = set(); uniq = []
-    for p in out:
-        if p not in seen:
-            uniq.append(p); seen.add(p)
-    if not uniq:
-        raise FileNotFoundError('No ND2 files found from config.inputs.')
-    return uniq
-
-
-def generate():
+from microglia_pipeline.io_nd2 import ND2ReadError, nd2_header, read_positions
+from microglia_pipeline.preprocess import ensure_dir, open_writer, save_flat_projections, save_flat_tiles
+from microglia_pipeline.manifest import MANIFEST_NAME, Manifest, plan_positions, position_key, projection_settings
+from microglia_pipeline.parallel import (BudgetStats, WorkUnit, list_work_units, resolve_workers, run_units,
+                                        run_units_budgeted, unit_peak_bytes)
+from microglia_pipeline.qc import QC_NAME, write_qc_table
+from microglia_pipeline.sharding import parse_shard, plan_shards, shard_catalog_name, shard_manifest_name, shard_qc_name
+
+
+def _layout(cfg):
+    return 'Zarr projection store(s)' if cfg.output.backend == 'zarr' else 'flat layout egfp/ and nuc/'
+
+
+def _timed_store_write(store, stem, xy, n_positions, projections):
+    with instrument.current().stage('write'):
+        store.write(stem, xy, n_positions, projections)
+
+
+def _record_failure(manifest, nd2_path, xy, ident, error, failed):
+    error = f"{type(error).__name__}: {error}" if isinstance(error, Exception) else str(error)
+    print(f"[generate] {nd2_path.name} XY{xy:03d} failed: {error}", file=sys.stderr)
+    if manifest is not None:
+        manifest.record_failure(nd2_path.stem, xy, ident, error)
+    failed.append((nd2_path, xy, error))
+
+
+def _catalog_up_to_date(catalog, manifest, nd2_path, positions):
+    """Record manifest-skipped positions missing from the catalog (e.g. projected before it was enabled)."""
+    known = {row['xy'] for row in catalog.positions(stem=nd2_path.stem, status='done')}
+    rows = []
+    for p in positions:
+        if p not in known:
+            rel = manifest.outputs[position_key(nd2_path.stem, p)]['files']
+            rows.append((p, 'done', [manifest.output_root / f for f in rel]))
+    if rows:
+        catalog.record_positions(nd2_path, rows)
+
+
+def _unit_estimator(cfg, catalog):
+    """unit -> estimated peak bytes (parallel.unit_peak_bytes), one header lookup per ND2."""
+    cache = {}
+
+    def estimate(unit):
+        if unit.nd2_path not in cache:
+            info = catalog.describe(unit.nd2_path) if catalog is not None else nd2_header(unit.nd2_path)
+            sizes = {k: v for k, v in info['sizes'].items() if k != 'P'}
+            cache[unit.nd2_path] = unit_peak_bytes(sizes, info['dtype'], cfg)
+        return cache[unit.nd2_path]
+    return estimate
+
+
+def generate(config_path=None, shard=None):
+    """Project every configured ND2; shard='i/N' processes only shard i of N (see sharding.plan_shards).
+
+    Returns the (nd2_path, xy_index, error) positions that could not be read.
+    """
     repo_root = Path(__file__).resolve().parents[1]
-    cfg = load_config(repo_root / 'config.yaml')
-    nd2_paths = _collect_nd2_paths(cfg.inputs)
+    cfg = load_config(config_path or repo_root / 'config.yaml')
+    return generate_from_config(cfg, shard)
+
+
+def generate_from_config(cfg, shard=None, nd2_paths=None, report='generate'):
+    """generate() for a loaded config; nd2_paths overrides config.inputs (e.g. one file from the watcher)."""
     out_root = ensure_dir(Path(cfg.output_root))
-    egfp_root = ensure_dir(out_root / 'egfp')
-    nuc_root = ensure_dir(out_root / 'nuc')
+    # Opt-in instrumentation; hooks are no-ops unless a Recorder is active
+    rec = instrument.Recorder() if cfg.execution.instrument else None
+    with instrument.activate(rec) as rec:
+        try:
+            return _generate(cfg, out_root, rec, shard, nd2_paths)
+        finally:
+            if rec.enabled:
+                rec.write_report(out_root, report)
+
 
+def _generate(cfg, out_root, rec, shard=None, nd2_paths=None):
+    nd2_paths = nd2_paths if nd2_paths is not None else collect_nd2_paths(cfg.inputs)
+    egfp_root = out_root / 'egfp'
+    nuc_root = out_root / 'nuc'
+
+    # Shard mode: each of N invocations owns a deterministic, byte-balanced subset of the
+    # (file, position) units and keeps its own manifest and catalog (merge with merge_shards.py)
+    only = None
+    manifest_name, catalog_name, qc_name = MANIFEST_NAME, CATALOG_NAME, QC_NAME
+    if shard is not None:
+        index, count = parse_shard(shard)
+        if cfg.output.backend == 'zarr' and cfg.output.zarr_scope != 'file':
+            raise ValueError("Sharding the Zarr backend needs output.zarr_scope: 'file' (one store per ND2).")
+        manifest_name, catalog_name = shard_manifest_name(index, count), shard_catalog_name(index, count)
+        qc_name = shard_qc_name(index, count)
+
+    # Catalog: ND2 headers are cached by (size, mtime), so unchanged files are never reopened
+    catalog = Catalog(out_root, catalog_name) if cfg.execution.catalog or shard is not None else None
+    n_positions = None
+    if catalog is not None:
+        def n_positions(nd2_path):
+            return catalog.describe(nd2_path, cfg.channels.egfp_keywords, cfg.channels.nuc_keywords)['n_positions']
+    try:
+        if shard is not None:
+            plan = plan_shards(catalog, nd2_paths, count, by_file=cfg.output.backend == 'zarr')
+            only = {}
+            for unit, s in plan.items():
+                if s == index:
+                    only.setdefault(unit.nd2_path, set()).add(unit.xy_index)
+            print(f"[generate] shard {index}/{count}: {sum(map(len, only.values()))} of {len(plan)} positions")
+        return _project(cfg, out_root, rec, nd2_paths, catalog, n_positions, egfp_root, nuc_root, only,
+                        manifest_name, qc_name)
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+
+def _project(cfg, out_root, rec, nd2_paths, catalog, n_positions, egfp_root, nuc_root, only=None,
+             manifest_name=MANIFEST_NAME, qc_name=QC_NAME):
+    # Incremental mode: only positions that are new, stale, missing or failed are projected.
+    # Completed positions are journaled as they land, so an interrupted run resumes where it stopped.
+    # Shards always keep a manifest: merge_shards verifies completion from it.
+    manifest = None
+    if cfg.execution.incremental or only is not None:
+        manifest = Manifest(out_root, manifest_name)
+    # A shard also skips units the last merge already holds: adding inputs can move units
+    # to another shard, whose new owner must not redo its predecessor's work
+    merged = Manifest(out_root) if manifest_name != MANIFEST_NAME and cfg.execution.incremental else None
+    settings = projection_settings(cfg)
+    plans = []  # (nd2_path, source identity, positions); positions None = all
     for nd2_path in nd2_paths:
-        nd2_stem = nd2_path.stem
-        print(f"[generate] Processing {nd2_path.name} -> {egfp_root} / {nuc_root}")
-        for item in read_positions(
-            nd2_path,
-            cfg.channels.egfp_keywords,
-            cfg.channels.nuc_keywords,
-        ):
-            xy = int(item['xy_index'])
-            egfp_fname = egfp_root / f"{nd2_stem}_XY{xy:03d}.tif"
-            nuc_fname  = nuc_root  / f"{nd2_stem}_XY{xy:03d}.tif"
-            # ensure arrays are numpy
-            egfp_arr = np.asarray(item['egfp_mip'])
-            nuc_arr = np.asarray(item['nuc_mip'])
-            tiff.imwrite(str(egfp_fname), egfp_arr, photometric="minisblack")
-            tiff.imwrite(str(nuc_fname),  nuc_arr,  photometric="minisblack")
-    print('[generate] Done. Wrote flat layout under results/egfp and results/nuc')
+        wanted = only.get(nd2_path.resolve()) if only is not None else None
+        if only is not None and not wanted:
+            continue
+        if manifest is None:
+            plans.append((nd2_path, None, None))
+            continue
+        rec.set_unit(nd2_path.stem)
+        with rec.stage('plan'):
+            ident, stale = plan_positions(manifest, nd2_path, settings, cfg.execution.hash_sources, n_positions)
+        if not cfg.execution.incremental:
+            stale = list(range(manifest.sources[ident['path']]['n_positions']))
+        if wanted is not None:
+            stale = [p for p in stale if p in wanted]
+        if catalog is not None:
+            skipped = set(wanted if wanted is not None else range(manifest.sources[ident['path']]['n_positions']))
+            _catalog_up_to_date(catalog, manifest, nd2_path, sorted(skipped - set(stale)))
+        if merged is not None and stale:
+            n_pos = manifest.sources[ident['path']]['n_positions']
+            not_merged = set(merged.stale_positions(nd2_path.stem, n_pos, ident, settings))
+            stale = [p for p in stale if p in not_merged]
+        if not stale:
+            print(f"[generate] {nd2_path.name} is up to date; skipping")
+            continue
+        plans.append((nd2_path, ident, stale))
+
+    tiff_opts = cfg.output.tiff_options
+    failed = []  # positions whose frames could not be read; retried by the next run
+    qc_rows = []  # per-position QC metrics, upserted into qc.csv as files complete
+
+    # Optional Zarr backend: all positions go into chunked stores instead of flat TIFFs
+    store = None
+    if cfg.output.backend == 'zarr':
+        from microglia_pipeline.zarr_store import open_projection_store
+        store = open_projection_store(out_root, cfg.output)
+
+    workers = resolve_workers(cfg.execution.workers)
+    if workers > 1:
+        units = []
+        for nd2_path, _, positions in plans:
+            if positions is None:
+                units.extend(list_work_units([nd2_path], n_positions))
+            else:
+                units.extend(WorkUnit(nd2_path, p) for p in positions)
+        idents = {nd2_path: ident for nd2_path, ident, _ in plans}
+        print(f"[generate] {len(units)} positions from {len(plans)} file(s) on {workers} workers")
+        # Memory budget: admit positions while their estimated peak bytes fit, so concurrency
+        # drops for huge positions instead of the pool running out of RAM
+        budget = int(float(cfg.execution.memory_budget_mb) * 1e6)
+        stats = BudgetStats(budget, workers) if budget else None
+        results = (run_units_budgeted(units, cfg, workers, _unit_estimator(cfg, catalog), budget, stats)
+                   if budget else run_units(units, cfg, workers))
+        done = {}  # nd2_path -> catalog rows, recorded once the store is closed
+        pending = []  # Zarr positions whose chunks may still be buffered in the store
+
+        def commit():
+            for args in pending:
+                manifest.record(*args)
+            pending.clear()
+
+        try:
+            for unit, res in zip(units, results):
+                if 'instrument' in res:
+                    rec.merge(res['instrument'])
+                rec.set_unit(unit.nd2_path.stem, unit.xy_index)
+                if 'error' in res:
+                    _record_failure(manifest, unit.nd2_path, unit.xy_index, idents[unit.nd2_path], res['error'],
+                                    failed)
+                    done.setdefault(unit.nd2_path, []).append((unit.xy_index, 'failed', []))
+                    continue
+                if store is not None:
+                    if manifest is not None and pending and pending[-1][0] != unit.nd2_path.stem:
+                        store.flush()
+                        commit()
+                    with rec.stage('write'):
+                        paths = store.write(unit.nd2_path.stem, unit.xy_index, res['n_positions'],
+                                            res['projections'])
+                else:
+                    paths = res['paths']
+                print(f"[generate] {res['nd2']} XY{res['xy_index']:03d} -> {len(paths)} file(s)")
+                if 'qc' in res:
+                    qc_rows.append(dict(nd2=unit.nd2_path.stem, xy_index=unit.xy_index, **res['qc']))
+                if manifest is not None:
+                    args = (unit.nd2_path.stem, unit.xy_index, idents[unit.nd2_path], settings, paths)
+                    if store is not None:
+                        pending.append(args)
+                    else:
+                        manifest.record(*args)  # the worker has already written (and renamed) the TIFFs
+                done.setdefault(unit.nd2_path, []).append((unit.xy_index, 'done', paths))
+        finally:
+            try:
+                if store is not None:
+                    store.close()
+                    if manifest is not None:
+                        commit()
+            finally:
+                if manifest is not None:
+                    manifest.save()
+                if catalog is not None:
+                    for nd2_path, rows in done.items():
+                        catalog.record_positions(nd2_path, rows)
+                write_qc_table(out_root, qc_rows, qc_name)
+                if stats is not None and stats.units:
+                    print(f"[generate] {stats.summary()}")
+        return _finish(cfg, out_root, failed)
+
+    # writes of position N overlap the projection of position N+1
+    with open_writer(cfg.execution.write_queue) as writer:
+        for nd2_path, ident, positions in plans:
+            nd2_stem = nd2_path.stem
+            dest = store.store_path(nd2_stem) if store is not None else f"{egfp_root} / {nuc_root}"
+            print(f"[generate] Processing {nd2_path.name} -> {dest}")
+            done = []
+            pending = []  # Zarr positions, recorded once the store is flushed
+
+            def on_error(xy, err, nd2_path=nd2_path, ident=ident, done=done):
+                _record_failure(manifest, nd2_path, xy, ident, err, failed)
+                done.append((xy, 'failed', []))
+
+            for item in read_positions(
+                nd2_path,
+                cfg.channels.egfp_keywords,
+                cfg.channels.nuc_keywords,
+                mode=cfg.preprocessing.mode,
+                z_chunk=cfg.preprocessing.z_chunk,
+                reader=cfg.preprocessing.reader,
+                reductions=cfg.preprocessing.reductions,
+                positions=positions,
+                on_error=on_error,
+                qc=cfg.qc.options,
+                tile=cfg.preprocessing.tile,
+            ):
+                xy = int(item['xy_index'])
+                if 'qc' in item:
+                    qc_rows.append(dict(nd2=nd2_stem, xy_index=xy, **item['qc']))
+                if 'tiles' in item:
+                    # huge frames: tiles are projected and written straight into tiled TIFFs
+                    try:
+                        paths = save_flat_tiles(out_root, nd2_stem, xy, item['shape'], item['tiles'], item['tile'],
+                                                tiff_opts=tiff_opts)
+                    except ND2ReadError as e:
+                        on_error(xy, e)
+                        continue
+                elif store is not None:
+                    n_pos = item['meta']['sizes'].get('P', 1)
+                    if writer is not None:
+                        writer.submit(_timed_store_write, store, nd2_stem, xy, n_pos, item['projections'])
+                    else:
+                        _timed_store_write(store, nd2_stem, xy, n_pos, item['projections'])
+                    paths = store.position_paths(nd2_stem, xy, item['projections'])
+                else:
+                    paths = save_flat_projections(out_root, nd2_stem, xy, item['projections'], writer=writer,
+                                                  tiff_opts=tiff_opts)
+                if manifest is not None:
+                    if store is not None:
+                        pending.append((nd2_stem, xy, ident, settings, paths))
+                    elif writer is not None:
+                        # queued behind this position's TIFF writes, so it runs once they have landed
+                        writer.submit(manifest.record, nd2_stem, xy, ident, settings, paths)
+                    else:
+                        manifest.record(nd2_stem, xy, ident, settings, paths)
+                done.append((xy, 'done', paths))
+            # only record a file once its writes have landed
+            rec.set_unit(nd2_stem)
+            with rec.stage('flush'):
+                if writer is not None:
+                    writer.flush()
+                if store is not None:
+                    store.flush()
+            if manifest is not None:
+                for args in pending:
+                    manifest.record(*args)
+                manifest.save()
+            if catalog is not None:
+                catalog.record_positions(nd2_path, done)
+            write_qc_table(out_root, qc_rows, qc_name)
+            qc_rows.clear()
+    if store is not None:
+        store.close()
+    return _finish(cfg, out_root, failed)
+
+
+def _finish(cfg, out_root, failed):
+    print(f"[generate] Done. Wrote {_layout(cfg)} under {out_root}")
+    if failed:
+        print(f"[generate] {len(failed)} position(s) could not be read and were skipped; "
+              "re-run to retry them (see 'failures' in the manifest):", file=sys.stderr)
+        for nd2_path, xy, error in failed:
+            print(f"  {nd2_path.name} XY{xy:03d}: {error}", file=sys.stderr)
+    return failed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Project ND2 files into per-position MIPs.')
+    ap.add_argument('--config', type=Path, default=None, help='config YAML (default: repo config.yaml)')
+    ap.add_argument('--shard', default=None, metavar='i/N',
+                    help='process only shard i of N (1-based); run scripts/merge_shards.py afterwards')
+    args = ap.parse_args(argv)
+    if generate(args.config, args.shard):
+        sys.exit(2)
 
 
 if __name__ == '__main__':
     try:
-        generate()
+        main()
     except Exception as e:
         traceback.print_exc()
         sys.exit(1)
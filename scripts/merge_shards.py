@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import sys
+import traceback
+from microglia_pipeline.aggregate import aggregate_all
+from microglia_pipeline.catalog import Catalog, collect_nd2_paths
+from microglia_pipeline.config import load_config
+from microglia_pipeline.manifest import projection_settings
+from microglia_pipeline.sharding import merge_shards, plan_shards
+
+
+def merge(config_path=None, count=1):
+    """Verify every shard finished and merge their manifests/catalogs into the output root."""
+    repo_root = Path(__file__).resolve().parents[1]
+    cfg = load_config(config_path or repo_root / 'config.yaml')
+    out_root = Path(cfg.output_root)
+    nd2_paths = collect_nd2_paths(cfg.inputs)
+    with Catalog(out_root) as catalog:
+        plan = plan_shards(catalog, nd2_paths, count, by_file=cfg.output.backend == 'zarr')
+    summary = merge_shards(out_root, count, plan, projection_settings(cfg))
+    for s, n in summary['per_shard'].items():
+        print(f"[merge] shard {s}/{count}: {n} position(s)")
+    # refresh the experiment-level table if per-ND2 summaries were produced on several nodes
+    if any(out_root.glob('*/summary.csv')):
+        aggregate_all(out_root)
+    print(f"[merge] Done. {summary['units']} position(s) from {count} shard(s) under {out_root}")
+    return summary
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Merge the outputs of generate_projections.py --shard i/N runs.')
+    ap.add_argument('--shards', type=int, required=True, metavar='N', help='number of shards (N)')
+    ap.add_argument('--config', type=Path, default=None, help='config YAML (default: repo config.yaml)')
+    args = ap.parse_args(argv)
+    merge(args.config, args.shards)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        traceback.print_exc()
+        sys.exit(1)
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 from __future__ import annotations
 from pathlib import Path
-import sys, traceback
+import os, sys, traceback
 import tifffile as tiff
 
 # Fail-fast for napari only here
@@ -11,6 +11,9 @@ except Exception as e:
     raise ImportError("napari is required to view projections. Install it and retry.") from e
 
 from microglia_pipeline.config import load_config
+from collections import OrderedDict
+import threading
+import numpy as np
 import re
 
 
@@ -38,6 +41,118 @@ def _discover_flat(output_root: Path):
         yield stem, xy, files.get('egfp'), files.get('nuc')
 
 
+def _discover(output_root: Path):
+    """Projections listed in the generate catalog (one query, no directory walk); else _discover_flat."""
+    from microglia_pipeline.catalog import CATALOG_NAME, Catalog
+    from microglia_pipeline.preprocess import flat_mip_paths
+    if not (output_root / CATALOG_NAME).exists():
+        yield from _discover_flat(output_root)
+        return
+    with Catalog(output_root) as catalog:
+        rows = catalog.positions(status='done')
+    if not rows:
+        yield from _discover_flat(output_root)
+        return
+    for row in rows:
+        outputs = set(row['outputs'])
+        egfp, nuc = flat_mip_paths(output_root, row['stem'], row['xy'])
+        yield (row['stem'], f"{row['xy']:03d}",
+               *(p if os.path.relpath(p, output_root) in outputs else None for p in (egfp, nuc)))
+
+
+class LazyFrameStack:
+    """Array-like (N, Y, X) view over one TIFF per position, read on demand.
+
+    Only the first existing file (position first_index) is opened up front
+    (for shape/dtype). Frames are read when napari slices them and kept in a
+    small LRU cache; missing files and frames of a different shape read as
+    zeros / are cropped or padded.
+    """
+
+    def __init__(self, paths, cache_frames: int = 64):
+        self.paths = list(paths)
+        self.first_index = next((i for i, p in enumerate(self.paths) if p is not None and p.exists()), None)
+        if self.first_index is None:
+            raise FileNotFoundError("No projection files to stack.")
+        with tiff.TiffFile(self.paths[self.first_index]) as tf:
+            page = tf.pages[0]
+            frame_shape, self.dtype = tuple(page.shape), np.dtype(page.dtype)
+        self.shape = (len(self.paths),) + frame_shape
+        self.ndim = len(self.shape)
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_frames = max(1, int(cache_frames))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    def frame(self, i: int) -> np.ndarray:
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+        out = np.zeros(self.shape[1:], dtype=self.dtype)
+        path = self.paths[i]
+        if path is not None and path.exists():
+            try:
+                arr = tiff.imread(path)
+                sl = tuple(slice(0, min(a, b)) for a, b in zip(arr.shape, out.shape))
+                out[sl] = arr[sl]
+            except Exception as e:  # pragma: no cover
+                print(f"[warn] Failed to load {path}: {e}")
+        with self._lock:
+            self._cache[i] = out
+            while len(self._cache) > self._cache_frames:
+                self._cache.popitem(last=False)
+        return out
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        first, rest = (key[0], key[1:]) if key else (slice(None), ())
+        if isinstance(first, (int, np.integer)):
+            return self.frame(int(first) % self.shape[0])[rest]
+        idx = np.arange(self.shape[0])[first]
+        return np.stack([self.frame(int(i)) for i in idx])[(slice(None),) + rest]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[:]
+        return arr.astype(dtype) if dtype is not None else arr
+
+
+def view_lazy(v, out_root: Path, cache_frames: int = 64):
+    """One lazily loaded layer per channel with a slider over all (stem, xy) positions."""
+    entries = list(_discover(out_root))
+    if not entries:
+        raise FileNotFoundError(f"No projections found under {out_root}. Run generate_projections first.")
+    labels = [f"{stem}_XY_{xy}" for stem, xy, _, _ in entries]
+    for idx, name, colormap in ((2, 'EGFP_MIP', 'green'), (3, 'NUC_MIP', 'blue')):
+        paths = [e[idx] for e in entries]
+        if not any(p is not None for p in paths):
+            continue
+        stack = LazyFrameStack(paths, cache_frames=cache_frames)
+        # contrast from the first existing frame so napari never scans the whole stack
+        first = stack.frame(stack.first_index)
+        lo, hi = (float(first.min()), float(first.max())) if first.size else (0.0, 1.0)
+        v.add_image(stack, name=name, blending='additive', colormap=colormap,
+                    contrast_limits=(lo, hi if hi > lo else lo + 1))
+
+    def _show_position(event=None):
+        i = int(v.dims.current_step[0]) if v.dims.ndim else 0
+        label = labels[min(max(i, 0), len(labels) - 1)]
+        v.title = f"Microglia Projections - {label} ({i + 1}/{len(labels)})"
+        try:
+            v.text_overlay.visible = True
+            v.text_overlay.text = label
+        except AttributeError:  # pragma: no cover - older napari
+            pass
+
+    v.dims.axis_labels = ('position', 'y', 'x')
+    v.dims.events.current_step.connect(_show_position)
+    _show_position()
+    print(f"[view] {len(labels)} positions loaded lazily (cache: {cache_frames} frames per channel)")
+
+
 def view():
     repo_root = Path(__file__).resolve().parents[1]
     cfg = load_config(repo_root / 'config.yaml')
@@ -46,7 +161,11 @@ def view():
         raise FileNotFoundError(f"Output root {out_root} does not exist. Run generate_projections first.")
 
     v = napari.Viewer(title='Microglia Projections')
-    for stem, xy, egfp_path, nuc_path in _discover_flat(out_root):
+    if cfg.viewer.mode == 'lazy':
+        view_lazy(v, out_root, cache_frames=cfg.viewer.cache_frames)
+        napari.run()
+        return
+    for stem, xy, egfp_path, nuc_path in _discover(out_root):
         xy_tag = f"XY_{xy}"
         if egfp_path and egfp_path.exists():
             try:
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""Project ND2 files as the microscope writes them.
+
+Usage:
+    python scripts/watch_projections.py [--config config.yaml]
+
+Polls config.inputs every watch.poll_seconds. Once a file's size and mtime
+have been stable for watch.settle_seconds it is queued (at most
+watch.queue_size at a time, newest first) and projected with the same code
+path and output layout as generate_projections.py. Files already up to date
+in the manifest are skipped without opening them. Stop with Ctrl+C; the file
+in progress is finished first, and anything interrupted resumes on restart.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import signal
+import sys
+import threading
+import traceback
+from microglia_pipeline.config import load_config
+from microglia_pipeline.manifest import Manifest, projection_settings, source_identity
+from microglia_pipeline.preprocess import ensure_dir
+from microglia_pipeline.watch import FolderWatcher, watch
+from generate_projections import generate_from_config
+
+
+def _up_to_date(snapshot, nd2_path, settings, cfg):
+    ident = source_identity(nd2_path, cfg.execution.hash_sources)
+    n_pos = snapshot.known_positions(ident, settings)
+    return n_pos is not None and not snapshot.stale_positions(nd2_path.stem, n_pos, ident, settings)
+
+
+def serve(cfg, stop=None):
+    out_root = ensure_dir(Path(cfg.output_root))
+    settings = projection_settings(cfg)
+    # manifest as of startup: lets a large existing backlog be skipped with a stat per file
+    snapshot = Manifest(out_root) if cfg.execution.incremental else None
+
+    def handle(nd2_path):
+        if snapshot is not None and _up_to_date(snapshot, nd2_path, settings, cfg):
+            return
+        print(f"[watch] {nd2_path.name} is complete; projecting")
+        generate_from_config(cfg, nd2_paths=[nd2_path], report=f'watch_{nd2_path.stem}')
+
+    def on_error(nd2_path, err):
+        print(f"[watch] {nd2_path.name} failed: {err}; it is retried once the file changes or on restart",
+              file=sys.stderr)
+
+    status = dict(backlog=0)
+
+    def on_poll(queued, backlog):
+        # only report while ready files are held back by the bounded queue
+        if backlog != status['backlog']:
+            status['backlog'] = backlog
+            print(f"[watch] {queued} queued, {backlog} waiting")
+
+    watcher = FolderWatcher(cfg.inputs, cfg.watch.settle_seconds)
+    print(f"[watch] Watching {', '.join(cfg.inputs)} (poll {cfg.watch.poll_seconds:g}s, "
+          f"settle {cfg.watch.settle_seconds:g}s) -> {out_root}")
+    watch(watcher, handle, cfg.watch.poll_seconds, cfg.watch.queue_size, stop=stop, on_error=on_error,
+          on_poll=on_poll)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--config', type=Path, default=None, help='config YAML (default: repo config.yaml)')
+    args = ap.parse_args(argv)
+    repo_root = Path(__file__).resolve().parents[1]
+    cfg = load_config(args.config or repo_root / 'config.yaml')
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    serve(cfg, stop)
+    print("[watch] Stopped.")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        traceback.print_exc()
+        sys.exit(1)
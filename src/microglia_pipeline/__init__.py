@@ -1,4 +1,10 @@
-from . import aggregate, io_nd2, orchestrate, plugin_runner, preprocess
+"""Microglia ND2 pipeline.
+
+Submodules are imported on first attribute access, so entry points that only
+need e.g. config or io_nd2 do not pay for napari/npe2 (orchestrate,
+plugin_runner) at startup.
+"""
+import importlib
 
 __all__ = [
     "aggregate",
@@ -7,3 +13,11 @@ __all__ = [
     "plugin_runner",
     "preprocess",
 ]
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
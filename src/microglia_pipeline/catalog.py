@@ -0,0 +1,160 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import glob
+import json
+import os
+import sqlite3
+import time
+
+CATALOG_NAME = "catalog.sqlite"
+CATALOG_TIMEOUT = 60.0  # seconds to wait for another process's write lock
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path        TEXT PRIMARY KEY,   -- resolved ND2 path
+    stem        TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    sizes       TEXT NOT NULL,      -- JSON axis sizes, e.g. {"P": 12, "Z": 15, "C": 2, "Y": 1024, "X": 1024}
+    dtype       TEXT NOT NULL,
+    n_positions INTEGER NOT NULL,
+    channels    TEXT NOT NULL,      -- JSON channel names
+    egfp_index  INTEGER,
+    nuc_index   INTEGER,
+    scanned_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_stem ON files (stem);
+CREATE TABLE IF NOT EXISTS positions (
+    stem       TEXT NOT NULL,
+    xy         INTEGER NOT NULL,
+    path       TEXT NOT NULL,       -- ND2 the position came from
+    status     TEXT NOT NULL,       -- e.g. 'done'
+    outputs    TEXT NOT NULL,       -- JSON output paths relative to output_root
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (stem, xy)
+);
+CREATE INDEX IF NOT EXISTS positions_status ON positions (status);
+"""
+
+def collect_nd2_paths(inputs: List[str]) -> List[Path]:
+    """ND2 files from config.inputs (directories, files or globs), de-duplicated in order."""
+    out: List[Path] = []
+    for patt in inputs:
+        p = Path(patt)
+        if p.is_dir():
+            out.extend(sorted(p.glob("*.nd2")))
+        else:
+            matches = [Path(m) for m in glob.glob(patt, recursive=True)]
+            for m in matches:
+                if m.is_dir():
+                    out.extend(sorted(m.glob("*.nd2")))
+                elif m.suffix.lower() == ".nd2":
+                    out.append(m)
+    # de-dupe preserve order
+    seen = set(); uniq = []
+    for p in out:
+        if p not in seen:
+            uniq.append(p); seen.add(p)
+    if not uniq:
+        raise FileNotFoundError("No ND2 files found from config.inputs.")
+    return uniq
+
+class Catalog:
+    """SQLite catalog of ND2 headers and per-position outputs under output_root.
+
+    files caches each ND2's identity (size, mtime), axis sizes, dtype, channel
+    names and resolved EGFP/nuclei channel indices; describe() only opens an
+    ND2 whose size or mtime changed. positions records each (stem, xy)'s
+    status and output paths, so viewers and aggregation can list outputs
+    with one query instead of walking the output tree.
+    """
+
+    def __init__(self, output_root: Path, name: str = CATALOG_NAME):
+        self.output_root = Path(output_root)
+        self.output_root.mkdir(parents=True, exist_ok=True)
+        self.path = self.output_root / name
+        # rollback journal, not WAL: output_root may be a network filesystem shared by shard nodes
+        # and workstations, where WAL's shared-memory index does not work across hosts
+        self.db = sqlite3.connect(str(self.path), timeout=CATALOG_TIMEOUT)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=DELETE")  # also converts catalogs created in WAL mode
+        self.db.executescript(_SCHEMA)
+
+    def _file_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        out = dict(row)
+        out["sizes"] = json.loads(out["sizes"])
+        out["channels"] = json.loads(out["channels"])
+        return out
+
+    def describe(self, nd2_path: Path, egfp_keywords: Optional[List[str]] = None,
+                 nuc_keywords: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Cached header of one ND2 (re-read only when its size/mtime changed).
+
+        With keywords, egfp_index/nuc_index are resolved from the cached
+        channel names (ND2ReadError if a channel is missing).
+        """
+        path = str(Path(nd2_path).resolve())
+        st = os.stat(path)
+        row = self.db.execute("SELECT * FROM files WHERE path = ?", (path,)).fetchone()
+        fresh = row is not None and (row["size"], row["mtime_ns"]) == (st.st_size, st.st_mtime_ns)
+        if fresh:
+            info = self._file_row(row)
+        else:
+            from .io_nd2 import nd2_header
+            hdr = nd2_header(Path(path))
+            info = dict(path=path, stem=Path(path).stem, size=st.st_size, mtime_ns=st.st_mtime_ns,
+                        sizes=hdr["sizes"], dtype=hdr["dtype"], n_positions=int(hdr["sizes"].get("P", 1)),
+                        channels=hdr["ch_names"], egfp_index=None, nuc_index=None, scanned_at=time.time())
+        indices = (info["egfp_index"], info["nuc_index"])
+        if egfp_keywords is not None and nuc_keywords is not None:
+            from .io_nd2 import resolve_channels
+            info["egfp_index"], info["nuc_index"] = resolve_channels(info["channels"], egfp_keywords, nuc_keywords)
+        if not fresh or indices != (info["egfp_index"], info["nuc_index"]):
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (:path, :stem, :size, :mtime_ns, :sizes, :dtype,"
+                    " :n_positions, :channels, :egfp_index, :nuc_index, :scanned_at)",
+                    {**info, "sizes": json.dumps(info["sizes"]), "channels": json.dumps(info["channels"])},
+                )
+        return info
+
+    def files(self) -> List[Dict[str, Any]]:
+        return [self._file_row(r) for r in self.db.execute("SELECT * FROM files ORDER BY stem, path")]
+
+    def record_positions(self, nd2_path: Path, rows: Iterable[Tuple[int, str, Iterable[Path]]]) -> None:
+        """Upsert (xy, status, output paths) rows of one ND2 in a single transaction."""
+        now = time.time()
+        path = str(Path(nd2_path).resolve())
+        stem = Path(nd2_path).stem
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?)",
+                [(stem, int(xy), path, status,
+                  json.dumps([os.path.relpath(Path(f), self.output_root) for f in outputs]), now)
+                 for xy, status, outputs in rows],
+            )
+
+    def positions(self, stem: Optional[str] = None, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Position rows (stem, xy, path, status, outputs, updated_at) in (stem, xy) order."""
+        where, args = [], []
+        if stem is not None:
+            where.append("stem = ?"); args.append(stem)
+        if status is not None:
+            where.append("status = ?"); args.append(status)
+        sql = "SELECT * FROM positions" + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY stem, xy"
+        out = []
+        for r in self.db.execute(sql, args):
+            d = dict(r)
+            d["outputs"] = json.loads(d["outputs"])
+            out.append(d)
+        return out
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
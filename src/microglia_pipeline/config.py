@@ -1,9 +1,11 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, List, Optional, Union
 import yaml
 
+from .preprocess import parse_reductions, tiff_options
+
 @dataclass
 class ChannelsConfig:
     egfp_keywords: List[str] = field(default_factory=lambda: ["egfp", "gfp"])
@@ -11,7 +13,83 @@ class ChannelsConfig:
 
 @dataclass
 class PreprocConfig:
-    projection: str = "max"  # only 'max' supported
+    # one reduction or a list, computed in a single pass: max, min, mean, sum, std, p<q> (e.g. p99)
+    projection: Union[str, List[str]] = "max"
+    mode: str = "volume"     # 'volume' (whole Z stack) or 'stream' (z_chunk planes at a time)
+    z_chunk: int = 1         # planes per read in 'stream' mode
+    reader: str = "dask"     # 'dask' (f.to_dask) or 'frames' (direct frame reads)
+    tile: int = 0            # project frames larger than this one tile x tile window at a time; 0 = whole frames
+
+    @property
+    def reductions(self) -> List[str]:
+        return parse_reductions(self.projection)
+
+@dataclass
+class ExecutionConfig:
+    workers: int = 1      # 1 = serial; 0 = one worker per CPU core
+    write_queue: int = 2  # pending background TIFF writes; 0 = write synchronously
+    incremental: bool = True     # skip positions whose outputs are up to date (output_root/manifest.json)
+    hash_sources: bool = False   # include a sha256 of each ND2 in its manifest identity
+    instrument: bool = False     # per-stage timing, bytes and peak RSS; JSON report in output_root/reports
+    catalog: bool = True         # cache ND2 headers and per-position outputs in output_root/catalog.sqlite
+    memory_budget_mb: float = 0  # parallel runs: cap estimated bytes of positions in flight; 0 = no cap
+
+@dataclass
+class OutputConfig:
+    backend: str = "tiff"          # 'tiff' (flat per-position files) or 'zarr' (chunked stores)
+    zarr_scope: str = "run"        # 'run' = one store for all ND2s; 'file' = one store per ND2
+    zarr_chunk_positions: int = 4  # positions per Zarr chunk file
+    compression: str = "none"      # TIFF codec for MIPs and labels: none, zlib, deflate, zstd, lzw, lzma
+    compression_level: Optional[int] = None  # codec level (zlib/deflate 1-9, zstd 1-22); None = codec default
+    predictor: bool = True         # horizontal differencing predictor for integer images
+    labels_compression: str = "zlib"  # TIFF codec for plugin label images (stored in the smallest integer dtype)
+    shapes_format: str = "csv"     # plugin shapes: 'csv' (one row per vertex) or 'npz' (vertices + offsets)
+
+    @property
+    def tiff_options(self) -> Dict[str, Any]:
+        return tiff_options(self.compression, self.compression_level, self.predictor)
+
+    @property
+    def labels_tiff_options(self) -> Dict[str, Any]:
+        return tiff_options(self.labels_compression, None, self.predictor)
+
+@dataclass
+class ViewerConfig:
+    mode: str = "lazy"       # 'lazy' (one stacked layer per channel, frames read on demand) or 'eager'
+    cache_frames: int = 64   # frames kept in memory per channel in 'lazy' mode
+
+@dataclass
+class AggregationConfig:
+    backend: str = "csv"       # 'csv' (rewrite summary.csv) or 'parquet' (incremental features.parquet dataset)
+    export_csv: bool = False   # with 'parquet', also export <nd2_stem>/summary.csv after each update
+
+@dataclass
+class PluginConfig:
+    enabled: bool = True
+    plugin_name: str = "microglia"    # matched against installed npe2 manifest names
+    command_ids: List[str] = field(default_factory=list)  # npe2 command IDs tried first
+    manual_mode: bool = False         # save layers the user creates instead of invoking the plugin
+    headless: bool = False            # call the command on numpy arrays in worker processes, no Viewer
+
+@dataclass
+class QCConfig:
+    enabled: bool = False              # per-position QC metrics computed during projection -> output_root/qc.csv
+    saturation: Optional[float] = None  # saturation level; None = the dtype maximum
+    percentiles: List[float] = field(default_factory=lambda: [1.0, 50.0, 99.0])
+    row_step: int = 16                 # metrics use every row_step-th row (and every second column)
+
+    @property
+    def options(self) -> Optional[Dict[str, Any]]:
+        """QCAccumulator options for read_positions(qc=...), or None when disabled."""
+        if not self.enabled:
+            return None
+        return dict(saturation=self.saturation, percentiles=list(self.percentiles), row_step=self.row_step)
+
+@dataclass
+class WatchConfig:
+    poll_seconds: float = 10.0    # interval between scans of config.inputs
+    settle_seconds: float = 60.0  # a file is ready once its size and mtime have not changed for this long
+    queue_size: int = 8           # ready files queued for projection; the rest wait (newest first)
 
 @dataclass
 class Config:
@@ -19,6 +97,13 @@ class Config:
     output_root: str = "results"
     channels: ChannelsConfig = field(default_factory=ChannelsConfig)
     preprocessing: PreprocConfig = field(default_factory=PreprocConfig)
+    execution: ExecutionConfig = field(default_factory=ExecutionConfig)
+    output: OutputConfig = field(default_factory=OutputConfig)
+    viewer: ViewerConfig = field(default_factory=ViewerConfig)
+    plugin: PluginConfig = field(default_factory=PluginConfig)
+    aggregation: AggregationConfig = field(default_factory=AggregationConfig)
+    watch: WatchConfig = field(default_factory=WatchConfig)
+    qc: QCConfig = field(default_factory=QCConfig)
 
 def load_config(path: str | Path) -> Config:
     with open(path, "r") as f:
@@ -28,12 +113,72 @@ def load_config(path: str | Path) -> Config:
         output_root=data.get("output_root", "results"),
         channels=ChannelsConfig(**data.get("channels", {})),
         preprocessing=PreprocConfig(**data.get("preprocessing", {})),
+        execution=ExecutionConfig(**(data.get("execution") or {})),
+        output=OutputConfig(**(data.get("output") or {})),
+        viewer=ViewerConfig(**(data.get("viewer") or {})),
+        plugin=PluginConfig(**(data.get("plugin") or {})),
+        aggregation=AggregationConfig(**(data.get("aggregation") or {})),
+        watch=WatchConfig(**(data.get("watch") or {})),
+        qc=QCConfig(**(data.get("qc") or {})),
     )
     # Fail-fast validation
     if not cfg.inputs:
         raise ValueError("config.inputs is required and cannot be empty.")
-    if cfg.preprocessing.projection.lower() != "max":
-        raise ValueError("Only 'max' projection is supported.")
+    try:
+        parse_reductions(cfg.preprocessing.projection)
+    except ValueError as e:
+        raise ValueError(f"preprocessing.projection: {e}") from e
+    if cfg.preprocessing.mode not in ("volume", "stream"):
+        raise ValueError("preprocessing.mode must be 'volume' or 'stream'.")
+    if cfg.preprocessing.reader not in ("dask", "frames"):
+        raise ValueError("preprocessing.reader must be 'dask' or 'frames'.")
+    if int(cfg.preprocessing.z_chunk) < 1:
+        raise ValueError("preprocessing.z_chunk must be >= 1.")
+    if int(cfg.preprocessing.tile) < 0 or int(cfg.preprocessing.tile) % 16:
+        raise ValueError("preprocessing.tile must be 0 (whole frames) or a positive multiple of 16.")
+    if int(cfg.execution.workers) < 0:
+        raise ValueError("execution.workers must be >= 0 (0 = all CPU cores).")
+    if int(cfg.execution.write_queue) < 0:
+        raise ValueError("execution.write_queue must be >= 0 (0 = synchronous writes).")
+    if float(cfg.execution.memory_budget_mb) < 0:
+        raise ValueError("execution.memory_budget_mb must be >= 0 (0 = no budget).")
+    if cfg.output.backend not in ("tiff", "zarr"):
+        raise ValueError("output.backend must be 'tiff' or 'zarr'.")
+    if cfg.output.zarr_scope not in ("run", "file"):
+        raise ValueError("output.zarr_scope must be 'run' or 'file'.")
+    if int(cfg.output.zarr_chunk_positions) < 1:
+        raise ValueError("output.zarr_chunk_positions must be >= 1.")
+    try:
+        tiff_options(cfg.output.compression, cfg.output.compression_level, cfg.output.predictor)
+    except ValueError as e:
+        raise ValueError(f"output.compression: {e}") from e
+    try:
+        tiff_options(cfg.output.labels_compression)
+    except ValueError as e:
+        raise ValueError(f"output.labels_compression: {e}") from e
+    if cfg.output.shapes_format not in ("csv", "npz"):
+        raise ValueError("output.shapes_format must be 'csv' or 'npz'.")
+    if cfg.viewer.mode not in ("lazy", "eager"):
+        raise ValueError("viewer.mode must be 'lazy' or 'eager'.")
+    if cfg.aggregation.backend not in ("csv", "parquet"):
+        raise ValueError("aggregation.backend must be 'csv' or 'parquet'.")
+    if cfg.plugin.headless and cfg.plugin.manual_mode:
+        raise ValueError("plugin.headless and plugin.manual_mode are mutually exclusive (manual mode needs a Viewer).")
+    if float(cfg.watch.poll_seconds) <= 0 or float(cfg.watch.settle_seconds) < 0:
+        raise ValueError("watch.poll_seconds must be > 0 and watch.settle_seconds >= 0.")
+    if int(cfg.watch.queue_size) < 1:
+        raise ValueError("watch.queue_size must be >= 1.")
+    if int(cfg.qc.row_step) < 1:
+        raise ValueError("qc.row_step must be >= 1.")
+    if any(not 0 <= float(q) <= 100 for q in cfg.qc.percentiles):
+        raise ValueError("qc.percentiles must be within [0, 100].")
+    if int(cfg.preprocessing.tile):
+        if cfg.preprocessing.reader != "frames":
+            raise ValueError("preprocessing.tile needs preprocessing.reader: 'frames'.")
+        if cfg.output.backend != "tiff":
+            raise ValueError("preprocessing.tile writes tiled TIFFs; it needs output.backend: 'tiff'.")
+        if cfg.qc.enabled:
+            raise ValueError("qc.enabled is not supported with preprocessing.tile.")
     if not cfg.channels.egfp_keywords:
         raise ValueError("channels.egfp_keywords must be a non-empty list.")
     if not cfg.channels.nuc_keywords:
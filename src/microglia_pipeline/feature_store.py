@@ -0,0 +1,126 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import json
+import os
+import pandas as pd
+
+# Optional backend: only imported when aggregation.backend is 'parquet'
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+except Exception as e:
+    raise ImportError("aggregation.backend 'parquet' requires the 'pyarrow' package. Install it before running.") from e
+
+DATASET_NAME = "features.parquet"
+INDEX_NAME = "_index.json"
+FEATURE_FILES = ("features.csv", "features_global.csv")  # same precedence as aggregate_per_nd2
+
+class FeatureStore:
+    """Per-position features in a Parquet dataset partitioned by ND2 file.
+
+    Layout: <output_root>/features.parquet/nd2=<stem>/<xy_dir>.parquet, one
+    small file per position with leading 'nd2' and 'xy_dir' columns (as in
+    summary.csv). An index maps each position to the (size, mtime) of the
+    per-XY CSV it came from, so update() only converts new or changed CSVs
+    and a rerun over an unchanged experiment only stats files.
+    """
+
+    def __init__(self, output_root: Path, compression: str = "zstd"):
+        self.output_root = Path(output_root)
+        self.root = self.output_root / DATASET_NAME
+        self.compression = compression
+        self.index_path = self.root / INDEX_NAME
+        self.index: Dict[str, Dict[str, List[int]]] = {}
+        if self.index_path.exists():
+            try:
+                self.index = json.loads(self.index_path.read_text())
+            except ValueError:
+                self.index = {}
+
+    def part_path(self, nd2_stem: str, xy_dir: str) -> Path:
+        return self.root / f"nd2={nd2_stem}" / f"{xy_dir}.parquet"
+
+    def put(self, nd2_stem: str, xy_dir: str, features: Any, source: Optional[List[int]] = None) -> Path:
+        """Write (replace) one position's feature rows."""
+        df = pd.DataFrame(features).copy()
+        for col in ("nd2", "xy_dir"):
+            if col in df.columns:
+                df = df.drop(columns=col)
+        df.insert(0, "nd2", nd2_stem)
+        df.insert(1, "xy_dir", xy_dir)
+        path = self.part_path(nd2_stem, xy_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".parquet.tmp")
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression=self.compression)
+        os.replace(tmp, path)
+        self.index.setdefault(nd2_stem, {})[xy_dir] = list(source) if source is not None else []
+        return path
+
+    def remove(self, nd2_stem: str, xy_dir: str) -> None:
+        self.part_path(nd2_stem, xy_dir).unlink(missing_ok=True)
+        self.index.get(nd2_stem, {}).pop(xy_dir, None)
+
+    def update(self, nd2_stem: str) -> List[str]:
+        """Ingest new or changed per-XY feature CSVs of one ND2; returns the positions rewritten."""
+        nd2_dir = self.output_root / nd2_stem
+        known = dict(self.index.get(nd2_stem, {}))
+        changed: List[str] = []
+        for xy_dir in sorted(nd2_dir.glob("XY_*")):
+            src = next((xy_dir / n for n in FEATURE_FILES if (xy_dir / n).exists()), None)
+            if src is None:
+                continue
+            st = src.stat()
+            sig = [st.st_size, st.st_mtime_ns]
+            if known.pop(xy_dir.name, None) == sig and self.part_path(nd2_stem, xy_dir.name).exists():
+                continue
+            self.put(nd2_stem, xy_dir.name, pd.read_csv(src), source=sig)
+            changed.append(xy_dir.name)
+        # positions whose CSV disappeared; rows added via put() without a source are kept
+        for xy_name, sig in known.items():
+            if sig:
+                self.remove(nd2_stem, xy_name)
+                changed.append(xy_name)
+        self.save()
+        return changed
+
+    def save(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.index, indent=1, sort_keys=True))
+        os.replace(tmp, self.index_path)
+
+    def read(self, nd2_stem: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Summary table of one ND2 (or every ND2) in (nd2, xy_dir) order.
+
+        Positions may carry different feature columns; missing values are null.
+        Column types are unified across positions (e.g. int64 with float64 ->
+        float64); columns that cannot be (numbers vs text) fall back to
+        pandas' object columns, as the CSV aggregation does.
+        """
+        stems = [nd2_stem] if nd2_stem is not None else sorted(self.index)
+        tables = []
+        for stem in stems:
+            for xy_name in sorted(self.index.get(stem, {})):
+                path = self.part_path(stem, xy_name)
+                if path.exists():
+                    tables.append(pq.read_table(path, columns=columns))
+        if not tables:
+            return pd.DataFrame(columns=columns or ["nd2", "xy_dir"])
+        try:
+            return pa.concat_tables(tables, promote_options="permissive").to_pandas()
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            return pd.concat([t.to_pandas() for t in tables], ignore_index=True)
+
+    def export_csv(self, nd2_stem: Optional[str] = None, out_path: Optional[Path] = None) -> Optional[Path]:
+        """Write summary.csv like aggregate_per_nd2 (one ND2) or aggregate_all (all ND2s)."""
+        df = self.read(nd2_stem)
+        if df.empty:
+            return None
+        if nd2_stem is None:
+            df.insert(0, "nd2_folder", df["nd2"])
+            out_path = out_path or self.output_root / "summary.csv"
+        else:
+            out_path = out_path or self.output_root / nd2_stem / "summary.csv"
+        df.to_csv(out_path, index=False)
+        return out_path
@@ -0,0 +1,144 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from .plugin_runner import get_resolver, save_features, save_labels_layer, save_shapes_layer
+
+# parameters that only make sense with a live napari Viewer
+_VIEWER_ARGS = ("viewer", "napari_viewer")
+
+def collect_outputs(result: Any) -> Dict[str, Any]:
+    """Normalize a plugin callable's return value into labels / shapes / features.
+
+    Accepts napari LayerDataTuples ((data, meta, layer_type) or a list of
+    them), a dict with 'labels'/'shapes'/'features' keys, an integer ndarray
+    (labels) or a DataFrame (features). Missing outputs are omitted.
+    """
+    out: Dict[str, Any] = {}
+    if result is None:
+        return out
+    if isinstance(result, dict):
+        return {k: result[k] for k in ("labels", "shapes", "features") if result.get(k) is not None}
+    if isinstance(result, pd.DataFrame):
+        return dict(features=result)
+    if isinstance(result, np.ndarray):
+        return dict(labels=result) if result.dtype.kind in "iub" else out
+    items = [result] if isinstance(result, tuple) and len(result) in (2, 3) and isinstance(result[1], dict) \
+        else list(result)
+    for item in items:
+        if not (isinstance(item, tuple) and item):
+            continue
+        data = item[0]
+        meta = item[1] if len(item) > 1 and isinstance(item[1], dict) else {}
+        kind = str(item[2]).lower() if len(item) > 2 else ("labels" if np.asarray(data).dtype.kind in "iub" else "")
+        if kind in ("labels", "shapes"):
+            out[kind] = data
+        feats = meta.get("features", meta.get("properties"))
+        if feats is not None and len(feats):
+            out["features"] = feats
+    return out
+
+def save_outputs(outputs: Dict[str, Any], out_dir: Path, tiff_opts: Optional[Dict[str, Any]] = None,
+                 shapes_format: str = "csv") -> List[Path]:
+    """Write collected outputs with the same file names as save_plugin_outputs."""
+    paths: List[Path] = []
+    feats = outputs.get("features")
+    feats = pd.DataFrame(feats) if feats is not None else None
+    if outputs.get("labels") is not None:
+        save_labels_layer(SimpleNamespace(data=np.asarray(outputs["labels"])), out_dir / "segmentation_labels.tif",
+                          tiff_opts=tiff_opts)
+        paths.append(out_dir / "segmentation_labels.tif")
+    if outputs.get("shapes") is not None:
+        shapes_path = out_dir / f"shapes.{shapes_format}"
+        save_shapes_layer(SimpleNamespace(data=outputs["shapes"], features=feats), shapes_path, fmt=shapes_format)
+        paths.append(shapes_path)
+    if feats is not None and len(feats):
+        save_features(feats, out_dir / "features.csv")
+        paths.append(out_dir / "features.csv")
+    return paths
+
+def run_plugin_headless(
+    egfp: np.ndarray,
+    nuc: Optional[np.ndarray],
+    out_dir: Path,
+    plugin_name: str,
+    preferred_command_ids: Optional[List[str]] = None,
+    tiff_opts: Optional[Dict[str, Any]] = None,
+    shapes_format: str = "csv",
+) -> Dict[str, Any]:
+    """Call the plugin's command callable on plain arrays and save what it returns.
+
+    Commands are tried in PluginResolver order; those whose callable requires
+    a napari viewer are skipped. Fails fast when no command returns label,
+    shape or feature data.
+    """
+    resolver = get_resolver(plugin_name, preferred_command_ids)
+    ordered = resolver.ordered()
+    base_kwargs = {"image": egfp, "nuclei": nuc, "output_dir": str(out_dir)}
+
+    errors: List[str] = []
+    for cid in ordered:
+        try:
+            rc = resolver.resolve(cid)
+        except Exception as e:
+            errors.append(f"{cid}: {e}")
+            continue
+        if rc.required & set(_VIEWER_ARGS):
+            errors.append(f"{cid}: requires a napari viewer")
+            continue
+        call_kwargs = {param: base_kwargs[src] for param, src in rc.arg_map if src in base_kwargs}
+        try:
+            outputs = collect_outputs(rc.func(**call_kwargs))
+        except Exception as e:
+            resolver.drop(cid)
+            errors.append(f"{cid}: execution error - {e}")
+            continue
+        if outputs:
+            resolver.last_good = cid
+            return dict(xy_dir=out_dir, command=cid, paths=save_outputs(outputs, out_dir, tiff_opts, shapes_format))
+        resolver.drop(cid)
+        errors.append(f"{cid}: returned no label, shape or feature data")
+
+    raise RuntimeError(
+        f"Failed to run any npe2 command for plugin '{plugin_name}' headlessly. "
+        f"Tried: {', '.join(ordered)}. Errors: {'; '.join(errors)}"
+    )
+
+def _run_job(job: Tuple[Path, np.ndarray, np.ndarray], plugin_name: str, command_ids: List[str],
+             tiff_opts: Optional[Dict[str, Any]], shapes_format: str) -> Dict[str, Any]:
+    xy_dir, egfp, nuc = job
+    return run_plugin_headless(egfp, nuc, xy_dir, plugin_name, command_ids, tiff_opts, shapes_format)
+
+def run_plugin_batch(
+    jobs: Iterable[Tuple[Path, np.ndarray, np.ndarray]],
+    plugin_name: str,
+    preferred_command_ids: Optional[List[str]] = None,
+    tiff_opts: Optional[Dict[str, Any]] = None,
+    workers: int = 1,
+    max_pending: int = 2,
+    shapes_format: str = "csv",
+) -> Iterator[Dict[str, Any]]:
+    """Run (xy_dir, egfp, nuc) jobs on a process pool; results are yielded in job order.
+
+    Jobs are pulled lazily and at most workers + max_pending are in flight,
+    so a generator that projects positions overlaps with segmentation
+    without holding every MIP in memory. Each worker discovers plugins once.
+    """
+    command_ids = list(preferred_command_ids or [])
+    if workers <= 1:
+        for job in jobs:
+            yield _run_job(job, plugin_name, command_ids, tiff_opts, shapes_format)
+        return
+    pending: Deque = deque()
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for job in jobs:
+            pending.append(ex.submit(_run_job, job, plugin_name, command_ids, tiff_opts, shapes_format))
+            if len(pending) >= workers + max(0, int(max_pending)):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
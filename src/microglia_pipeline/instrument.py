@@ -0,0 +1,232 @@
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is reported as None
+    resource = None  # type: ignore[assignment]
+
+Key = Tuple[str, Optional[int]]  # (nd2 stem, xy index or None for file-level work)
+
+_NULL = nullcontext()
+
+def peak_rss_mb() -> Optional[float]:
+    """High-water resident set size of this process in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / 1e6 if sys.platform == "darwin" else peak * 1024 / 1e6
+
+def _empty_unit() -> Dict[str, Any]:
+    return dict(stages={}, bytes_read=0, bytes_written=0, rss_growth_mb=None)
+
+class _Stage:
+    """Times one stage; nested stages are subtracted so stage times never double count."""
+
+    __slots__ = ("rec", "name", "t0", "child")
+
+    def __init__(self, rec: "Recorder", name: str):
+        self.rec, self.name = rec, name
+
+    def __enter__(self) -> "_Stage":
+        self.child = 0.0
+        self.rec._stack().append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.t0
+        stack = self.rec._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child += elapsed
+        self.rec.add_time(self.name, elapsed - self.child)
+
+class Recorder:
+    """Per-(file, position) wall time per stage, bytes read/written and RSS growth.
+
+    The current unit is thread-local: set_unit() attributes every following
+    stage() and add() on that thread to (stem, xy). Callables handed to a
+    background thread keep their submitter's unit via bind().
+    rss_growth_mb is how much the process peak RSS rose while the unit was
+    current: 0 when the unit fit in memory the process had already used,
+    so it points at the positions that drove the peak rather than giving
+    each position's own footprint.
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.units: Dict[Key, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started = datetime.now()
+        self._t0 = time.perf_counter()
+
+    def _stack(self) -> List[_Stage]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _unit(self, key: Optional[Key] = None) -> Dict[str, Any]:
+        key = key if key is not None else getattr(self._local, "key", None) or ("<run>", None)
+        unit = self.units.get(key)
+        if unit is None:
+            unit = self.units.setdefault(key, _empty_unit())
+        return unit
+
+    def set_unit(self, stem: str, xy: Optional[int] = None) -> None:
+        """Attribute this thread's following measurements to (stem, xy)."""
+        self._sample_rss()
+        self._local.key = (stem, None if xy is None else int(xy))
+        self._local.rss0 = peak_rss_mb()
+
+    def _sample_rss(self) -> None:
+        key = getattr(self._local, "key", None)
+        rss0 = getattr(self._local, "rss0", None)
+        if key is not None and rss0 is not None:
+            now = peak_rss_mb()
+            self._local.rss0 = now  # later samples only add further growth
+            with self._lock:
+                unit = self._unit(key)
+                unit["rss_growth_mb"] = (unit["rss_growth_mb"] or 0.0) + (now - rss0)
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stages = self._unit()["stages"]
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    def add(self, counter: str, n: int) -> None:
+        """Increment 'bytes_read' or 'bytes_written' of the current unit."""
+        with self._lock:
+            unit = self._unit()
+            unit[counter] = unit.get(counter, 0) + int(n)
+
+    def bind(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Wrap fn so it records into the calling thread's current unit wherever it runs."""
+        key = getattr(self._local, "key", None)
+
+        def bound(*args: Any, **kwargs: Any) -> Any:
+            prev = getattr(self._local, "key", None)
+            self._local.key = key
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.key = prev
+        return bound
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Picklable unit records (e.g. returned from worker processes to merge())."""
+        self._sample_rss()
+        with self._lock:
+            return [dict(stem=k[0], xy=k[1], **v) for k, v in self.units.items()]
+
+    def merge(self, records: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            for rec in records:
+                unit = self._unit((rec["stem"], rec["xy"]))
+                for name, secs in rec["stages"].items():
+                    unit["stages"][name] = unit["stages"].get(name, 0.0) + secs
+                unit["bytes_read"] += rec["bytes_read"]
+                unit["bytes_written"] += rec["bytes_written"]
+                growth = [g for g in (unit["rss_growth_mb"], rec["rss_growth_mb"]) if g is not None]
+                unit["rss_growth_mb"] = sum(growth) if growth else None
+
+    def report(self, entry: str) -> Dict[str, Any]:
+        """Run report: totals, per-file rollups and per-position records."""
+        units = self.snapshot()
+        totals = dict(_empty_unit(), peak_rss_mb=peak_rss_mb())
+        files: Dict[str, Dict[str, Any]] = {}
+        for u in units:
+            for target in (totals, files.setdefault(u["stem"], dict(_empty_unit(), positions=0))):
+                for name, secs in u["stages"].items():
+                    target["stages"][name] = target["stages"].get(name, 0.0) + secs
+                target["bytes_read"] += u["bytes_read"]
+                target["bytes_written"] += u["bytes_written"]
+                if u["rss_growth_mb"] is not None:
+                    target["rss_growth_mb"] = (target["rss_growth_mb"] or 0.0) + u["rss_growth_mb"]
+            if u["xy"] is not None:
+                files[u["stem"]]["positions"] += 1
+        return dict(
+            version=1,
+            entry=entry,
+            started=self._started.isoformat(timespec="seconds"),
+            wall_seconds=time.perf_counter() - self._t0,
+            totals=totals,
+            files=files,
+            positions=[u for u in units if u["xy"] is not None],
+        )
+
+    def write_report(self, out_root: Path, entry: str) -> Path:
+        """Write <out_root>/reports/<entry>_<timestamp>.json and print a short summary."""
+        report = self.report(entry)
+        out_dir = Path(out_root) / "reports"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / f"{entry}_{self._started:%Y%m%d-%H%M%S}.json"
+        path.write_text(json.dumps(report, indent=1))
+        print(summarize(report))
+        print(f"[{entry}] run report: {path}")
+        return path
+
+class NullRecorder(Recorder):
+    """Disabled recorder: every hook is a constant-time no-op."""
+
+    enabled = False
+
+    def set_unit(self, stem: str, xy: Optional[int] = None) -> None:
+        pass
+
+    def stage(self, name: str):  # type: ignore[override]
+        return _NULL
+
+    def add_time(self, name: str, seconds: float) -> None:
+        pass
+
+    def add(self, counter: str, n: int) -> None:
+        pass
+
+    def bind(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        return fn
+
+NULL_RECORDER = NullRecorder()
+_current: Recorder = NULL_RECORDER
+
+def current() -> Recorder:
+    """The active recorder (NULL_RECORDER unless inside activate())."""
+    return _current
+
+@contextmanager
+def activate(recorder: Optional[Recorder]) -> Iterator[Recorder]:
+    """Make recorder the process-wide active recorder for the duration of the block."""
+    global _current
+    prev, _current = _current, recorder or NULL_RECORDER
+    try:
+        yield _current
+    finally:
+        _current = prev
+
+def summarize(report: Dict[str, Any], top: int = 3) -> str:
+    """Console summary: stage totals and the slowest files."""
+    tot = report["totals"]
+    busy = sum(tot["stages"].values()) or 1.0
+    lines = [f"[{report['entry']}] {report['wall_seconds']:.1f}s wall, "
+             f"{tot['bytes_read'] / 1e6:.1f} MB read, {tot['bytes_written'] / 1e6:.1f} MB written, "
+             f"peak RSS {tot['peak_rss_mb'] or 0:.0f} MB"]
+    for name, secs in sorted(tot["stages"].items(), key=lambda kv: -kv[1]):
+        lines.append(f"  {name:<10} {secs:9.2f}s  {100 * secs / busy:5.1f}%")
+    slow = sorted(report["files"].items(), key=lambda kv: -sum(kv[1]["stages"].values()))[:top]
+    for stem, f in slow:
+        lines.append(f"  {stem}: {sum(f['stages'].values()):.2f}s over {f['positions']} position(s)")
+    return "\n".join(lines)
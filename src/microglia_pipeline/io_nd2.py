@@ -1,6 +1,7 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Iterator, Dict, Any, List
+from typing import Callable, Iterator, Dict, Any, List, Optional, Sequence
+import itertools
 import numpy as np
 
 # Fail-fast: require the modern 'nd2' library only
@@ -9,7 +10,9 @@ try:
 except Exception as e:
     raise ImportError("The 'nd2' package is required (tlambert03/nd2). Install it before running.") from e
 
-from .preprocess import max_proj
+from . import instrument
+from .preprocess import ZProjector, parse_reductions, project_z
+from .qc import QCAccumulator, observe
 
 class ND2ReadError(RuntimeError):
     ...
@@ -22,17 +25,210 @@ def _find_channel_index(ch_names: List[str], keywords: List[str]) -> int:
                 return i
     raise ND2ReadError(f"Required channel with keywords {keywords} not found in channels {ch_names}.")
 
+def _iter_z_chunks(read_block: Callable[[int, int], np.ndarray], n_z: int, step: int) -> Iterator[np.ndarray]:
+    for z0 in range(0, n_z, step):
+        yield read_block(z0, min(z0 + step, n_z))
+
+def _array_block_reader(sub, zdim: int, compute: bool) -> Callable[[int, int], np.ndarray]:
+    """Z-slab reader over a (dask or numpy) position array."""
+    def read_block(z0: int, z1: int) -> np.ndarray:
+        sl = [slice(None)] * sub.ndim
+        sl[zdim] = slice(z0, z1)
+        block = sub[tuple(sl)]
+        # materialize if dask; nd2 serializes frame reads behind a file lock, so the
+        # synchronous scheduler loses nothing and keeps pool workers single-threaded
+        if compute:
+            block = block.compute(scheduler="synchronous")
+        return np.asarray(block)
+    return read_block
+
+def _frame_block_reader(f, sizes: Dict[str, int], p: int, sel_channels: List[int],
+                        window: Optional[tuple] = None) -> Callable[[int, int], np.ndarray]:
+    """Z-slab reader mapping (P, Z, ...) coordinates straight to f.read_frame.
+
+    Each frame holds every channel as (C, Y, X); only the selected channel planes
+    (restricted to the (y slice, x slice) window when given) are copied out of
+    the memory-mapped frame. No dask graph is built.
+    """
+    axes = tuple(sizes.keys())
+    coord_axes = axes[:-3]
+    coord_shape = tuple(sizes[ax] for ax in coord_axes)
+    dtype = f.dtype
+    ys, xs = window if window is not None else (slice(None), slice(None))
+    ny = len(range(*ys.indices(sizes["Y"])))
+    nx = len(range(*xs.indices(sizes["X"])))
+
+    def read_block(z0: int, z1: int) -> np.ndarray:
+        ranges = []
+        for ax in coord_axes:
+            if ax == "P":
+                ranges.append(range(p, p + 1))
+            elif ax == "Z":
+                ranges.append(range(z0, z1))
+            else:
+                ranges.append(range(sizes[ax]))
+        lead = [len(r) for ax, r in zip(coord_axes, ranges) if ax != "P"]
+        out = np.empty(lead + [len(sel_channels), ny, nx], dtype=dtype)
+        for out_idx, coords in zip(np.ndindex(*lead), itertools.product(*ranges)):
+            frame = f.read_frame(int(np.ravel_multi_index(coords, coord_shape)))
+            for k, c in enumerate(sel_channels):
+                out[out_idx + (k,)] = frame[c, ys, xs]
+        return out
+    return read_block
+
+def _timed_reader(rec: instrument.Recorder, read_block: Callable[[int, int], np.ndarray]) -> Callable[[int, int], np.ndarray]:
+    def timed(z0: int, z1: int) -> np.ndarray:
+        with rec.stage("read"):
+            block = read_block(z0, z1)
+        rec.add("bytes_read", block.nbytes)
+        return block
+    return timed
+
+def _split_channels(reduced: Dict[str, np.ndarray], cdim: int) -> Dict[str, tuple]:
+    """reduction -> (egfp, nuc) views of each Z-reduced (EGFP, nuclei) array; no per-channel copies."""
+    projections = {}
+    for name, arr in reduced.items():
+        sl = [slice(None)] * arr.ndim
+        sl[cdim] = 0
+        egfp = arr[tuple(sl)]
+        sl[cdim] = 1
+        projections[name] = (egfp, arr[tuple(sl)])
+    return projections
+
+def _is_compressed(f) -> bool:
+    """True when f's frames are zlib-compressed, i.e. every read_frame decodes the whole frame."""
+    attrs = getattr(f, "attributes", None)
+    return getattr(attrs, "compressionType", None) == "lossless"
+
+def _tile_windows(sizes: Dict[str, int], tile: int) -> List[tuple]:
+    """((y0, x0), (y slice, x slice)) of every tile x tile window, in row-major order."""
+    n_y, n_x = sizes["Y"], sizes["X"]
+    return [((y0, x0), (slice(y0, min(y0 + tile, n_y)), slice(x0, min(x0 + tile, n_x))))
+            for y0 in range(0, n_y, tile) for x0 in range(0, n_x, tile)]
+
+def _iter_tiles(f, nd2_path: Path, sizes: Dict[str, int], p: int, sel_channels: List[int], tile: int,
+                step: int, reductions: List[str], dtype, zdim: int, cdim: int,
+                rec: instrument.Recorder) -> Iterator[tuple]:
+    """((y0, x0), {reduction: (egfp, nuc)}) per tile x tile window of position p, in row-major order.
+
+    Uncompressed frames are memory-mapped, so each tile's Z column is cut from
+    them directly and memory follows the tile size. Compressed frames are
+    decoded whole on every read, so each Z chunk is read once and folded into
+    one ZProjector per tile instead; the accumulators then cover the frame.
+    """
+    n_z = sizes["Z"]
+    windows = _tile_windows(sizes, tile)
+    if _is_compressed(f):
+        read_block = _frame_block_reader(f, sizes, p, sel_channels)
+        if rec.enabled:
+            read_block = _timed_reader(rec, read_block)
+        projectors: List[Optional[ZProjector]] = [ZProjector(reductions, n_z, dtype, axis=zdim) for _ in windows]
+        try:
+            for block in _iter_z_chunks(read_block, n_z, step):
+                with rec.stage("reduce"):
+                    for proj, (_, (ys, xs)) in zip(projectors, windows):
+                        proj.update(block[..., ys, xs])
+            for i, (origin, _) in enumerate(windows):
+                reduced = projectors[i].results()
+                projectors[i] = None  # release each tile's accumulators once it is handed on
+                yield origin, _split_channels(reduced, cdim)
+        except Exception as e:
+            raise ND2ReadError(f"File {nd2_path.name}: position {p}: {e}") from e
+        return
+    for (y0, x0), window in windows:
+        read_block = _frame_block_reader(f, sizes, p, sel_channels, window)
+        if rec.enabled:
+            read_block = _timed_reader(rec, read_block)
+        try:
+            with rec.stage("reduce"):
+                reduced = project_z(_iter_z_chunks(read_block, n_z, step), reductions, n_z, dtype, axis=zdim)
+        except Exception as e:
+            raise ND2ReadError(f"File {nd2_path.name}: position {p}, tile y={y0} x={x0}: {e}") from e
+        yield (y0, x0), _split_channels(reduced, cdim)
+
+def _channel_names(f, nd2_path: Path) -> List[str]:
+    # Extract channel names; nd2 0.10.x exposes Channel objects with a `.channel` field (ChannelMeta) containing `.name`
+    ch_names: List[str] = []
+    chans = list(getattr(f.metadata, "channels", []) or [])
+    if not chans:
+        raise ND2ReadError(f"File {nd2_path.name}: metadata.channels is missing or empty.")
+    for idx, ch in enumerate(chans):
+        name = None
+        # Preferred: Channel.channel.name
+        meta = getattr(ch, "channel", None)
+        if meta is not None:
+            name = getattr(meta, "name", None)
+        # Fallbacks: attempt common attributes
+        if not name:
+            for cand in ("label", "Label", "description", "text"):
+                name = getattr(ch, cand, None) or (getattr(meta, cand, None) if meta is not None else None)
+                if name:
+                    break
+        ch_names.append(str(name) if name else f"C{idx}")
+    return ch_names
+
+def resolve_channels(ch_names: List[str], egfp_keywords: List[str], nuc_keywords: List[str]) -> tuple[int, int]:
+    """(egfp, nuclei) channel indices by keyword; raises ND2ReadError if either is missing."""
+    return _find_channel_index(ch_names, egfp_keywords), _find_channel_index(ch_names, nuc_keywords)
+
+def nd2_sizes(nd2_path: Path) -> Dict[str, int]:
+    """Axis sizes of an ND2 file without decoding any frames."""
+    with nd2.ND2File(str(nd2_path)) as f:
+        return dict(f.sizes)
+
+def nd2_header(nd2_path: Path) -> Dict[str, Any]:
+    """Axis sizes, dtype and channel names of an ND2 file without decoding any frames."""
+    with nd2.ND2File(str(nd2_path)) as f:
+        return dict(sizes=dict(f.sizes), dtype=str(np.dtype(f.dtype)), ch_names=_channel_names(f, nd2_path))
+
 def read_positions(
     nd2_path: Path,
     egfp_keywords: List[str],
     nuc_keywords: List[str],
+    mode: str = "volume",
+    z_chunk: int = 1,
+    positions: Optional[Sequence[int]] = None,
+    reader: str = "dask",
+    reductions: Sequence[str] = ("max",),
+    on_error: Optional[Callable[[int, Exception], None]] = None,
+    qc: Optional[Dict[str, Any]] = None,
+    tile: int = 0,
 ) -> Iterator[Dict[str, Any]]:
     """
-    Yields per-XY dicts: xy_index, egfp_mip, nuc_mip, meta
+    Yields per-XY dicts: xy_index, egfp_mip, nuc_mip, projections, meta
+    projections maps each requested reduction (see preprocess.ZProjector) to an
+    (egfp, nuc) pair, all computed in one pass over Z; egfp_mip/nuc_mip are the
+    'max' pair when requested, else the first reduction's.
+    Only the EGFP and nuclei channels are read; meta reports bytes_read and
+    bytes_skipped (the other channels of the position).
+    mode='volume' loads the whole (C, Z, Y, X) stack of a position before
+    projecting; mode='stream' reads z_chunk planes at a time into a running
+    max, so peak memory no longer grows with Z depth.
+    positions restricts iteration to the given XY indices (in the given order).
+    reader='dask' slices f.to_dask(); reader='frames' reads frames directly by
+    sequence index (no dask graph per position).
+    With an active instrument.Recorder, 'read' and 'reduce' time and bytes
+    read are attributed to (file stem, position).
+    on_error(xy_index, exc), when given, receives errors raised while
+    decoding a position's frames (e.g. a corrupt frame); that position is
+    skipped and iteration continues. Without it the error propagates.
+    qc, when given (QCAccumulator options, {} for defaults), adds a 'qc'
+    dict of per-position metrics (see qc.QCAccumulator) computed from the
+    same chunks as the projection.
+    tile > 0 projects frames larger than tile (in Y or X) one tile x tile
+    window at a time: such items carry 'tiles', an iterator of ((y0, x0),
+    projections) in row-major order, plus 'shape' (Y, X) and 'tile', instead
+    of whole-frame projections (see preprocess.save_flat_tiles). Peak memory
+    then depends on the tile size, not the frame size; compressed ND2s are
+    still decoded once per frame, holding every tile's accumulators until the
+    Z pass ends (see _iter_tiles). Consume 'tiles' before
+    advancing; a tile that cannot be decoded raises ND2ReadError from it.
+    Needs reader='frames' and no qc.
     Fail-fast conditions:
       - Z axis must exist
       - EGFP and nuclei channels must be found
     """
+    rec = instrument.current()
     with nd2.ND2File(str(nd2_path)) as f:
         sizes = dict(f.sizes)  # e.g., {'P':12, 'Z':15, 'C':2, 'Y':1024, 'X':1024}
         # Determine axis order from sizes and array shape
@@ -43,30 +239,20 @@ def read_positions(
         if "C" not in sizes or sizes.get("C", 0) < 2:
             raise ND2ReadError(f"File {nd2_path.name}: requires a C axis with EGFP and nuclei channels.")
 
-        # Extract channel names; nd2 0.10.x exposes Channel objects with a `.channel` field (ChannelMeta) containing `.name`
-        ch_names: List[str] = []
-        chans = list(getattr(f.metadata, "channels", []) or [])
-        if not chans:
-            raise ND2ReadError(f"File {nd2_path.name}: metadata.channels is missing or empty.")
-        for idx, ch in enumerate(chans):
-            name = None
-            # Preferred: Channel.channel.name
-            meta = getattr(ch, "channel", None)
-            if meta is not None:
-                name = getattr(meta, "name", None)
-            # Fallbacks: attempt common attributes
-            if not name:
-                for cand in ("label", "Label", "description", "text"):
-                    name = getattr(ch, cand, None) or (getattr(meta, cand, None) if meta is not None else None)
-                    if name:
-                        break
-            ch_names.append(str(name) if name else f"C{idx}")
+        ch_names = _channel_names(f, nd2_path)
 
         egfp_idx = _find_channel_index(ch_names, egfp_keywords)
         nuc_idx  = _find_channel_index(ch_names, nuc_keywords)
 
+        if reader == "frames":
+            if axes[-3:] != ("C", "Y", "X"):
+                raise ND2ReadError(f"File {nd2_path.name}: frame reader needs trailing C, Y, X axes; got {axes}.")
+            arr = None
+            compute = False
+        elif reader != "dask":
+            raise ValueError(f"Unknown reader '{reader}' (expected 'dask' or 'frames').")
         # Prefer dask for large files; fall back to numpy
-        if hasattr(f, "to_dask"):
+        elif hasattr(f, "to_dask"):
             arr = f.to_dask()
             compute = True
         else:
@@ -77,33 +263,110 @@ def read_positions(
         pos_axis = ax_index.get("P", None)
         n_pos = sizes.get("P", 1)
 
-        for p in range(n_pos):
-            sub = arr
-            if pos_axis is not None:
+        # After slicing P, recompute axis map without P
+        old_axes = [ax for ax in axes if ax != "P"]
+        aidx = {ax: i for i, ax in enumerate(old_axes)}
+        try:
+            cdim = aidx["C"]; zdim = aidx["Z"]
+        except KeyError:
+            raise ND2ReadError(f"File {nd2_path.name}: unexpected axis order {old_axes} (need C and Z).")
+        # Channel axis index in the projected (Z-reduced) array
+        cdim_red = cdim - 1 if cdim > zdim else cdim
+
+        # Only the EGFP and nuclei channels are materialized per position
+        sel_channels = [egfp_idx, nuc_idx]
+        dtype = np.dtype(f.dtype if arr is None else arr.dtype)
+        itemsize = dtype.itemsize
+        pos_bytes = int(np.prod([n for ax, n in sizes.items() if ax != "P"])) * itemsize
+        bytes_read = pos_bytes // sizes["C"] * len(sel_channels)
+
+        tiled = tile > 0 and (sizes["Y"] > tile or sizes["X"] > tile)
+        if tiled and (reader != "frames" or qc is not None):
+            raise ValueError("Tiled projection needs reader='frames' and no QC.")
+
+        reductions = parse_reductions(reductions)
+        primary = "max" if "max" in reductions else reductions[0]
+
+        # 'volume' reduces the whole Z stack at once; 'stream' holds z_chunk planes at a time
+        n_z = sizes["Z"]
+        if mode == "volume":
+            step = n_z
+        elif mode == "stream":
+            step = max(1, int(z_chunk))
+        else:
+            raise ValueError(f"Unknown projection mode '{mode}' (expected 'volume' or 'stream').")
+
+        if positions is None:
+            positions = range(n_pos)
+        for p in positions:
+            if not 0 <= p < n_pos:
+                raise ND2ReadError(f"File {nd2_path.name}: position {p} out of range (P={n_pos}).")
+            rec.set_unit(nd2_path.stem, p)
+            meta = dict(
+                ch_names=ch_names,
+                sizes=sizes,
+                axes="".join(axes),
+                reader="nd2",
+                backend=reader,
+                mode=mode,
+                z_chunk=step,
+                reductions=reductions,
+                channels_read=sel_channels,
+                bytes_read=bytes_read,
+                bytes_skipped=max(pos_bytes - bytes_read, 0),
+            )
+            if tiled:
+                yield dict(
+                    xy_index=p,
+                    tiles=_iter_tiles(f, nd2_path, sizes, p, sel_channels, tile, step, reductions, dtype,
+                                      zdim, cdim_red, rec),
+                    shape=(sizes["Y"], sizes["X"]),
+                    tile=tile,
+                    meta=dict(meta, tile=tile),
+                )
+                continue
+            if arr is None:
+                read_block = _frame_block_reader(f, sizes, p, sel_channels)
+            else:
+                sub = arr
+                if pos_axis is not None:
+                    sl = [slice(None)] * sub.ndim
+                    sl[pos_axis] = p
+                    sub = sub[tuple(sl)]
+                # select channels before materializing so dask only keeps what we need
                 sl = [slice(None)] * sub.ndim
-                sl[pos_axis] = p
+                sl[cdim] = sel_channels
                 sub = sub[tuple(sl)]
-            # materialize if dask
-            if compute:
-                sub = sub.compute()
+                read_block = _array_block_reader(sub, zdim, compute)
 
-            # After slicing P, recompute axis map without P
-            old_axes = [ax for ax in axes if ax != "P"]
-            aidx = {ax: i for i, ax in enumerate(old_axes)}
+            if rec.enabled:
+                read_block = _timed_reader(rec, read_block)
+            chunks = _iter_z_chunks(read_block, n_z, step)
+            acc = None
+            if qc is not None:
+                acc = QCAccumulator(n_z, dtype, n_channels=len(sel_channels), **qc)
+                chunks = observe(chunks, acc, cdim, zdim)
             try:
-                cdim = aidx["C"]; zdim = aidx["Z"]
-            except KeyError:
-                raise ND2ReadError(f"File {nd2_path.name}: unexpected axis order {old_axes} (need C and Z).")
-
-            egfp_vol = np.take(sub, indices=egfp_idx, axis=cdim)
-            nuc_vol  = np.take(sub, indices=nuc_idx,  axis=cdim)
+                with rec.stage("reduce"):
+                    reduced = project_z(chunks, reductions, n_z, dtype, axis=zdim)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(p, e)
+                continue
 
-            egfp_mip = max_proj(egfp_vol, axis=zdim)
-            nuc_mip  = max_proj(nuc_vol,  axis=zdim)
+            projections = _split_channels(reduced, cdim_red)
+            egfp_mip, nuc_mip = projections[primary]
 
+            extra = {}
+            if acc is not None:
+                with rec.stage("qc"):
+                    extra["qc"] = acc.results()
             yield dict(
+                **extra,
                 xy_index=p,
                 egfp_mip=np.asarray(egfp_mip),
                 nuc_mip=np.asarray(nuc_mip),
-                meta=dict(ch_names=ch_names, sizes=sizes, axes="".join(axes), reader="nd2"),
+                projections=projections,
+                meta=meta,
             )
@@ -0,0 +1,158 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .config import Config
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+def source_identity(nd2_path: Path, content_hash: bool = False) -> Dict[str, Any]:
+    """Identity of an ND2 source: resolved path, size, mtime and optional sha256."""
+    st = nd2_path.stat()
+    ident: Dict[str, Any] = dict(path=str(nd2_path.resolve()), size=st.st_size, mtime_ns=st.st_mtime_ns)
+    if content_hash:
+        h = hashlib.sha256()
+        with open(nd2_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 24), b""):
+                h.update(block)
+        ident["sha256"] = h.hexdigest()
+    return ident
+
+def projection_settings(cfg: Config) -> Dict[str, Any]:
+    """Config values that change the content of a projection output."""
+    return dict(
+        egfp_keywords=list(cfg.channels.egfp_keywords),
+        nuc_keywords=list(cfg.channels.nuc_keywords),
+        projection=cfg.preprocessing.reductions,
+        backend=cfg.output.backend,
+        zarr_scope=cfg.output.zarr_scope if cfg.output.backend == "zarr" else None,
+        tiff=cfg.output.tiff_options if cfg.output.backend == "tiff" else None,
+    )
+
+def position_key(nd2_stem: str, xy_index: int) -> str:
+    return f"{nd2_stem}_XY{xy_index:03d}"
+
+class Manifest:
+    """Record of which outputs under output_root were produced from which source.
+
+    Stored as JSON at <output_root>/manifest.json (or another name, e.g. one
+    per shard). A position is up to date when
+    its entry matches the current source identity and projection settings and all
+    of its recorded outputs still exist.
+
+    record() and record_failure() also append to <name>.journal (JSON lines)
+    as they happen, and loading replays it, so a run that dies before save()
+    resumes from the last completed position. save() folds the journal into
+    the manifest. failures lists positions whose frames could not be read;
+    they stay stale and are retried by the next run.
+    """
+
+    def __init__(self, output_root: Path, name: str = MANIFEST_NAME):
+        self.output_root = Path(output_root)
+        self.path = self.output_root / name
+        self.journal_path = self.path.with_name(self.path.name + ".journal")
+        self.sources: Dict[str, Dict[str, Any]] = {}
+        self.outputs: Dict[str, Dict[str, Any]] = {}
+        self.failures: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()  # record() may run on a background writer thread
+        if self.path.exists():
+            try:
+                data = json.loads(self.path.read_text())
+            except ValueError:
+                data = {}
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data.get("sources", {})
+                self.outputs = data.get("outputs", {})
+                self.failures = data.get("failures", {})
+        if self.journal_path.exists():
+            for line in self.journal_path.read_text().splitlines():
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue  # torn last line of an interrupted run
+
+    def _apply(self, entry: Dict[str, Any]) -> None:
+        key = entry["key"]
+        if entry["kind"] == "done":
+            self.outputs[key] = entry["rec"]
+            self.failures.pop(key, None)
+        elif entry["kind"] == "failed":
+            self.failures[key] = entry["rec"]
+
+    def _log(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._apply(entry)
+            self.output_root.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def _fresh(self, rec: Optional[Dict[str, Any]], ident: Dict[str, Any], settings: Dict[str, Any]) -> bool:
+        return rec is not None and rec.get("source") == ident and rec.get("settings") == settings
+
+    def known_positions(self, ident: Dict[str, Any], settings: Dict[str, Any]) -> Optional[int]:
+        """Position count recorded for an unchanged source, else None."""
+        rec = self.sources.get(ident["path"])
+        return int(rec["n_positions"]) if self._fresh(rec, ident, settings) else None
+
+    def stale_positions(self, nd2_stem: str, n_positions: int, ident: Dict[str, Any],
+                        settings: Dict[str, Any]) -> List[int]:
+        stale = []
+        for p in range(n_positions):
+            rec = self.outputs.get(position_key(nd2_stem, p))
+            if not self._fresh(rec, ident, settings) or not all(
+                (self.output_root / rel).exists() for rel in rec.get("files", [])
+            ):
+                stale.append(p)
+        return stale
+
+    def record_source(self, ident: Dict[str, Any], settings: Dict[str, Any], n_positions: int) -> None:
+        self.sources[ident["path"]] = dict(source=ident, settings=settings, n_positions=int(n_positions))
+
+    def record(self, nd2_stem: str, xy_index: int, ident: Dict[str, Any], settings: Dict[str, Any],
+               files: Iterable[Path]) -> None:
+        """Mark a position complete; call only once its files have been written."""
+        rels = [os.path.relpath(Path(f), self.output_root) for f in files]
+        self._log(dict(kind="done", key=position_key(nd2_stem, xy_index),
+                       rec=dict(source=ident, settings=settings, files=rels)))
+
+    def record_failure(self, nd2_stem: str, xy_index: int, ident: Optional[Dict[str, Any]], error: str) -> None:
+        key = position_key(nd2_stem, xy_index)
+        attempts = self.failures.get(key, {}).get("attempts", 0) + 1
+        self._log(dict(kind="failed", key=key,
+                       rec=dict(source=ident, error=str(error), attempts=attempts, time=time.time())))
+
+    def save(self) -> None:
+        self.output_root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".json.tmp")
+        with self._lock:
+            data = dict(version=MANIFEST_VERSION, sources=self.sources, outputs=self.outputs,
+                        failures=self.failures)
+            tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+            os.replace(tmp, self.path)
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+
+def plan_positions(manifest: Manifest, nd2_path: Path, settings: Dict[str, Any],
+                   content_hash: bool = False,
+                   n_positions: Optional[Callable[[Path], int]] = None) -> Tuple[Dict[str, Any], List[int]]:
+    """(source identity, positions needing projection) for one ND2 file.
+
+    Unchanged sources are resolved from the manifest alone; the ND2 header is
+    only read for new or modified files (via n_positions(path) when given,
+    e.g. a Catalog lookup).
+    """
+    ident = source_identity(nd2_path, content_hash)
+    n_pos = manifest.known_positions(ident, settings)
+    if n_pos is None:
+        if n_positions is None:
+            from .io_nd2 import nd2_sizes
+            n_positions = lambda p: nd2_sizes(p).get("P", 1)
+        n_pos = n_positions(nd2_path)
+        manifest.record_source(ident, settings, n_pos)
+    return ident, manifest.stale_positions(nd2_path.stem, n_pos, ident, settings)
@@ -1,41 +1,28 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import List
-import glob
-
-# Fail-fast: require napari
-try:
-    import napari  # type: ignore
-except Exception as e:
-    raise ImportError("The 'napari' package is required. Install it before running.") from e
+import atexit
+import sys
 
+from . import instrument
 from .config import Config
 from .io_nd2 import read_positions
-from .preprocess import save_xy_mips, ensure_dir
+from .manifest import Manifest, plan_positions, projection_settings
+from .preprocess import CoalescingWriter, save_xy_projections, ensure_dir, open_writer
 from .aggregate import aggregate_per_nd2, aggregate_all
-from .plugin_runner import try_run_plugin, save_plugin_outputs
-
-def _collect_nd2_paths(inputs: List[str]) -> List[Path]:
-    out: List[Path] = []
-    for patt in inputs:
-        p = Path(patt)
-        if p.is_dir():
-            out.extend(sorted(p.glob("*.nd2")))
-        else:
-            matches = [Path(m) for m in glob.glob(patt, recursive=True)]
-            for m in matches:
-                if m.is_dir():
-                    out.extend(sorted(m.glob("*.nd2")))
-                elif m.suffix.lower() == ".nd2":
-                    out.append(m)
-    # de-dupe preserve order
-    seen = set(); uniq = []
-    for p in out:
-        if p not in seen:
-            uniq.append(p); seen.add(p)
-    if not uniq:
-        raise FileNotFoundError("No ND2 files found from config.inputs.")
-    return uniq
+from .parallel import resolve_workers
+
+# per-position progress of process_nd2_file, kept apart from generate_projections' manifest.json
+ORCHESTRATE_MANIFEST = "manifest.orchestrate.json"
+
+_OUTPUT_NAMES = ("segmentation_labels.tif", "features.csv", "shapes.csv", "shapes.npz")
+
+def _require_napari():
+    # Fail-fast: the viewer path requires napari; imported here so headless runs never load Qt
+    try:
+        import napari  # type: ignore
+    except Exception as e:
+        raise ImportError("The 'napari' package is required. Install it before running.") from e
+    return napari
 
 def _assert_xy_outputs(xy_dir: Path) -> None:
     # Define minimal success criterion after plugin run
@@ -46,16 +33,178 @@ def _assert_xy_outputs(xy_dir: Path) -> None:
             "Ensure the plugin exposes npe2 commands that create new napari layers (labels/shapes/features)."
         )
 
+def _xy_outputs(xy_dir: Path) -> list[Path]:
+    return [xy_dir / n for n in _OUTPUT_NAMES if (xy_dir / n).exists()]
+
+def _run_settings(cfg: Config) -> dict:
+    """Config values that change a position's projections or plugin outputs."""
+    return dict(projection_settings(cfg), plugin_name=cfg.plugin.plugin_name,
+                command_ids=list(cfg.plugin.command_ids), headless=cfg.plugin.headless)
+
+def _resume_plan(nd2_path: Path, cfg: Config):
+    """(manifest, source identity, positions left to process) for an interruptible run.
+
+    (None, None, None) when execution.incremental is off or in manual mode,
+    where every position is processed.
+    """
+    if not cfg.execution.incremental or cfg.plugin.manual_mode:
+        return None, None, None
+    manifest = Manifest(Path(cfg.output_root), ORCHESTRATE_MANIFEST)
+    ident, stale = plan_positions(manifest, nd2_path, _run_settings(cfg), cfg.execution.hash_sources)
+    if len(stale) < manifest.sources[ident["path"]]["n_positions"]:
+        print(f"[orchestrate] {nd2_path.name}: resuming, {len(stale)} position(s) left")
+    return manifest, ident, stale
+
+def _failure_handler(nd2_path: Path, manifest, ident):
+    def on_error(xy: int, err: Exception) -> None:
+        # a corrupt frame skips its position; it stays stale and is retried by the next run
+        print(f"[orchestrate] {nd2_path.name} XY{xy:03d} could not be read: {err}", file=sys.stderr)
+        if manifest is not None:
+            manifest.record_failure(nd2_path.stem, xy, ident, f"{type(err).__name__}: {err}")
+    return on_error
+
+def _record_done(manifest, writer, nd2_stem: str, xy: int, ident, settings: dict, paths: list) -> None:
+    if manifest is None:
+        return
+    if writer is not None:
+        # queued behind the position's projection writes, so it runs once they have landed
+        writer.submit(manifest.record, nd2_stem, xy, ident, settings, paths)
+    else:
+        manifest.record(nd2_stem, xy, ident, settings, paths)
+
 def process_nd2_file(nd2_path: Path, cfg: Config) -> None:
+    # Opt-in instrumentation: per-position read/reduce/write/plugin timings in output_root/reports
+    rec = instrument.Recorder() if cfg.execution.instrument else None
+    with instrument.activate(rec) as rec:
+        try:
+            _process_nd2_file(nd2_path, cfg, rec)
+        finally:
+            if rec.enabled:
+                rec.write_report(Path(cfg.output_root), f"orchestrate_{nd2_path.stem}")
+
+def _aggregate(cfg: Config, nd2_stem: str) -> None:
+    if cfg.aggregation.backend == "parquet":
+        from .feature_store import FeatureStore
+        store = FeatureStore(Path(cfg.output_root))
+        store.update(nd2_stem)
+        if cfg.aggregation.export_csv:
+            store.export_csv(nd2_stem)
+    else:
+        aggregate_per_nd2(Path(cfg.output_root), nd2_stem)
+
+def _process_headless(nd2_path: Path, cfg: Config, rec: instrument.Recorder) -> None:
+    """Project, then segment each position on a process pool without a napari Viewer."""
+    from .headless import run_plugin_batch
+
+    nd2_stem = nd2_path.stem
+    nd2_outdir = ensure_dir(Path(cfg.output_root) / nd2_stem)
+    tiff_opts = cfg.output.tiff_options
+    if not cfg.plugin.enabled:
+        raise RuntimeError("Plugin is mandatory. Set plugin.enabled: true in config.")
+    manifest, ident, positions = _resume_plan(nd2_path, cfg)
+    settings = _run_settings(cfg)
+    projected = {}  # xy_dir -> (xy index, projection paths)
+
+    with open_writer(cfg.execution.write_queue) as writer:
+        def jobs():
+            for item in read_positions(
+                nd2_path,
+                cfg.channels.egfp_keywords,
+                cfg.channels.nuc_keywords,
+                mode=cfg.preprocessing.mode,
+                z_chunk=cfg.preprocessing.z_chunk,
+                reader=cfg.preprocessing.reader,
+                reductions=cfg.preprocessing.reductions,
+                positions=positions,
+                on_error=_failure_handler(nd2_path, manifest, ident),
+            ):
+                xy = int(item["xy_index"])
+                xy_dir = ensure_dir(nd2_outdir / f"XY_{xy:03d}")
+                projected[xy_dir] = (xy, save_xy_projections(xy_dir, item["projections"], writer=writer,
+                                                             tiff_opts=tiff_opts))
+                yield xy_dir, item["egfp_mip"], item["nuc_mip"]
+
+        for res in run_plugin_batch(
+            jobs(),
+            cfg.plugin.plugin_name,
+            cfg.plugin.command_ids,
+            tiff_opts=cfg.output.labels_tiff_options,
+            workers=resolve_workers(cfg.execution.workers),
+            max_pending=cfg.execution.write_queue,
+            shapes_format=cfg.output.shapes_format,
+        ):
+            print(f"[orchestrate] {res['xy_dir'].name}: {res['command']} -> {len(res['paths'])} file(s)")
+            _assert_xy_outputs(res["xy_dir"])
+            xy, proj_paths = projected.pop(res["xy_dir"])
+            _record_done(manifest, writer, nd2_stem, xy, ident, settings, proj_paths + list(res["paths"]))
+
+    if manifest is not None:
+        manifest.save()
+    rec.set_unit(nd2_stem)
+    with rec.stage("aggregate"):
+        _aggregate(cfg, nd2_stem)
+
+def _process_nd2_file(nd2_path: Path, cfg: Config, rec: instrument.Recorder) -> None:
+    if cfg.plugin.headless:
+        _process_headless(nd2_path, cfg, rec)
+        return
+    napari = _require_napari()
+    from .plugin_runner import try_run_plugin, save_plugin_outputs, save_layer_snapshot, snapshot_layer
+
     nd2_stem = nd2_path.stem
     nd2_outdir = ensure_dir(Path(cfg.output_root) / nd2_stem)
 
+    tiff_opts = cfg.output.tiff_options
+    labels_opts = cfg.output.labels_tiff_options
+    shapes_format = cfg.output.shapes_format
+
+    # Resume: positions completed by an earlier (interrupted) run are skipped
+    manifest, ident, positions = _resume_plan(nd2_path, cfg)
+    settings = _run_settings(cfg)
+    if positions == []:
+        print(f"[orchestrate] {nd2_path.name} is up to date; skipping")
+        _aggregate(cfg, nd2_stem)
+        return
+
     # viewer always required/shown
     viewer = napari.Viewer(title=f"Microglia pipeline: {nd2_stem}")
 
     # In manual mode we register a callback that saves any new plugin output layers
     manual_mode = getattr(cfg.plugin, "manual_mode", False)
     saved_xy_dirs = []  # track which XY dirs have at least one output
+    saver = None  # background saves of manual-mode layers, created with the hook
+    status_timer = None  # GUI-thread poll of saver.status() while saves are outstanding
+
+    def _show_status() -> None:
+        try:
+            viewer.status = f"[microglia] {saver.status()}"
+        except Exception:
+            pass
+        if status_timer is not None and saver.pending == 0:
+            status_timer.stop()  # final state (incl. failures) shown; the next save restarts it
+
+    def _on_save_error(key, err) -> None:
+        # saver thread: stderr only; the status line picks the failure up on the next poll
+        print(f"[orchestrate] Failed to save {key[1]} layer for {key[0]}: {err}", file=sys.stderr)
+
+    def _close_saver() -> None:
+        if status_timer is not None:
+            status_timer.stop()
+        saver.close()
+        atexit.unregister(saver.close)
+
+    def _queue_save(layer, xy_dir: Path) -> None:
+        # snapshot on the GUI thread; the write itself runs on the saver thread
+        snap = snapshot_layer(layer)
+        if snap is None:
+            return
+        saver.submit((xy_dir, snap.kind), save_layer_snapshot, snap, xy_dir, labels_opts, shapes_format)
+        if xy_dir not in saved_xy_dirs:
+            saved_xy_dirs.append(xy_dir)
+        if status_timer is not None:
+            status_timer.start()
+        _show_status()
+
     def _on_new_layer(event):  # type: ignore[unused-private-member]
         layer = event.value
         name = str(getattr(layer, "name", ""))
@@ -69,73 +218,101 @@ def process_nd2_file(nd2_path: Path, cfg: Config) -> None:
         xy_dir = Path(cfg.output_root) / nd2_stem / f"XY_{xy_idx:03d}"
         if not xy_dir.exists():
             return
-        # Persist this single layer if relevant
-        try:
-            cls = layer.__class__.__name__.lower()
-            if cls == "labels":
-                from .plugin_runner import save_labels_layer
-                save_labels_layer(layer, xy_dir / "segmentation_labels.tif")
-            elif cls == "shapes":
-                from .plugin_runner import save_shapes_layer
-                save_shapes_layer(layer, xy_dir / "shapes.csv")
-            feats = getattr(layer, "features", None)
-            if feats is not None and len(feats):
-                import pandas as _pd
-                _pd.DataFrame(feats).to_csv(xy_dir / "features.csv", index=False)
-            if xy_dir not in saved_xy_dirs:
-                saved_xy_dirs.append(xy_dir)
-        except Exception:
-            return
-
-    for item in read_positions(
-        nd2_path,
-        cfg.channels.egfp_keywords,
-        cfg.channels.nuc_keywords,
-    ):
-        xy_idx = int(item["xy_index"])
-        egfp_mip = item["egfp_mip"]
-        nuc_mip = item["nuc_mip"]
-
-        xy_dir = ensure_dir(nd2_outdir / f"XY_{xy_idx:03d}")
-        save_xy_mips(xy_dir, egfp_mip, nuc_mip)
-
-        egfp_name = f"{nd2_stem}_XY{xy_idx:03d}_EGFP_MIP"
-        nuc_name = f"{nd2_stem}_XY{xy_idx:03d}_NUC_MIP"
-        viewer.add_image(egfp_mip, name=egfp_name, blending="additive", colormap="green")
-        viewer.add_image(nuc_mip,  name=nuc_name,  blending="additive", colormap="blue")
-
-        if not cfg.plugin.enabled:
-            raise RuntimeError("Plugin is mandatory. Set plugin.enabled: true in config.")
-
-        if manual_mode:
-            # Defer plugin execution; user will trigger via GUI. We attach callback once.
-            if not hasattr(viewer, "_microglia_manual_hook"):
-                try:
-                    viewer.layers.events.inserted.connect(_on_new_layer)  # type: ignore[attr-defined]
-                    viewer._microglia_manual_hook = True  # type: ignore[attr-defined]
-                except Exception:
-                    pass
+        # Persist this layer now and again after every edit; queued saves of the same
+        # XY and layer kind coalesce to the latest snapshot. Labels painting edits the
+        # array in place and fires only paint/labels_update, never events.data.
+        _queue_save(layer, xy_dir)
+        if layer.__class__.__name__.lower() == "labels":
+            names = ("paint", "labels_update")
         else:
-            before_names = [str(l.name) for l in viewer.layers]
-            ran = try_run_plugin(
-                viewer,
-                egfp_name,
-                nuc_name,
-                xy_dir,
-                plugin_name=cfg.plugin.plugin_name,
-                preferred_command_ids=cfg.plugin.command_ids,
-            )
-            if not ran:
-                raise RuntimeError(
-                    f"Failed to invoke plugin '{cfg.plugin.plugin_name}'. "
-                    "Provide explicit plugin.command_ids in config or verify the plugin installation."
-                )
-
-            save_plugin_outputs(viewer, xy_dir, only_new_from=before_names)
-            _assert_xy_outputs(xy_dir)
+            names = ("data",)
+        for ev_name in names:
+            emitter = getattr(layer.events, ev_name, None)
+            if emitter is None:
+                continue
+            try:
+                emitter.connect(lambda _e, layer=layer, xy_dir=xy_dir: _queue_save(layer, xy_dir))
+            except Exception:
+                pass
+
+    with open_writer(cfg.execution.write_queue) as writer:
+        for item in read_positions(
+            nd2_path,
+            cfg.channels.egfp_keywords,
+            cfg.channels.nuc_keywords,
+            mode=cfg.preprocessing.mode,
+            z_chunk=cfg.preprocessing.z_chunk,
+            reader=cfg.preprocessing.reader,
+            reductions=cfg.preprocessing.reductions,
+            positions=positions,
+            on_error=_failure_handler(nd2_path, manifest, ident),
+        ):
+            xy_idx = int(item["xy_index"])
+            egfp_mip = item["egfp_mip"]
+            nuc_mip = item["nuc_mip"]
+
+            xy_dir = ensure_dir(nd2_outdir / f"XY_{xy_idx:03d}")
+            proj_paths = save_xy_projections(xy_dir, item["projections"], writer=writer, tiff_opts=tiff_opts)
 
+            egfp_name = f"{nd2_stem}_XY{xy_idx:03d}_EGFP_MIP"
+            nuc_name = f"{nd2_stem}_XY{xy_idx:03d}_NUC_MIP"
+            with rec.stage("viewer"):
+                viewer.add_image(egfp_mip, name=egfp_name, blending="additive", colormap="green")
+                viewer.add_image(nuc_mip,  name=nuc_name,  blending="additive", colormap="blue")
+
+            if not cfg.plugin.enabled:
+                raise RuntimeError("Plugin is mandatory. Set plugin.enabled: true in config.")
+
+            if manual_mode:
+                # Defer plugin execution; user will trigger via GUI. We attach callback once.
+                if saver is None:
+                    saver = CoalescingWriter(on_error=_on_save_error)
+                    # flush outstanding saves when the viewer window closes (or at interpreter exit)
+                    atexit.register(saver.close)
+                    try:
+                        viewer.window._qt_window.destroyed.connect(lambda *_: _close_saver())
+                    except Exception:
+                        pass
+                    try:
+                        from qtpy.QtCore import QTimer
+                        status_timer = QTimer(viewer.window._qt_window)
+                        status_timer.setInterval(250)
+                        status_timer.timeout.connect(_show_status)
+                    except Exception:
+                        status_timer = None
+                    try:
+                        viewer.layers.events.inserted.connect(_on_new_layer)  # type: ignore[attr-defined]
+                    except Exception:
+                        pass
+            else:
+                before_names = [str(l.name) for l in viewer.layers]
+                with rec.stage("plugin"):
+                    ran = try_run_plugin(
+                        viewer,
+                        egfp_name,
+                        nuc_name,
+                        xy_dir,
+                        plugin_name=cfg.plugin.plugin_name,
+                        preferred_command_ids=cfg.plugin.command_ids,
+                    )
+                if not ran:
+                    raise RuntimeError(
+                        f"Failed to invoke plugin '{cfg.plugin.plugin_name}'. "
+                        "Provide explicit plugin.command_ids in config or verify the plugin installation."
+                    )
+
+                with rec.stage("save"):
+                    save_plugin_outputs(viewer, xy_dir, only_new_from=before_names, tiff_opts=labels_opts,
+                                        shapes_format=shapes_format)
+                _assert_xy_outputs(xy_dir)
+                _record_done(manifest, writer, nd2_stem, xy_idx, ident, settings, proj_paths + _xy_outputs(xy_dir))
+
+    if manifest is not None:
+        manifest.save()
     if not manual_mode:
-        aggregate_per_nd2(Path(cfg.output_root), nd2_stem)
+        rec.set_unit(nd2_stem)
+        with rec.stage("aggregate"):
+            _aggregate(cfg, nd2_stem)
 
 ## Note: run_from_config has been intentionally removed. The orchestration
 ## logic now lives directly inside scripts/run_microglia_pipeline.py:main().
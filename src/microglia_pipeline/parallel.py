@@ -0,0 +1,259 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, Any, Optional
+import os
+import time
+
+import numpy as np
+
+from . import instrument
+from .config import Config
+from .io_nd2 import ND2ReadError, nd2_sizes, read_positions
+from .preprocess import save_flat_projections, save_flat_tiles
+
+@dataclass(frozen=True)
+class WorkUnit:
+    nd2_path: Path
+    xy_index: int
+
+def resolve_workers(workers: int) -> int:
+    """0 means one worker per CPU core."""
+    return int(workers) if workers else (os.cpu_count() or 1)
+
+def list_work_units(nd2_paths: List[Path],
+                    n_positions: Optional[Callable[[Path], int]] = None) -> List[WorkUnit]:
+    """(file, position) units in deterministic order; only ND2 headers are read.
+
+    n_positions(path) overrides the header read (e.g. a Catalog lookup).
+    """
+    units: List[WorkUnit] = []
+    for nd2_path in nd2_paths:
+        n_pos = n_positions(nd2_path) if n_positions is not None else nd2_sizes(nd2_path).get("P", 1)
+        units.extend(WorkUnit(nd2_path, p) for p in range(n_pos))
+    return units
+
+def project_unit(unit: WorkUnit, cfg: Config) -> Dict[str, Any]:
+    """Project one position and write it to the flat layout.
+
+    Runs in a worker process, which opens its own ND2File via read_positions.
+    With the Zarr backend nothing is written here: the projections are
+    returned so the parent process can write them in position order.
+    With execution.instrument the unit's measurements are returned under
+    'instrument' for the parent to merge(). A position whose frames cannot be
+    decoded returns 'error' instead of raising, so one corrupt frame does not
+    abort the pool.
+    """
+    rec = instrument.Recorder() if cfg.execution.instrument else None
+    with instrument.activate(rec):
+        res = _project_unit(unit, cfg)
+    if rec is not None:
+        res["instrument"] = rec.snapshot()
+    return res
+
+def _project_unit(unit: WorkUnit, cfg: Config) -> Dict[str, Any]:
+    errors: List[Exception] = []
+    item = next(read_positions(
+        unit.nd2_path,
+        cfg.channels.egfp_keywords,
+        cfg.channels.nuc_keywords,
+        mode=cfg.preprocessing.mode,
+        z_chunk=cfg.preprocessing.z_chunk,
+        reader=cfg.preprocessing.reader,
+        reductions=cfg.preprocessing.reductions,
+        positions=[unit.xy_index],
+        on_error=lambda _p, e: errors.append(e),
+        qc=cfg.qc.options,
+        tile=cfg.preprocessing.tile,
+    ), None)
+    if item is not None and "tiles" in item:
+        try:
+            paths = save_flat_tiles(Path(cfg.output_root), unit.nd2_path.stem, unit.xy_index, item["shape"],
+                                    item["tiles"], item["tile"], tiff_opts=cfg.output.tiff_options)
+        except ND2ReadError as e:
+            errors.append(e)
+            item = None
+        else:
+            return dict(nd2=unit.nd2_path.name, xy_index=unit.xy_index, paths=paths)
+    if item is None:
+        return dict(nd2=unit.nd2_path.name, xy_index=unit.xy_index, error=f"{type(errors[0]).__name__}: {errors[0]}")
+    extra = {"qc": item["qc"]} if "qc" in item else {}
+    if cfg.output.backend == "zarr":
+        n_pos = item["meta"]["sizes"].get("P", 1)
+        return dict(nd2=unit.nd2_path.name, xy_index=unit.xy_index, n_positions=n_pos,
+                    projections=item["projections"], **extra)
+    paths = save_flat_projections(Path(cfg.output_root), unit.nd2_path.stem, unit.xy_index, item["projections"],
+                                  tiff_opts=cfg.output.tiff_options)
+    return dict(nd2=unit.nd2_path.name, xy_index=unit.xy_index, paths=paths, **extra)
+
+def unit_peak_bytes(sizes: Dict[str, int], dtype, cfg: Config) -> int:
+    """Estimated peak bytes of projecting one position with cfg, from its ND2 sizes and dtype.
+
+    Counts the decoded EGFP + nuclei planes held at once (the whole stack in
+    'volume' mode, z_chunk planes in 'stream' mode; doubled for dask's
+    compute copy), the Z-reduction accumulators and outputs, percentile
+    buffers and QC samples. With preprocessing.tile, planes are tile-sized
+    (memory-mapped, i.e. uncompressed, frames; see io_nd2._iter_tiles).
+    Process baseline memory is not included.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    pre = cfg.preprocessing
+    n_y, n_x = int(sizes.get("Y", 1)), int(sizes.get("X", 1))
+    tiled = int(pre.tile) > 0 and max(n_y, n_x) > int(pre.tile)
+    if tiled:  # one tile's Z column at a time, cut from memory-mapped frames
+        n_y, n_x = min(n_y, int(pre.tile)), min(n_x, int(pre.tile))
+    plane = n_y * n_x
+    n_z = int(sizes.get("Z", 1))
+    n_c = int(sizes.get("C", 2))
+    sel = 2  # EGFP + nuclei
+    held = n_z if pre.mode == "volume" else min(max(1, int(pre.z_chunk)), n_z)
+    chunk = sel * held * plane * itemsize
+    if pre.reader == "dask":
+        read = 2 * chunk
+    else:
+        read = chunk + (0 if tiled else n_c * plane * itemsize)
+    state = 0
+    for name in pre.reductions:
+        if name in ("max", "min"):
+            state += 2 * sel * plane * itemsize      # accumulator + per-chunk partial
+        elif name in ("sum", "mean"):
+            state += sel * plane * (8 + 4)           # integer/float64 sum + float32 output
+        elif name == "std":
+            state += sel * plane * (8 + 8 + 4)
+        else:                                        # p<q>: order-statistic buffer, concatenated per chunk
+            q = float(name[1:]) / 100.0
+            keep = min(int(q * (n_z - 1)), n_z - 1 - int(q * (n_z - 1))) + 2
+            state += sel * plane * (2 * (keep + held) * itemsize + 4)
+    if cfg.qc.enabled:
+        state += chunk * 6 // (2 * max(1, int(cfg.qc.row_step)))  # strided copy + float32 differences
+    if tiled:
+        state += 2 * len(pre.reductions) * sel * plane * 8  # tiles queued per output file (TiledTiffWriter)
+    return int(read + state)
+
+@dataclass
+class BudgetStats:
+    """How a memory-budgeted run used its budget (bytes are estimates from unit_peak_bytes)."""
+    budget: int
+    workers: int
+    units: int = 0
+    peak_bytes: int = 0        # largest estimated total in flight
+    peak_concurrency: int = 0
+    largest_unit: int = 0
+    over_budget: int = 0       # units larger than the budget, run alone
+    busy_seconds: float = 0.0  # wall time with at least one unit in flight
+    unit_seconds: float = 0.0  # sum of per-unit wall times (for mean concurrency)
+    byte_seconds: float = 0.0  # integral of estimated bytes in flight over time
+    wall_seconds: float = 0.0
+    worker_peak_rss_mb: Optional[float] = None
+
+    def summary(self) -> str:
+        mean_conc = self.unit_seconds / self.busy_seconds if self.busy_seconds else 0.0
+        mean_use = self.byte_seconds / self.busy_seconds / self.budget if self.busy_seconds and self.budget else 0.0
+        text = (f"memory budget {self.budget / 1e6:.0f} MB: peak {self.peak_bytes / 1e6:.0f} MB estimated in flight "
+                f"({self.peak_bytes / max(self.budget, 1):.0%}), mean {mean_use:.0%}; concurrency peak "
+                f"{self.peak_concurrency}/{self.workers}, mean {mean_conc:.1f}; largest position "
+                f"{self.largest_unit / 1e6:.0f} MB")
+        if self.over_budget:
+            text += f"; {self.over_budget} position(s) above the budget ran alone"
+        if self.worker_peak_rss_mb is not None:
+            text += f"; worker peak RSS {self.worker_peak_rss_mb:.0f} MB"
+        return text
+
+def _project_unit_rss(unit: WorkUnit, cfg: Config) -> Dict[str, Any]:
+    res = project_unit(unit, cfg)
+    res["peak_rss_mb"] = instrument.peak_rss_mb()
+    return res
+
+def _result_bytes(res: Dict[str, Any]) -> int:
+    """Bytes of the arrays a unit result carries back to the parent (Zarr projections)."""
+    return sum(int(getattr(a, "nbytes", 0)) for pair in res.get("projections", {}).values() for a in pair)
+
+def run_units_budgeted(units: List[WorkUnit], cfg: Config, workers: int, estimate: Callable[[WorkUnit], int],
+                       budget_bytes: int, stats: Optional[BudgetStats] = None) -> Iterator[Dict[str, Any]]:
+    """Like run_units, but admit units only while their estimated bytes fit in budget_bytes.
+
+    Units are admitted in order, up to `workers` at a time, while the sum
+    of estimate(unit) over units in flight stays within the budget; a unit
+    larger than the whole budget runs alone. Concurrency therefore follows
+    position size: many small positions run side by side, huge ones one at
+    a time. Results are yielded in unit order: results that finish ahead
+    of an earlier unit are held in the parent, and their arrays (the
+    projections of the Zarr backend) count against the budget until they
+    are yielded. Admission never runs more than 2 * workers units ahead of
+    the next result, so a slow unit cannot make the parent buffer the rest
+    of the run. stats, when given, is filled in as the run progresses (see
+    BudgetStats.summary()).
+    """
+    n = min(resolve_workers(workers), max(len(units), 1))
+    stats = stats if stats is not None else BudgetStats(budget_bytes, n)
+    stats.budget, stats.workers = int(budget_bytes), n
+    sizes = [int(estimate(u)) for u in units]
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=n) as ex:
+        inflight: Dict[Any, int] = {}   # future -> unit index
+        started: Dict[int, float] = {}
+        results: Dict[int, Dict[str, Any]] = {}
+        queue: Deque[int] = deque(range(len(units)))
+        in_bytes, nxt = 0, 0
+        t_last = time.perf_counter()
+        held: Dict[int, int] = {}  # unit index -> bytes of its buffered result
+        while nxt < len(units):
+            # admit in order while the head unit fits (or nothing is running), not too far ahead of nxt
+            while (queue and len(inflight) < n and queue[0] - nxt < 2 * n
+                   and (not inflight or in_bytes + sizes[queue[0]] <= budget_bytes)):
+                i = queue.popleft()
+                if sizes[i] > budget_bytes:
+                    stats.over_budget += 1
+                inflight[ex.submit(_project_unit_rss, units[i], cfg)] = i
+                started[i] = time.perf_counter()
+                in_bytes += sizes[i]
+                stats.units += 1
+                stats.largest_unit = max(stats.largest_unit, sizes[i])
+                stats.peak_bytes = max(stats.peak_bytes, in_bytes)
+                stats.peak_concurrency = max(stats.peak_concurrency, len(inflight))
+            if nxt not in results:
+                done, _ = wait(list(inflight), return_when=FIRST_COMPLETED)
+                now = time.perf_counter()
+                stats.busy_seconds += now - t_last
+                stats.byte_seconds += in_bytes * (now - t_last)
+                t_last = now
+                for fut in done:
+                    i = inflight.pop(fut)
+                    in_bytes -= sizes[i]
+                    stats.unit_seconds += now - started.pop(i)
+                    results[i] = fut.result()
+                    rss = results[i].pop("peak_rss_mb", None)
+                    if rss is not None:
+                        stats.worker_peak_rss_mb = max(stats.worker_peak_rss_mb or 0.0, rss)
+                    held[i] = _result_bytes(results[i])
+                    in_bytes += held[i]
+                stats.peak_bytes = max(stats.peak_bytes, in_bytes)
+                t_last = now
+            while nxt in results:
+                in_bytes -= held.pop(nxt)
+                yield results.pop(nxt)
+                nxt += 1
+    stats.wall_seconds = time.perf_counter() - t_start
+
+def run_units(units: List[WorkUnit], cfg: Config, workers: int) -> Iterator[Dict[str, Any]]:
+    """Project units on a process pool; results are yielded in unit order.
+
+    At most 2 * workers units are submitted ahead of the next result, so
+    results finished behind a slow unit (whole projections with the Zarr
+    backend) never pile up in the parent beyond that window.
+    """
+    n = min(resolve_workers(workers), max(len(units), 1))
+    if n <= 1:
+        for u in units:
+            yield project_unit(u, cfg)
+        return
+    with ProcessPoolExecutor(max_workers=n) as ex:
+        window: Deque[Any] = deque()
+        for u in units:
+            if len(window) >= 2 * n:
+                yield window.popleft().result()
+            window.append(ex.submit(project_unit, u, cfg))
+        while window:
+            yield window.popleft().result()
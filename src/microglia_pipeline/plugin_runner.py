@@ -1,19 +1,23 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import List, Optional
+from types import SimpleNamespace
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
 import importlib
 import inspect
+import numpy as np
 import pandas as pd
 
-# Fail-fast: require napari and npe2 (modern plugin system)
+# Fail-fast: require npe2 (modern plugin system); napari itself is only needed by the caller's Viewer
 try:
-    import napari  # type: ignore
     from npe2 import PluginManager  # type: ignore
 except Exception as e:
     raise ImportError(
-        "This pipeline requires napari and npe2 for plugin execution. Install them and restart."
+        "This pipeline requires npe2 for plugin execution. Install napari (which provides npe2) and restart."
     ) from e
 
+from .preprocess import atomic_path, write_tiff
+
 def _get_layer_by_name(viewer, name: str):
     try:
         return viewer.layers[name]
@@ -27,25 +31,252 @@ def _new_layers_since(viewer, baseline_names: List[str]):
     existing = set(baseline_names)
     return [l for l in viewer.layers if str(l.name) not in existing]
 
-def save_labels_layer(layer, out_path: Path) -> None:
-    import numpy as np, tifffile as tiff
+def label_dtype(labels: np.ndarray) -> np.dtype:
+    """Smallest integer dtype holding every label (unsigned unless labels are negative)."""
+    if labels.size == 0:
+        return np.dtype(np.uint8)
+    lo, hi = int(labels.min()), int(labels.max())
+    cands = (np.uint8, np.uint16, np.uint32, np.uint64) if lo >= 0 else (np.int8, np.int16, np.int32, np.int64)
+    for c in cands:
+        info = np.iinfo(c)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(c)
+    return np.dtype(cands[-1])
+
+def save_labels_layer(layer, out_path: Path, tiff_opts: Optional[Dict[str, Any]] = None) -> None:
+    """Labels TIFF in the smallest integer dtype that holds the max label."""
     arr = getattr(layer, "data", None)
     if arr is None:
         return
-    tiff.imwrite(str(out_path), (arr.astype("uint32")))
+    arr = np.asarray(arr)
+    dtype = label_dtype(arr)
+    write_tiff(out_path, arr if arr.dtype == dtype else arr.astype(dtype), tiff_opts)
+
+SHAPES_FORMATS = ("csv", "npz")
+
+def shapes_table(shapes) -> Tuple[np.ndarray, np.ndarray]:
+    """(vertices (N, D) float64, offsets (n_shapes + 1,)) with shape i at vertices[offsets[i]:offsets[i + 1]]."""
+    arrays = [np.asarray(s, dtype=np.float64).reshape(len(s), -1) for s in shapes]
+    counts = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    ndim = max((a.shape[1] for a in arrays), default=2)
+    vertices = np.concatenate(arrays) if arrays else np.empty((0, ndim))
+    return vertices, offsets
 
-def save_shapes_layer(layer, out_csv: Path) -> None:
-    rows = []
+def save_shapes_layer(layer, out_path: Path, fmt: str = "csv") -> None:
+    """Shapes as one row per vertex (csv) or as vertices + offsets arrays (npz).
+
+    csv columns: shape_index, vertex_index, [d0..], y, x, then the layer's
+    per-shape features. npz holds float32 'vertices', int64 'offsets' and,
+    when available, 'shape_type'; read it back with load_shapes_npz().
+    """
+    shapes = list(getattr(layer, "data", []))
+    vertices, offsets = shapes_table(shapes)
+    if fmt == "npz":
+        extra = {}
+        shape_type = getattr(layer, "shape_type", None)
+        if shape_type is not None and len(shape_type) == len(shapes):
+            extra["shape_type"] = np.asarray(shape_type, dtype=str)
+        with atomic_path(out_path) as tmp:
+            np.savez_compressed(tmp, vertices=vertices.astype(np.float32), offsets=offsets, **extra)
+        return
+    if fmt != "csv":
+        raise ValueError(f"Unknown shapes format '{fmt}' (expected one of {', '.join(SHAPES_FORMATS)}).")
+    counts = np.diff(offsets)
+    shape_index = np.repeat(np.arange(len(shapes)), counts)
+    cols: Dict[str, Any] = {
+        "shape_index": shape_index,
+        "vertex_index": np.arange(len(vertices)) - np.repeat(offsets[:-1], counts),
+    }
+    ndim = vertices.shape[1]
+    names = [f"d{k}" for k in range(ndim - 2)] + ["y", "x"]
+    for k, name in enumerate(names[-ndim:]):
+        cols[name] = vertices[:, k]
+    df = pd.DataFrame(cols)
     feats = getattr(layer, "features", None)
-    for i, shape in enumerate(getattr(layer, "data", [])):
-        for j, (y, x) in enumerate(shape):
-            rows.append({"shape_index": i, "vertex_index": j, "y": float(y), "x": float(x)})
-    df = pd.DataFrame(rows)
-    if feats is not None and len(feats) == len(getattr(layer, "data", [])):
-        feats = feats.copy()
-        feats["shape_index"] = range(len(feats))
-        df = df.merge(feats, on="shape_index", how="left")
-    df.to_csv(out_csv, index=False)
+    if feats is not None and len(feats) == len(shapes):
+        # one row per shape -> broadcast to its vertices by position, no merge
+        feats = pd.DataFrame(feats).drop(columns="shape_index", errors="ignore").reset_index(drop=True)
+        df = pd.concat([df, feats.iloc[shape_index].reset_index(drop=True)], axis=1)
+    with atomic_path(out_path) as tmp:
+        df.to_csv(tmp, index=False)
+
+def save_features(features, out_path: Path) -> None:
+    """Per-object features table as CSV (written atomically like every other output)."""
+    with atomic_path(out_path) as tmp:
+        pd.DataFrame(features).to_csv(tmp, index=False)
+
+def load_shapes_npz(path: Path) -> List[np.ndarray]:
+    """Shapes saved with save_shapes_layer(fmt='npz') as a list of (n_vertices, D) arrays."""
+    with np.load(path) as z:
+        vertices, offsets = z["vertices"], z["offsets"]
+    return [vertices[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+def snapshot_layer(layer) -> Optional[SimpleNamespace]:
+    """Copy what save_layer_snapshot needs from a layer, on the GUI thread.
+
+    The copy decouples background saving from later edits to the layer.
+    Returns None for layers that produce no outputs.
+    """
+    kind = layer.__class__.__name__.lower()
+    data = getattr(layer, "data", None)
+    if kind == "labels" and data is not None:
+        data = np.array(data, copy=True)
+    elif kind == "shapes":
+        data = [np.array(s, copy=True) for s in (data or [])]
+    else:
+        data = None
+    feats = getattr(layer, "features", None)
+    feats = pd.DataFrame(feats).copy() if feats is not None and len(feats) else None
+    if data is None and feats is None:
+        return None
+    shape_type = getattr(layer, "shape_type", None) if kind == "shapes" else None
+    return SimpleNamespace(kind=kind, data=data, features=feats,
+                           shape_type=list(shape_type) if shape_type is not None else None)
+
+def save_layer_snapshot(snap: SimpleNamespace, xy_dir: Path, tiff_opts: Optional[Dict[str, Any]] = None,
+                        shapes_format: str = "csv") -> None:
+    """Persist a snapshot_layer() copy with the same file names as save_plugin_outputs."""
+    if snap.kind == "labels" and snap.data is not None:
+        save_labels_layer(snap, xy_dir / "segmentation_labels.tif", tiff_opts=tiff_opts)
+    elif snap.kind == "shapes" and snap.data is not None:
+        save_shapes_layer(snap, xy_dir / f"shapes.{shapes_format}", fmt=shapes_format)
+    if snap.features is not None:
+        save_features(snap.features, xy_dir / "features.csv")
+
+@dataclass(frozen=True)
+class ResolvedCommand:
+    cmd: Any                          # npe2 command (cmd.exec runs it against a viewer)
+    func: Callable[..., Any]          # the command's python callable
+    arg_map: List[Tuple[str, str]]    # (callable parameter, base kwarg) pairs
+    required: FrozenSet[str]          # parameters without a default
+
+class PluginResolver:
+    """Per-process cache of npe2 discovery and resolved plugin commands.
+
+    Discovery and the manifest walk run once; each command's callable is
+    imported and its signature inspected once, leaving a (parameter, source)
+    argument map. The command that last succeeded is tried first; a cached
+    command is dropped only when it fails.
+    """
+
+    def __init__(self, plugin_name: str, preferred_command_ids: Optional[List[str]] = None):
+        self.plugin_name = plugin_name
+        self.preferred_command_ids = list(preferred_command_ids or [])
+        self.last_good: Optional[str] = None
+        self._pm = None
+        self._ordered: Optional[List[str]] = None
+        self._resolved: Dict[str, ResolvedCommand] = {}
+
+    @property
+    def pm(self):
+        if self._pm is None:
+            self._pm = PluginManager.instance()
+            self._pm.discover()
+        return self._pm
+
+    def candidates(self) -> List[str]:
+        """Command IDs to try: explicit preferred first, then those of manifests matching plugin_name."""
+        if self._ordered is not None:
+            return self._ordered
+        pm = self.pm
+        candidates: List[str] = list(self.preferred_command_ids)
+        for mani in pm.iter_manifests():
+            if self.plugin_name.lower() in mani.name.lower():
+                for cmd in (mani.contributions.commands or []):
+                    if cmd.id:  # type: ignore[attr-defined]
+                        candidates.append(cmd.id)
+
+        # De-dupe, preserve order
+        seen = set(); ordered: List[str] = []
+        for c in candidates:
+            if c and c not in seen:
+                ordered.append(c); seen.add(c)
+
+        if not ordered:
+            # Prepare helpful diagnostics: list available manifests and commands
+            manifests = [m.name for m in pm.iter_manifests()]
+            available_cmds = []
+            for m in pm.iter_manifests():
+                for c in (m.contributions.commands or []):
+                    available_cmds.append(f"{m.name}:{c.id}")
+            raise RuntimeError(
+                (
+                    f"No npe2 commands found for plugin '{self.plugin_name}'.\n"
+                    f"Installed manifests: {manifests}\n"
+                    f"Available commands (name:id): {available_cmds[:50]}{' ...' if len(available_cmds)>50 else ''}\n"
+                    f"Ensure your plugin is installed and contributes commands, or set explicit command IDs in config.plugin.command_ids."
+                )
+            )
+        self._ordered = ordered
+        return ordered
+
+    def ordered(self) -> List[str]:
+        """candidates() with the last successful command moved to the front."""
+        ordered = self.candidates()
+        if self.last_good in ordered:
+            return [self.last_good] + [c for c in ordered if c != self.last_good]
+        return ordered
+
+    def resolve(self, cid: str) -> ResolvedCommand:
+        """Cached ResolvedCommand; raises LookupError/ValueError when unresolvable."""
+        hit = self._resolved.get(cid)
+        if hit is not None:
+            return hit
+        try:
+            cmd = self.pm.get_command(cid)
+        except KeyError:
+            cmd = None
+        if not cmd:
+            raise LookupError("not found")
+
+        # Resolve underlying callable from python_name to filter parameters accurately
+        try:
+            pyname = getattr(cmd, "python_name", None)
+            if not pyname or ":" not in pyname:
+                raise ValueError("Command has no valid python_name")
+            mod_name, func_name = pyname.split(":", 1)
+            mod = importlib.import_module(mod_name)
+            func = getattr(mod, func_name)
+            params = inspect.signature(func).parameters
+        except Exception as e:
+            raise ValueError(f"failed to resolve callable - {e}") from e
+        required = frozenset(n for n, prm in params.items() if prm.default is inspect.Parameter.empty
+                             and prm.kind not in (prm.VAR_POSITIONAL, prm.VAR_KEYWORD))
+        hit = self._resolved[cid] = ResolvedCommand(cmd, func, _argument_map(set(params)), required)
+        return hit
+
+    def drop(self, cid: str) -> None:
+        self._resolved.pop(cid, None)
+        if self.last_good == cid:
+            self.last_good = None
+
+_RESOLVERS: Dict[Tuple[str, Tuple[str, ...]], PluginResolver] = {}
+
+def get_resolver(plugin_name: str, preferred_command_ids: Optional[List[str]] = None) -> PluginResolver:
+    """Process-wide PluginResolver for this plugin name and preferred command IDs."""
+    key = (plugin_name, tuple(preferred_command_ids or []))
+    resolver = _RESOLVERS.get(key)
+    if resolver is None:
+        resolver = _RESOLVERS[key] = PluginResolver(plugin_name, preferred_command_ids)
+    return resolver
+
+_BASE_ARGS = ("viewer", "image", "nuclei", "output_dir")
+
+def _argument_map(allowed) -> List[Tuple[str, str]]:
+    """(callable parameter, base kwarg) pairs for the parameters a command accepts."""
+    pairs = [(k, k) for k in _BASE_ARGS if k in allowed]
+    have = {k for k, _ in pairs}
+    # Support common alias names (some plugins expect napari_viewer instead of viewer)
+    if "viewer" in have and "napari_viewer" in allowed:
+        pairs.append(("napari_viewer", "viewer"))
+    # Some commands may use 'image_layer' or 'nuclei_layer'
+    if "image" in have and "image_layer" in allowed:
+        pairs.append(("image_layer", "image"))
+    if "nuclei" in have and "nuclei_layer" in allowed:
+        pairs.append(("nuclei_layer", "nuclei"))
+    return pairs
 
 def try_run_plugin(
     viewer,
@@ -58,41 +289,11 @@ def try_run_plugin(
     """
     Strict npe2-only execution. Discover and execute commands matching the
     given plugin. Fail fast on missing commands or no outputs.
+    Discovery and command resolution are cached per process (get_resolver).
     """
     baseline = [str(l.name) for l in viewer.layers]
-
-    pm = PluginManager.instance()
-    pm.discover()
-
-    # Build candidate command IDs: explicit preferred first, then those from manifests filtered by plugin name
-    candidates: List[str] = list(preferred_command_ids or [])
-    for mani in pm.iter_manifests():
-        if plugin_name.lower() in mani.name.lower():
-            for cmd in (mani.contributions.commands or []):
-                if cmd.id:  # type: ignore[attr-defined]
-                    candidates.append(cmd.id)
-
-    # De-dupe, preserve order
-    seen = set(); ordered: List[str] = []
-    for c in candidates:
-        if c and c not in seen:
-            ordered.append(c); seen.add(c)
-
-    if not ordered:
-        # Prepare helpful diagnostics: list available manifests and commands
-        manifests = [m.name for m in pm.iter_manifests()]
-        available_cmds = []
-        for m in pm.iter_manifests():
-            for c in (m.contributions.commands or []):
-                available_cmds.append(f"{m.name}:{c.id}")
-        raise RuntimeError(
-            (
-                f"No npe2 commands found for plugin '{plugin_name}'.\n"
-                f"Installed manifests: {manifests}\n"
-                f"Available commands (name:id): {available_cmds[:50]}{' ...' if len(available_cmds)>50 else ''}\n"
-                f"Ensure your plugin is installed and contributes commands, or set explicit command IDs in config.plugin.command_ids."
-            )
-        )
+    resolver = get_resolver(plugin_name, preferred_command_ids)
+    ordered = resolver.ordered()
 
     # Prepare common argument mappings
     base_kwargs = {
@@ -105,49 +306,25 @@ def try_run_plugin(
     errors: List[str] = []
     for cid in ordered:
         try:
-            cmd = pm.get_command(cid)
-        except KeyError as e:
-            errors.append(f"{cid}: not found")
-            continue
-        if not cmd:
-            errors.append(f"{cid}: not found")
-            continue
-
-        # Resolve underlying callable from python_name to filter parameters accurately
-        func = None
-        try:
-            pyname = getattr(cmd, "python_name", None)
-            if not pyname or ":" not in pyname:
-                raise ValueError("Command has no valid python_name")
-            mod_name, func_name = pyname.split(":", 1)
-            mod = importlib.import_module(mod_name)
-            func = getattr(mod, func_name)
-            sig = inspect.signature(func)
-            allowed = set(sig.parameters.keys())
+            rc = resolver.resolve(cid)
         except Exception as e:
-            errors.append(f"{cid}: failed to resolve callable - {e}")
+            errors.append(f"{cid}: {e}")
             continue
 
-        # Support common alias names (some plugins expect napari_viewer instead of viewer)
-        call_kwargs = {k: v for k, v in base_kwargs.items() if k in allowed}
-        if "viewer" in call_kwargs and "napari_viewer" in allowed and "napari_viewer" not in call_kwargs:
-            call_kwargs["napari_viewer"] = call_kwargs["viewer"]
-        # Some commands may use 'image_layer' or 'nuclei_layer'
-        if "image" in call_kwargs and "image_layer" in allowed and "image_layer" not in call_kwargs:
-            call_kwargs["image_layer"] = call_kwargs["image"]
-        if "nuclei" in call_kwargs and "nuclei_layer" in allowed and "nuclei_layer" not in call_kwargs:
-            call_kwargs["nuclei_layer"] = call_kwargs["nuclei"]
-
+        call_kwargs = {param: base_kwargs[src] for param, src in rc.arg_map}
         try:
-            cmd.exec(call_kwargs)
+            rc.cmd.exec(call_kwargs)
         except Exception as e:
+            resolver.drop(cid)
             errors.append(f"{cid}: execution error - {e}")
             continue
 
         new_layers = _new_layers_since(viewer, baseline)
         if new_layers:
+            resolver.last_good = cid
             return True
         else:
+            resolver.drop(cid)
             errors.append(f"{cid}: executed but produced no new layers")
 
     raise RuntimeError(
@@ -159,18 +336,19 @@ def try_run_plugin(
         + "; ".join(errors)
     )
 
-def save_plugin_outputs(viewer, out_dir: Path, only_new_from: list[str]) -> None:
+def save_plugin_outputs(viewer, out_dir: Path, only_new_from: list[str],
+                        tiff_opts: Optional[Dict[str, Any]] = None, shapes_format: str = "csv") -> None:
     before = set(only_new_from)
     for layer in list(viewer.layers):
         if str(layer.name) in before:
             continue
         try:
             if layer.__class__.__name__.lower() == "labels":
-                save_labels_layer(layer, out_dir / "segmentation_labels.tif")
+                save_labels_layer(layer, out_dir / "segmentation_labels.tif", tiff_opts=tiff_opts)
             elif layer.__class__.__name__.lower() == "shapes":
-                save_shapes_layer(layer, out_dir / "shapes.csv")
+                save_shapes_layer(layer, out_dir / f"shapes.{shapes_format}", fmt=shapes_format)
             feats = getattr(layer, "features", None)
             if feats is not None and len(feats):
-                pd.DataFrame(feats).to_csv(out_dir / "features.csv", index=False)
+                save_features(feats, out_dir / "features.csv")
         except Exception:
             continue
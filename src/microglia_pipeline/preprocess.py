@@ -1,8 +1,16 @@
 from __future__ import annotations
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import io
+import os
+import queue
+import threading
 import numpy as np
 import tifffile as tiff
 
+from . import instrument
+
 def ensure_dir(path: Path) -> Path:
     path.mkdir(parents=True, exist_ok=True)
     return path
@@ -10,7 +18,502 @@ def ensure_dir(path: Path) -> Path:
 def max_proj(stack: np.ndarray, axis: int) -> np.ndarray:
     return np.max(stack, axis=axis)
 
-def save_xy_mips(out_xy_dir: Path, egfp_mip: np.ndarray, nuc_mip: np.ndarray) -> None:
+REDUCTIONS = ("max", "min", "mean", "sum", "std")  # plus percentiles spelled "p<q>", e.g. "p99"
+
+def parse_reductions(spec) -> List[str]:
+    """Normalize a projection spec (str or list of str) into validated reduction names."""
+    names = [spec] if isinstance(spec, str) else list(spec or [])
+    out: List[str] = []
+    for raw in names:
+        name = str(raw).strip().lower()
+        if name not in REDUCTIONS:
+            try:
+                q = float(name[1:]) if name.startswith("p") else None
+            except ValueError:
+                q = None
+            if q is None or not 0.0 <= q <= 100.0:
+                raise ValueError(
+                    f"Unknown projection '{raw}'. Use {', '.join(REDUCTIONS)} or a percentile like 'p99'."
+                )
+        if name not in out:
+            out.append(name)
+    if not out:
+        raise ValueError("At least one projection is required.")
+    return out
+
+def _acc_dtype(dtype: np.dtype, bound: int) -> np.dtype:
+    """Smallest integer dtype of dtype's kind (no narrower than dtype) holding |values| <= bound."""
+    cands = (np.uint16, np.uint32, np.uint64) if dtype.kind in "ub" else (np.int16, np.int32, np.int64)
+    for c in cands:
+        if np.dtype(c).itemsize >= dtype.itemsize and bound <= np.iinfo(c).max:
+            return np.dtype(c)
+    return np.dtype(cands[-1])
+
+class ZProjector:
+    """Compute a set of Z reductions in a single pass over Z chunks.
+
+    Chunks are fed in Z order with update(); each is folded into per-pixel
+    accumulators and can be dropped afterwards. Integer stacks are summed in
+    the narrowest integer dtype that cannot overflow (exact mean/std without a
+    float64 copy of the stack); float stacks accumulate in float64 planes.
+    Percentiles (linear interpolation, as np.percentile) keep only the
+    min(k, n - k) + 1 planes per pixel needed for the order statistic.
+
+    Output dtypes: max/min keep the input dtype, sum uses the accumulator
+    dtype, mean/std/percentiles are float32.
+    """
+
+    def __init__(self, reductions, n_z: int, dtype, axis: int = 0):
+        self.reductions = parse_reductions(reductions)
+        self.n_z = int(n_z)
+        self.dtype = np.dtype(dtype)
+        self.axis = axis
+        self.seen = 0
+        self._max = self._min = self._s1 = self._s2 = None
+        need = set(self.reductions)
+        self._want_s1 = bool(need & {"mean", "sum", "std"})
+        self._want_s2 = "std" in need
+        if self.dtype.kind == "f":
+            self._s1_dtype = self._s2_dtype = np.dtype(np.float64)
+        else:
+            info = np.iinfo(self.dtype)
+            peak = max(abs(int(info.min)), int(info.max))
+            self._s1_dtype = _acc_dtype(self.dtype, peak * self.n_z)
+            self._s2_dtype = np.dtype(np.uint64 if self.dtype.kind in "ub" else np.int64)
+        # percentile name -> [keep_top, m, lo, hi, frac, buffer]
+        self._pct: Dict[str, list] = {}
+        for name in self.reductions:
+            if name not in REDUCTIONS:
+                pos = float(name[1:]) / 100.0 * (self.n_z - 1)
+                lo, hi = int(np.floor(pos)), int(np.ceil(pos))
+                keep_top = (self.n_z - lo) <= (hi + 1)
+                m = self.n_z - lo if keep_top else hi + 1
+                self._pct[name] = [keep_top, m, lo, hi, pos - lo, None]
+
+    def update(self, chunk: np.ndarray) -> None:
+        chunk = np.moveaxis(np.asarray(chunk), self.axis, 0)
+        if chunk.shape[0] == 0:
+            return
+        self.seen += chunk.shape[0]
+        if "max" in self.reductions:
+            part = chunk.max(axis=0)
+            self._max = part if self._max is None else np.maximum(self._max, part, out=self._max)
+        if "min" in self.reductions:
+            part = chunk.min(axis=0)
+            self._min = part if self._min is None else np.minimum(self._min, part, out=self._min)
+        if self._want_s1:
+            part = chunk.sum(axis=0, dtype=self._s1_dtype)
+            self._s1 = part if self._s1 is None else np.add(self._s1, part, out=self._s1)
+        if self._want_s2:
+            if self._s2 is None:
+                self._s2 = np.zeros(chunk.shape[1:], dtype=self._s2_dtype)
+            for plane in chunk:
+                sq = plane.astype(self._s2_dtype)
+                sq *= sq
+                self._s2 += sq
+        for state in self._pct.values():
+            keep_top, m, _, _, _, buf = state
+            cat = chunk if buf is None else np.concatenate([buf, chunk], axis=0)
+            if cat.shape[0] > m:
+                if keep_top:
+                    cat = np.partition(cat, cat.shape[0] - m, axis=0)[-m:]
+                else:
+                    cat = np.partition(cat, m - 1, axis=0)[:m]
+            state[5] = np.array(cat, copy=True) if cat is chunk else cat
+
+    def results(self) -> Dict[str, np.ndarray]:
+        if self.seen != self.n_z:
+            raise ValueError(f"ZProjector expected {self.n_z} planes, received {self.seen}.")
+        out: Dict[str, np.ndarray] = {}
+        for name in self.reductions:
+            if name == "max":
+                out[name] = self._max
+            elif name == "min":
+                out[name] = self._min
+            elif name == "sum":
+                out[name] = self._s1
+            elif name == "mean":
+                out[name] = (self._s1 / self.n_z).astype(np.float32)
+            elif name == "std":
+                mean = self._s1 / self.n_z
+                var = self._s2 / self.n_z - mean * mean
+                out[name] = np.sqrt(np.clip(var, 0, None)).astype(np.float32)
+            else:
+                keep_top, m, lo, hi, frac, buf = self._pct[name]
+                buf = np.sort(buf, axis=0)
+                base = lo - (self.n_z - m) if keep_top else lo
+                a = buf[base].astype(np.float64)
+                b = buf[base + (hi - lo)].astype(np.float64)
+                out[name] = (a + (b - a) * frac).astype(np.float32)
+        return out
+
+def project_z(chunks: Iterable[np.ndarray], reductions, n_z: int, dtype, axis: int) -> Dict[str, np.ndarray]:
+    """Single pass of ZProjector over an iterable of Z chunks."""
+    proj = ZProjector(reductions, n_z, dtype, axis=axis)
+    for chunk in chunks:
+        proj.update(chunk)
+    return proj.results()
+
+class BackgroundWriter:
+    """Run write jobs on one background thread behind a bounded queue.
+
+    submit() blocks while max_pending jobs are queued (backpressure caps the
+    number of projections held in memory). The first writer error is re-raised
+    on the next submit() or on close(); later jobs are dropped once a write
+    has failed. Submitted arrays must not be modified afterwards.
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_pending: int = 2):
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="mip-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is self._STOP:
+                    return
+                if self._error is None:
+                    fn, args = job
+                    fn(*args)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending(self) -> None:
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise RuntimeError(f"Background TIFF write failed: {err}") from err
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> None:
+        self._raise_pending()
+        if not self._thread.is_alive():
+            raise RuntimeError("BackgroundWriter is closed.")
+        self._queue.put((instrument.current().bind(fn), args))
+
+    def flush(self) -> None:
+        """Block until every submitted write has finished; surface any writer error."""
+        self._queue.join()
+        self._raise_pending()
+
+    def close(self) -> None:
+        """Wait for queued writes to finish and surface any writer error."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        self._raise_pending()
+
+    def __enter__(self) -> "BackgroundWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # already unwinding: drain quietly so the original exception wins
+        try:
+            self.close()
+        except Exception:
+            pass
+
+class CoalescingWriter:
+    """Run keyed save jobs on one background thread, keeping only the newest job per key.
+
+    submit(key, fn, *args) replaces a still-queued job with the same key, so
+    repeated saves of the same output write once with the latest snapshot.
+    Unlike BackgroundWriter, failures do not stop the queue: each is kept in
+    errors (and passed to on_error) and later jobs still run.
+    """
+
+    def __init__(self, on_error: Optional[Callable[[Any, BaseException], None]] = None):
+        self.errors: List[tuple] = []
+        self._on_error = on_error
+        self._jobs: Dict[Any, tuple] = {}  # insertion ordered; key -> (fn, args)
+        self._running = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="layer-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                key = next(iter(self._jobs))
+                fn, args = self._jobs.pop(key)
+                self._running = 1
+            try:
+                fn(*args)
+            except Exception as e:
+                self.errors.append((key, e))
+                if self._on_error is not None:
+                    self._on_error(key, e)
+            finally:
+                with self._cond:
+                    self._running = 0
+                    self._cond.notify_all()
+
+    def submit(self, key: Any, fn: Callable[..., Any], *args: Any) -> None:
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("CoalescingWriter is closed.")
+            self._jobs.pop(key, None)  # re-queue at the back with the newest snapshot
+            self._jobs[key] = (fn, args)
+            self._cond.notify_all()
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._jobs) + self._running
+
+    def status(self) -> str:
+        n, failed = self.pending, len(self.errors)
+        text = f"{n} save(s) pending" if n else "all saved"
+        return f"{text}, {failed} failed (last: {self.errors[-1][1]})" if failed else text
+
+    def flush(self) -> None:
+        """Block until every queued save has run."""
+        with self._cond:
+            while self._jobs or self._running:
+                self._cond.wait()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+def open_writer(max_pending: int):
+    """BackgroundWriter context, or a no-op context yielding None when max_pending is 0."""
+    return BackgroundWriter(max_pending) if max_pending > 0 else nullcontext()
+
+TIFF_COMPRESSIONS = ("none", "zlib", "deflate", "zstd", "lzw", "lzma")
+
+def tiff_options(compression: str = "none", level: Optional[int] = None, predictor: bool = True) -> Dict[str, Any]:
+    """Validated TIFF compression settings for write_tiff (zstd/lzw need imagecodecs)."""
+    compression = (compression or "none").lower()
+    if compression not in TIFF_COMPRESSIONS:
+        raise ValueError(f"Unknown TIFF compression '{compression}' (expected one of {', '.join(TIFF_COMPRESSIONS)}).")
+    opts = dict(compression=compression, level=level, predictor=bool(predictor))
+    if compression != "none":
+        # fail fast on codecs that this tifffile install cannot encode
+        try:
+            tiff.imwrite(io.BytesIO(), np.zeros((2, 2), dtype=np.uint16), **_imwrite_kwargs(np.uint16, opts))
+        except Exception as e:
+            raise ValueError(f"TIFF compression '{compression}' is unavailable ({e}); install imagecodecs.") from e
+    return opts
+
+def _imwrite_kwargs(dtype, tiff_opts: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not tiff_opts or tiff_opts.get("compression", "none") == "none":
+        return {}
+    kw: Dict[str, Any] = dict(compression=tiff_opts["compression"])
+    if tiff_opts.get("level") is not None and tiff_opts["compression"] != "lzw":
+        kw["compressionargs"] = dict(level=int(tiff_opts["level"]))
+    # horizontal differencing helps smooth integer images; float predictors need imagecodecs
+    if tiff_opts.get("predictor") and np.dtype(dtype).kind in "iu":
+        kw["predictor"] = "horizontal"
+    return kw
+
+@contextmanager
+def atomic_path(path: Path) -> Iterator[Path]:
+    """Temporary sibling of path that replaces path only if the block succeeds.
+
+    An interrupted write leaves at most a hidden '.<name>.<pid>-<tid>.part<suffix>'
+    file behind, never a truncated file under the final name.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.part{path.suffix}")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+def write_tiff(path: Path, data: np.ndarray, tiff_opts: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+    data = np.asarray(data)
+    rec = instrument.current()
+    with rec.stage("write"), atomic_path(path) as tmp:
+        tiff.imwrite(str(tmp), data, **kwargs, **_imwrite_kwargs(data.dtype, tiff_opts))
+    if rec.enabled:
+        rec.add("bytes_written", Path(path).stat().st_size)
+
+def write_mip(path: Path, mip: np.ndarray, tiff_opts: Optional[Dict[str, Any]] = None) -> None:
+    write_tiff(path, mip, tiff_opts, photometric="minisblack")
+
+def _write(writer: Optional[BackgroundWriter], path: Path, mip: np.ndarray,
+           tiff_opts: Optional[Dict[str, Any]] = None) -> None:
+    if writer is None:
+        write_mip(path, mip, tiff_opts)
+    else:
+        writer.submit(write_mip, path, mip, tiff_opts)
+
+def save_xy_mips(out_xy_dir: Path, egfp_mip: np.ndarray, nuc_mip: np.ndarray,
+                 writer: Optional[BackgroundWriter] = None, tiff_opts: Optional[Dict[str, Any]] = None) -> tuple[Path, Path]:
     ensure_dir(out_xy_dir)
-    tiff.imwrite(str(out_xy_dir / "mip_egfp.tif"), np.asarray(egfp_mip), photometric="minisblack")
-    tiff.imwrite(str(out_xy_dir / "mip_nuc.tif"),  np.asarray(nuc_mip),  photometric="minisblack")
+    _write(writer, out_xy_dir / "mip_egfp.tif", egfp_mip, tiff_opts)
+    _write(writer, out_xy_dir / "mip_nuc.tif",  nuc_mip,  tiff_opts)
+    return out_xy_dir / "mip_egfp.tif", out_xy_dir / "mip_nuc.tif"
+
+def save_xy_projections(out_xy_dir: Path, projections: Dict[str, tuple],
+                        writer: Optional[BackgroundWriter] = None, tiff_opts: Optional[Dict[str, Any]] = None) -> List[Path]:
+    """Nested layout: 'max' as mip_egfp/mip_nuc.tif, other reductions under XY_###/<name>/.
+
+    Returns all paths written.
+    """
+    paths: List[Path] = []
+    for name, (egfp, nuc) in projections.items():
+        if name == "max":
+            paths.extend(save_xy_mips(out_xy_dir, egfp, nuc, writer=writer, tiff_opts=tiff_opts))
+        else:
+            sub = ensure_dir(out_xy_dir / name)
+            _write(writer, sub / "egfp.tif", egfp, tiff_opts)
+            _write(writer, sub / "nuc.tif",  nuc,  tiff_opts)
+            paths.extend([sub / "egfp.tif", sub / "nuc.tif"])
+    return paths
+
+def flat_mip_paths(out_root: Path, nd2_stem: str, xy_index: int, reduction: str = "max") -> tuple[Path, Path]:
+    """(egfp, nuc) paths of one position in the flat layout under out_root.
+
+    'max' lives directly in out_root/egfp and out_root/nuc; every other
+    reduction gets its own subtree, e.g. out_root/mean/egfp.
+    """
+    name = f"{nd2_stem}_XY{xy_index:03d}.tif"
+    root = out_root if reduction == "max" else out_root / reduction
+    return root / "egfp" / name, root / "nuc" / name
+
+def save_flat_mips(out_root: Path, nd2_stem: str, xy_index: int, egfp_mip: np.ndarray, nuc_mip: np.ndarray,
+                   writer: Optional[BackgroundWriter] = None, reduction: str = "max",
+                   tiff_opts: Optional[Dict[str, Any]] = None) -> tuple[Path, Path]:
+    egfp_path, nuc_path = flat_mip_paths(out_root, nd2_stem, xy_index, reduction)
+    ensure_dir(egfp_path.parent); ensure_dir(nuc_path.parent)
+    _write(writer, egfp_path, egfp_mip, tiff_opts)
+    _write(writer, nuc_path,  nuc_mip,  tiff_opts)
+    return egfp_path, nuc_path
+
+def save_flat_projections(out_root: Path, nd2_stem: str, xy_index: int, projections: Dict[str, tuple],
+                          writer: Optional[BackgroundWriter] = None,
+                          tiff_opts: Optional[Dict[str, Any]] = None) -> List[Path]:
+    """Write every (egfp, nuc) reduction of one position; returns all paths written."""
+    paths: List[Path] = []
+    for name, (egfp, nuc) in projections.items():
+        paths.extend(save_flat_mips(out_root, nd2_stem, xy_index, egfp, nuc, writer=writer, reduction=name,
+                                    tiff_opts=tiff_opts))
+    return paths
+
+class TiledTiffWriter:
+    """Stream tiles into one tiled TIFF without ever holding the whole image.
+
+    put() tiles in row-major order (edge tiles may be smaller than tile);
+    tifffile encodes them on a background thread that pulls from a queue of
+    at most max_pending tiles. The file replaces path only once close()
+    succeeds; abort() discards it.
+    """
+
+    _END = object()
+    _ABORT = object()
+
+    def __init__(self, path: Path, shape: tuple, dtype, tile: int,
+                 tiff_opts: Optional[Dict[str, Any]] = None, max_pending: int = 2):
+        self.path = Path(path)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self._error: Optional[BaseException] = None
+        kwargs = dict(shape=tuple(shape), dtype=np.dtype(dtype), tile=(int(tile), int(tile)),
+                      photometric="minisblack", **_imwrite_kwargs(dtype, tiff_opts))
+        self._thread = threading.Thread(target=instrument.current().bind(self._run), args=(kwargs,),
+                                        name="tile-writer", daemon=True)
+        self._thread.start()
+
+    def _tiles(self) -> Iterator[np.ndarray]:
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            if item is self._ABORT:
+                raise RuntimeError("tiled write aborted")
+            yield item
+
+    def _run(self, kwargs: Dict[str, Any]) -> None:
+        try:
+            with atomic_path(self.path) as tmp:
+                tiff.imwrite(str(tmp), self._tiles(), **kwargs)
+            rec = instrument.current()
+            if rec.enabled:
+                rec.add("bytes_written", self.path.stat().st_size)
+        except BaseException as e:
+            self._error = e
+
+    def _put(self, item: Any) -> None:
+        # never block forever on a writer thread that has died
+        while True:
+            if self._error is not None or not self._thread.is_alive():
+                reason = self._error or "more tiles than the image holds"
+                raise RuntimeError(f"Tiled TIFF write to {self.path.name} failed: {reason}") from self._error
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, tile: np.ndarray) -> None:
+        self._put(np.asarray(tile))
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._put(self._END)  # tifffile stops pulling once it has every tile
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError(f"Tiled TIFF write to {self.path.name} failed: {self._error}") from self._error
+
+    def abort(self) -> None:
+        while self._thread.is_alive():
+            try:
+                self._queue.put(self._ABORT, timeout=0.1)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()  # make room; the pending tiles are discarded anyway
+                except queue.Empty:
+                    pass
+        self._thread.join()
+
+def save_flat_tiles(out_root: Path, nd2_stem: str, xy_index: int, shape: tuple, tiles: Iterable[tuple],
+                    tile: int, tiff_opts: Optional[Dict[str, Any]] = None) -> List[Path]:
+    """Write a tiled position (io_nd2.read_positions with tile > 0) to the flat layout.
+
+    tiles yields ((y0, x0), {reduction: (egfp, nuc)}) in row-major order; every
+    output is a tiled TIFF filled as the tiles arrive, at the same paths as
+    save_flat_projections. If tiles raises, no output is left behind.
+    Returns all paths written.
+    """
+    writers: Dict[Path, TiledTiffWriter] = {}
+    try:
+        for _, projections in tiles:
+            pieces = [(path, arr) for name, pair in projections.items()
+                      for path, arr in zip(flat_mip_paths(out_root, nd2_stem, xy_index, name), pair)]
+            for path, arr in pieces:
+                if path not in writers:
+                    ensure_dir(path.parent)
+                    writers[path] = TiledTiffWriter(path, shape, arr.dtype, tile, tiff_opts)
+                writers[path].put(arr)
+    except BaseException:
+        for w in writers.values():
+            w.abort()
+        raise
+    errors = []
+    for w in writers.values():
+        try:
+            w.close()
+        except RuntimeError as e:
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return list(writers)
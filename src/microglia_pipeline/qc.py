@@ -0,0 +1,144 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import csv
+import numpy as np
+
+from .preprocess import atomic_path
+
+QC_NAME = "qc.csv"
+QC_CHANNELS = ("egfp", "nuc")
+
+class QCAccumulator:
+    """Per-position QC metrics folded in from the Z chunks the projection already reads.
+
+    Chunks are (C, z, Y, X) views (C = the EGFP and nuclei channels). Every
+    metric is computed on a strided sample (every row_step-th row, every
+    second column), so the extra work is a small fixed fraction of the
+    decoded data and nothing is read twice:
+      - sat_frac: fraction of sampled voxels >= the saturation level
+        (default: the dtype maximum)
+      - p<q>: intensity percentiles of the sampled voxels (one histogram
+        for 8/16-bit stacks)
+      - background: most frequent sampled intensity (histogram mode)
+      - focus: per-plane normalized Brenner score, mean((I[x+2] - I[x])^2) /
+        mean(I)^2; focus_peak_z is the sharpest plane and focus_ratio its
+        score over the median plane's (~1 for a stack with no focused plane)
+    """
+
+    def __init__(self, n_z: int, dtype, n_channels: int = 2, saturation: Optional[float] = None,
+                 percentiles: Sequence[float] = (1, 50, 99), row_step: int = 16):
+        self.n_z = int(n_z)
+        self.dtype = np.dtype(dtype)
+        self.percentiles = [float(q) for q in percentiles]
+        self.row_step = max(1, int(row_step))
+        if saturation is None:
+            saturation = np.iinfo(self.dtype).max if self.dtype.kind in "ui" else np.inf
+        self.saturation = saturation
+        self.seen = 0
+        self.voxels = 0
+        self.saturated = np.zeros(n_channels, dtype=np.int64)
+        self.focus = np.zeros((n_channels, self.n_z), dtype=np.float64)
+        self._hist = self.dtype.kind == "u" and self.dtype.itemsize <= 2
+        self.counts = np.zeros((n_channels, 1 << (8 * self.dtype.itemsize)), dtype=np.int64) if self._hist else None
+        self._samples: List[np.ndarray] = []  # (C, n) samples not yet folded into counts
+        self._pending = 0
+
+    def update(self, chunk: np.ndarray) -> None:
+        # every second column: neighbours in the sample are the Brenner pairs I[x], I[x+2]
+        sub = np.ascontiguousarray(np.asarray(chunk)[..., ::self.row_step, ::2])
+        n_c, zc = sub.shape[:2]
+        if zc == 0:
+            return
+        self.voxels += sub[0].size
+        planes = sub.reshape(n_c, zc, -1)
+        if self._hist:
+            # histogram in batches: one bincount per ~1M samples, not per (thin) chunk
+            self._samples.append(planes.reshape(n_c, -1))
+            self._pending += planes[0].size
+            if self._pending >= 1 << 20:
+                self._fold()
+        else:
+            self.saturated += np.count_nonzero((planes >= self.saturation).reshape(n_c, -1), axis=1)
+            self._samples.append(planes.astype(np.float32))
+        if sub.shape[-1] > 1:
+            d = sub[..., 1:].astype(np.float32) - sub[..., :-1]
+            energy = np.einsum("czyx,czyx->cz", d, d, dtype=np.float64) / d[0, 0].size
+            mean = planes.sum(axis=2, dtype=np.float64) / planes.shape[2]
+            self.focus[:, self.seen:self.seen + zc] = energy / np.maximum(mean * mean, 1e-12)
+        self.seen += zc
+
+    def _fold(self) -> None:
+        if self._samples:
+            batch = np.concatenate(self._samples, axis=1)
+            for c in range(len(batch)):
+                self.counts[c] += np.bincount(batch[c], minlength=self.counts.shape[1])
+        self._samples, self._pending = [], 0
+
+    def _percentile(self, c: int, q: float) -> float:
+        if not self._hist:
+            return float(np.percentile(np.concatenate([s[c].ravel() for s in self._samples]), q))
+        cdf = np.cumsum(self.counts[c])
+        return float(np.searchsorted(cdf, q / 100.0 * (cdf[-1] - 1), side="right"))
+
+    def results(self, names: Sequence[str] = QC_CHANNELS) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        if self.seen == 0:
+            return out
+        if self._hist:
+            self._fold()
+            sat = int(np.ceil(self.saturation))
+            self.saturated = self.counts[:, sat:].sum(axis=1) if sat < self.counts.shape[1] \
+                else np.zeros(len(self.counts), dtype=np.int64)
+        for c, ch in enumerate(names):
+            out[f"{ch}_sat_frac"] = float(self.saturated[c] / max(self.voxels, 1))
+            for q in self.percentiles:
+                out[f"{ch}_p{q:g}"] = self._percentile(c, q)
+            if self._hist:
+                out[f"{ch}_background"] = float(np.argmax(self.counts[c]))
+            else:
+                vals = np.concatenate([s[c].ravel() for s in self._samples])
+                hist, edges = np.histogram(vals, bins=256)
+                out[f"{ch}_background"] = float((edges[np.argmax(hist)] + edges[np.argmax(hist) + 1]) / 2)
+            focus = self.focus[c, :self.seen]
+            out[f"{ch}_focus_peak_z"] = int(np.argmax(focus))
+            median = float(np.median(focus))
+            out[f"{ch}_focus_ratio"] = float(focus.max() / median) if median > 0 else float("nan")
+            out[f"{ch}_focus"] = ";".join(f"{v:.4g}" for v in focus)
+        return out
+
+def observe(chunks: Iterable[np.ndarray], acc: QCAccumulator, cdim: int, zdim: int) -> Iterator[np.ndarray]:
+    """Pass chunks through unchanged, folding each into acc as (C, z, Y, X)."""
+    for chunk in chunks:
+        a = np.moveaxis(np.asarray(chunk), (cdim, zdim), (0, 1))
+        acc.update(a.reshape(a.shape[0], a.shape[1], -1, a.shape[-1]))  # any extra axes fold into rows
+        yield chunk
+
+def read_qc_table(path: Path) -> List[Dict[str, Any]]:
+    """Rows of a qc.csv as dicts of strings ([] if it does not exist)."""
+    if not Path(path).exists():
+        return []
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def write_qc_table(output_root: Path, rows: Iterable[Dict[str, Any]], name: str = QC_NAME) -> Optional[Path]:
+    """Upsert rows keyed by (nd2, xy_index) into <output_root>/qc.csv; returns its path.
+
+    Positions not projected in this run keep their previous rows.
+    """
+    rows = list(rows)
+    if not rows:
+        return None
+    path = Path(output_root) / name
+    table: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for r in read_qc_table(path) + rows:
+        table[(str(r["nd2"]), int(r["xy_index"]))] = r
+    fields: List[str] = ["nd2", "xy_index"]
+    for r in table.values():
+        fields.extend(k for k in r if k not in fields)
+    with atomic_path(path) as tmp, open(tmp, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields)
+        w.writeheader()
+        for key in sorted(table):
+            w.writerow(table[key])
+    return path
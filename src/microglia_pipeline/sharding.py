@@ -0,0 +1,158 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import heapq
+import json
+import re
+
+import numpy as np
+
+from .catalog import Catalog
+from .manifest import Manifest, position_key, source_identity
+from .parallel import WorkUnit
+from .qc import read_qc_table, write_qc_table
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'i/N' (1-based shard i of N) -> (i, N)."""
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", str(spec))
+    if not m:
+        raise ValueError(f"Invalid shard '{spec}' (expected i/N, e.g. 1/4).")
+    i, n = int(m.group(1)), int(m.group(2))
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError(f"Invalid shard '{spec}': need 1 <= i <= N.")
+    return i, n
+
+def shard_tag(index: int, count: int) -> str:
+    return f"shard-{index}-of-{count}"
+
+def shard_manifest_name(index: int, count: int) -> str:
+    return f"manifest.{shard_tag(index, count)}.json"
+
+def shard_catalog_name(index: int, count: int) -> str:
+    return f"catalog.{shard_tag(index, count)}.sqlite"
+
+def shard_qc_name(index: int, count: int) -> str:
+    return f"qc.{shard_tag(index, count)}.csv"
+
+def position_bytes(info: Dict[str, Any]) -> int:
+    """Estimated bytes decoded per position, from a Catalog.describe() record."""
+    sizes = {k: v for k, v in info["sizes"].items() if k != "P"}
+    return int(np.prod(list(sizes.values()))) * np.dtype(info["dtype"]).itemsize
+
+def assign_shards(weights: Sequence[Tuple[Any, int]], count: int) -> Dict[Any, int]:
+    """Deterministic balanced assignment of weighted keys to shards 1..count.
+
+    Longest-processing-time greedy: heaviest key first (ties by key) onto the
+    currently lightest shard (ties by shard number). Every invocation given
+    the same keys and weights computes the same assignment.
+    """
+    heap = [(0, s) for s in range(1, count + 1)]
+    out: Dict[Any, int] = {}
+    for key, weight in sorted(weights, key=lambda kw: (-kw[1], kw[0])):
+        load, s = heapq.heappop(heap)
+        out[key] = s
+        heapq.heappush(heap, (load + int(weight), s))
+    return out
+
+def plan_shards(catalog: Catalog, nd2_paths: List[Path], count: int,
+                by_file: bool = False) -> Dict[WorkUnit, int]:
+    """Shard of every (file, position) unit, balanced by estimated bytes.
+
+    Units are keyed by resolved path so every node computes the same plan
+    regardless of input glob order. by_file keeps all positions of an ND2
+    on one shard (needed when positions share output files, e.g. Zarr chunks).
+    """
+    units: List[Tuple[WorkUnit, int]] = []
+    for nd2_path in sorted({Path(p).resolve() for p in nd2_paths}):
+        info = catalog.describe(nd2_path)
+        units.extend((WorkUnit(nd2_path, p), position_bytes(info)) for p in range(info["n_positions"]))
+    if by_file:
+        per_file: Dict[str, int] = {}
+        for u, b in units:
+            per_file[str(u.nd2_path)] = per_file.get(str(u.nd2_path), 0) + b
+        files = assign_shards(list(per_file.items()), count)
+        return {u: files[str(u.nd2_path)] for u, _ in units}
+    shard_of = assign_shards([((str(u.nd2_path), u.xy_index), b) for u, b in units], count)
+    return {u: shard_of[(str(u.nd2_path), u.xy_index)] for u, _ in units}
+
+def _same_source(rec: Optional[Dict[str, Any]], nd2_path: Path) -> bool:
+    src = (rec or {}).get("source") or {}
+    return all(src.get(k) == v for k, v in source_identity(nd2_path).items())
+
+def merge_shards(output_root: Path, count: int, plan: Dict[WorkUnit, int],
+                 settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Combine shard manifests/catalogs/QC tables into manifest.json/catalog.sqlite/qc.csv.
+
+    Verifies that every planned unit is complete (with settings, with the
+    current projection settings) and raises RuntimeError listing missing
+    and conflicting units otherwise. The plan can move units between shards
+    when inputs are added, so a unit may have been completed by an earlier
+    owner too: the current owner's record wins, identical records from
+    other shards are accepted, and a unit no shard redid is complete if
+    the previous merge recorded it for the unchanged source with all its
+    files present. Only differing records without the owner's are an error.
+    """
+    output_root = Path(output_root)
+    merged = Manifest(output_root)
+    previous = dict(merged.outputs)
+    records: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for s in range(1, count + 1):
+        shard = Manifest(output_root, shard_manifest_name(s, count))
+        merged.sources.update(shard.sources)
+        for key, rec in shard.outputs.items():
+            if settings is not None and rec.get("settings") != settings:
+                continue
+            records.setdefault(key, {})[s] = rec
+
+    expected = {position_key(u.nd2_path.stem, u.xy_index): (u, s) for u, s in plan.items()}
+    missing: List[str] = []
+    conflicting: Dict[str, List[int]] = {}
+    for key, recs in records.items():
+        if key not in expected:
+            merged.outputs[key] = recs[max(recs)]
+    for key, (unit, owner) in sorted(expected.items()):
+        recs = records.get(key, {})
+        if owner in recs:
+            merged.outputs[key] = recs[owner]
+        elif len({json.dumps(r, sort_keys=True) for r in recs.values()}) == 1:
+            merged.outputs[key] = next(iter(recs.values()))
+        elif recs:
+            conflicting[key] = sorted(recs)
+        else:
+            prev = previous.get(key)
+            if not (prev is not None and (settings is None or prev.get("settings") == settings)
+                    and _same_source(prev, unit.nd2_path)
+                    and all((output_root / rel).exists() for rel in prev.get("files", []))):
+                missing.append(key)
+    if missing or conflicting:
+        raise RuntimeError(
+            f"Shard merge incomplete: {len(missing)} missing unit(s) {missing[:20]}"
+            f"{' ...' if len(missing) > 20 else ''}; {len(conflicting)} completed more than once with "
+            f"different results and not by their current shard (key: shards) {dict(list(conflicting.items())[:20])}."
+        )
+    merged.save()
+
+    # catalog and QC rows: a unit's current owner is applied last, so its row wins
+    by_path = {(str(u.nd2_path), u.xy_index): s for u, s in plan.items()}
+    by_stem = {(u.nd2_path.stem, u.xy_index): s for u, s in plan.items()}
+
+    rows: List[Tuple[Tuple[bool, int], str, Tuple[int, str, List[Path]]]] = []
+    for s in range(1, count + 1):
+        if not (output_root / shard_catalog_name(s, count)).exists():
+            continue
+        with Catalog(output_root, shard_catalog_name(s, count)) as shard:
+            for row in shard.positions():
+                rows.append(((by_path.get((row["path"], row["xy"])) == s, s), row["path"],
+                             (row["xy"], row["status"], [output_root / rel for rel in row["outputs"]])))
+    by_file: Dict[str, Dict[int, Tuple[int, str, List[Path]]]] = {}
+    for _, nd2_path, row in sorted(rows, key=lambda r: r[0]):
+        by_file.setdefault(nd2_path, {})[row[0]] = row
+    with Catalog(output_root) as catalog:
+        for nd2_path, per_xy in by_file.items():
+            catalog.record_positions(Path(nd2_path), list(per_xy.values()))
+    qc_rows = [((by_stem.get((r["nd2"], int(r["xy_index"]))) == s, s), r) for s in range(1, count + 1)
+               for r in read_qc_table(output_root / shard_qc_name(s, count))]
+    write_qc_table(output_root, [r for _, r in sorted(qc_rows, key=lambda x: x[0])])
+    return dict(units=len(expected), shards=count,
+                per_shard={s: sum(1 for k, (_, o) in expected.items() if o == s and s in records.get(k, {}))
+                           for s in range(1, count + 1)})
@@ -0,0 +1,108 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Iterator, List
+import numpy as np
+
+@dataclass
+class SyntheticSpec:
+    """Shape and content of a synthetic (P, Z, C, Y, X) acquisition."""
+    positions: int = 4
+    z: int = 20
+    channel_names: List[str] = field(default_factory=lambda: ["DAPI", "EGFP", "Cy5"])
+    y: int = 1024
+    x: int = 1024
+    dtype: str = "uint16"
+    seed: int = 0
+    distinct_frames: int = 8  # frames are drawn from a pool of this many (C, Y, X) frames
+    compressed: bool = False  # report lossless compression, as zlib-compressed ND2s do
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        sizes = dict(P=self.positions, Z=self.z, C=len(self.channel_names), Y=self.y, X=self.x)
+        # nd2 drops singleton axes from `sizes`
+        return {ax: n for ax, n in sizes.items() if n != 1 or ax in "CYX"}
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(list(self.sizes.values()))) * np.dtype(self.dtype).itemsize
+
+class SyntheticND2File:
+    """Local stand-in for ``nd2.ND2File`` serving synthetic frames.
+
+    Implements the subset io_nd2 uses: context manager, sizes, dtype,
+    metadata.channels, attributes.compressionType, read_frame, to_dask and
+    asarray. Frames come from a pool of spec.distinct_frames precomputed
+    (C, Y, X) arrays (frame i is pool entry i % distinct_frames), so
+    arbitrarily large files cost only the pool's memory and read_frame is as
+    cheap as a memory-mapped ND2 frame.
+    """
+
+    def __init__(self, spec: SyntheticSpec):
+        self.spec = spec
+        self.sizes = spec.sizes
+        self.dtype = np.dtype(spec.dtype)
+        self.metadata = SimpleNamespace(
+            channels=[SimpleNamespace(channel=SimpleNamespace(name=n)) for n in spec.channel_names]
+        )
+        self.attributes = SimpleNamespace(compressionType="lossless" if spec.compressed else None)
+        self._coord_shape = tuple(n for ax, n in self.sizes.items() if ax not in "CYX")
+        n_frames = int(np.prod(self._coord_shape)) if self._coord_shape else 1
+        rng = np.random.default_rng(spec.seed)
+        hi = np.iinfo(self.dtype).max if self.dtype.kind in "ui" else 1.0
+        shape = (min(max(1, spec.distinct_frames), n_frames), len(spec.channel_names), spec.y, spec.x)
+        if self.dtype.kind == "f":
+            self._pool = rng.random(shape, dtype=np.float32).astype(self.dtype)
+        else:
+            self._pool = rng.integers(0, min(hi, 4095), size=shape, dtype=self.dtype)
+        self._pool.setflags(write=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self) -> None:
+        pass
+
+    @property
+    def shape(self):
+        return tuple(self.sizes.values())
+
+    def read_frame(self, index: int) -> np.ndarray:
+        return self._pool[int(index) % self._pool.shape[0]]
+
+    def _block(self, block_id):
+        ncoords = len(self._coord_shape)
+        idx = np.ravel_multi_index(block_id[:ncoords], self._coord_shape) if ncoords else 0
+        return self.read_frame(int(idx)).copy()[(np.newaxis,) * ncoords]
+
+    def to_dask(self):
+        import dask.array as da
+        chunks = [(1,) * n for n in self._coord_shape] + [(n,) for ax, n in self.sizes.items() if ax in "CYX"]
+        return da.map_blocks(lambda block_id=None: self._block(block_id), chunks=chunks, dtype=self.dtype)
+
+    def asarray(self) -> np.ndarray:
+        out = np.empty(self.shape, dtype=self.dtype)
+        for i, idx in enumerate(np.ndindex(*self._coord_shape)):
+            out[idx] = self.read_frame(i)
+        return out
+
+@contextmanager
+def synthetic_nd2(specs: Dict[str, SyntheticSpec]) -> Iterator[None]:
+    """Serve ``specs[path.name]`` from io_nd2's ``nd2.ND2File`` while active.
+
+    Paths only need to exist for callers that stat them (e.g. the manifest).
+    Worker processes forked inside the block inherit the patch.
+    """
+    from . import io_nd2
+
+    original = io_nd2.nd2.ND2File
+    io_nd2.nd2.ND2File = lambda path, *a, **k: SyntheticND2File(specs[Path(path).name])
+    try:
+        yield
+    finally:
+        io_nd2.nd2.ND2File = original
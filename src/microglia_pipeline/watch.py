@@ -0,0 +1,122 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+import os
+import queue
+import threading
+import time
+
+from .catalog import collect_nd2_paths
+
+@dataclass
+class _FileState:
+    size: int
+    mtime_ns: int
+    since: float              # clock() when (size, mtime_ns) was first seen
+    handed_out: bool = False  # reported ready for this (size, mtime_ns)
+
+class FolderWatcher:
+    """Polls config.inputs (directories, files or globs) for ND2 files that stopped changing.
+
+    A file is ready once its size and mtime have been unchanged for
+    settle_seconds (and it is not empty), i.e. the microscope has finished
+    writing it. Each (path, size, mtime) is reported once; a file that is
+    rewritten later is reported again after it settles. Polling only stats
+    files, so thousands of existing files cost one scandir and stat each.
+    """
+
+    def __init__(self, inputs: List[str], settle_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.inputs = list(inputs)
+        self.settle_seconds = float(settle_seconds)
+        self.clock = clock
+        self.files: Dict[Path, _FileState] = {}
+
+    def scan(self) -> List[Path]:
+        try:
+            return collect_nd2_paths(self.inputs)
+        except FileNotFoundError:
+            return []
+
+    def poll(self) -> List[Path]:
+        """Files that became ready since the last poll, most recently modified first."""
+        now = self.clock()
+        seen: Dict[Path, _FileState] = {}
+        ready: List[Tuple[int, Path]] = []
+        for path in self.scan():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed or renamed between scan and stat
+            prev = self.files.get(path)
+            if prev is None or (prev.size, prev.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                state = _FileState(st.st_size, st.st_mtime_ns, now)
+            else:
+                state = prev
+            if not state.handed_out and st.st_size > 0 and now - state.since >= self.settle_seconds:
+                state.handed_out = True
+                ready.append((st.st_mtime_ns, path))
+            seen[path] = state
+        self.files = seen
+        return [p for _, p in sorted(ready, key=lambda mp: (-mp[0], str(mp[1])))]
+
+def watch(
+    watcher: FolderWatcher,
+    handle: Callable[[Path], None],
+    poll_seconds: float = 10.0,
+    queue_size: int = 8,
+    stop: Optional[threading.Event] = None,
+    on_error: Optional[Callable[[Path, Exception], None]] = None,
+    on_poll: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """Feed ready files to handle(path) on a worker thread through a bounded queue.
+
+    At most queue_size ready files are queued; the rest wait in a backlog
+    that is re-offered newest first on every poll, so freshly acquired files
+    overtake an old backlog. A failing file is passed to on_error and the
+    service continues. on_poll(queued, backlog) is called after every poll.
+    Runs until stop is set; the file being processed is finished first.
+    """
+    stop = stop or threading.Event()
+    work: "queue.Queue[Path]" = queue.Queue(maxsize=max(1, int(queue_size)))
+    backlog: List[Path] = []
+
+    def worker() -> None:
+        while True:
+            path = work.get()
+            try:
+                if stop.is_set():
+                    return
+                handle(path)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(path, e)
+            finally:
+                work.task_done()
+
+    t = threading.Thread(target=worker, name="watch-worker", daemon=True)
+    t.start()
+    try:
+        while not stop.is_set():
+            fresh = watcher.poll()
+            if fresh:
+                new = set(fresh)
+                backlog = fresh + [p for p in backlog if p not in new]
+            while backlog:
+                try:
+                    work.put_nowait(backlog[0])
+                except queue.Full:
+                    break
+                backlog.pop(0)
+            if on_poll is not None:
+                on_poll(work.qsize(), len(backlog))
+            stop.wait(poll_seconds)
+    finally:
+        stop.set()
+        try:
+            work.put_nowait(Path())  # wake an idle worker so it sees stop
+        except queue.Full:
+            pass
+        t.join()
@@ -0,0 +1,143 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+import numpy as np
+
+# Optional backend: only imported when output.backend is 'zarr'
+try:
+    import zarr  # type: ignore
+    import numcodecs  # type: ignore
+except Exception as e:
+    raise ImportError("output.backend 'zarr' requires the 'zarr' (>=3) package. Install it before running.") from e
+
+CHANNELS = ("egfp", "nuc")
+RUN_STORE_NAME = "projections.zarr"
+
+class ZarrProjectionStore:
+    """Projections written to chunked, compressed Zarr stores instead of flat TIFFs.
+
+    Arrays live at <store>/<nd2_stem>/<reduction> with shape (P, 2, Y, X),
+    channel order (egfp, nuc), and chunks of chunk_positions positions, so each
+    chunk file holds several positions. scope='run' puts every ND2 into
+    <output_root>/projections.zarr; scope='file' uses <output_root>/zarr/<stem>.zarr.
+    Stores are Zarr v2 format with consolidated metadata written on close().
+
+    Writes of consecutive positions are buffered per chunk so each chunk is
+    compressed once; call flush() before relying on data being on disk. Not
+    thread-safe: use from one thread (e.g. via BackgroundWriter).
+    """
+
+    def __init__(self, output_root: Path, scope: str = "run", chunk_positions: int = 4,
+                 cname: str = "zstd", clevel: int = 5):
+        if scope not in ("run", "file"):
+            raise ValueError("Zarr scope must be 'run' or 'file'.")
+        self.output_root = Path(output_root)
+        self.scope = scope
+        self.chunk_positions = max(1, int(chunk_positions))
+        self.compressor = numcodecs.Blosc(cname=cname, clevel=int(clevel), shuffle=numcodecs.Blosc.BITSHUFFLE)
+        self._groups: Dict[str, "zarr.Group"] = {}
+        self._touched: set = set()
+        # (stem, reduction) -> (chunk index, {xy_index: (2, Y, X) array})
+        self._pending: Dict[Tuple[str, str], Tuple[int, Dict[int, np.ndarray]]] = {}
+
+    def store_path(self, nd2_stem: str) -> Path:
+        if self.scope == "run":
+            return self.output_root / RUN_STORE_NAME
+        return self.output_root / "zarr" / f"{nd2_stem}.zarr"
+
+    def _group(self, nd2_stem: str):
+        grp = self._groups.get(nd2_stem)
+        if grp is None:
+            path = self.store_path(nd2_stem)
+            root = zarr.open_group(str(path), mode="a", zarr_format=2)
+            grp = root.require_group(nd2_stem)
+            self._groups[nd2_stem] = grp
+            self._touched.add(path)
+        return grp
+
+    def _array(self, nd2_stem: str, reduction: str, n_positions: int, plane: np.ndarray):
+        grp = self._group(nd2_stem)
+        shape = (int(n_positions), len(CHANNELS)) + tuple(plane.shape)
+        if reduction in grp:
+            arr = grp[reduction]
+            if tuple(arr.shape) == shape and arr.dtype == plane.dtype:
+                return arr
+        arr = grp.create_array(
+            reduction,
+            shape=shape,
+            chunks=(self.chunk_positions, len(CHANNELS)) + tuple(plane.shape),
+            dtype=plane.dtype,
+            compressors=self.compressor,
+            fill_value=0,
+            chunk_key_encoding={"name": "v2", "separator": "/"},
+            config={"write_empty_chunks": True},
+            overwrite=True,
+        )
+        arr.attrs.update(channels=list(CHANNELS), reduction=reduction, nd2_stem=nd2_stem)
+        return arr
+
+    def chunk_path(self, nd2_stem: str, reduction: str, xy_index: int) -> Path:
+        """File holding xy_index's chunk (channels and YX are never split)."""
+        return self.store_path(nd2_stem) / nd2_stem / reduction / str(xy_index // self.chunk_positions) / "0" / "0" / "0"
+
+    def position_paths(self, nd2_stem: str, xy_index: int, reductions: Iterable[str]) -> List[Path]:
+        return [self.chunk_path(nd2_stem, name, xy_index) for name in reductions]
+
+    def write(self, nd2_stem: str, xy_index: int, n_positions: int, projections: Dict[str, tuple]) -> List[Path]:
+        """Buffer one position's (egfp, nuc) reductions; returns the chunk files they land in."""
+        block = xy_index // self.chunk_positions
+        for name, (egfp, nuc) in projections.items():
+            key = (nd2_stem, name)
+            if key in self._pending and self._pending[key][0] != block:
+                self._flush_key(key)
+            stacked = np.stack([np.asarray(egfp), np.asarray(nuc)])
+            self._array(nd2_stem, name, n_positions, stacked[0])
+            self._pending.setdefault(key, (block, {}))[1][xy_index] = stacked
+            if len(self._pending[key][1]) == self._block_len(block, n_positions):
+                self._flush_key(key)
+        return self.position_paths(nd2_stem, xy_index, projections)
+
+    def _block_len(self, block: int, n_positions: int) -> int:
+        return min(self.chunk_positions, n_positions - block * self.chunk_positions)
+
+    def _flush_key(self, key: Tuple[str, str]) -> None:
+        _, planes = self._pending.pop(key)
+        arr = self._group(key[0])[key[1]]
+        idx = sorted(planes)
+        # contiguous runs become one slice assignment (one chunk read-modify-write)
+        start = prev = idx[0]
+        for p in idx[1:] + [None]:
+            if p is not None and p == prev + 1:
+                prev = p
+                continue
+            arr[start:prev + 1] = np.stack([planes[i] for i in range(start, prev + 1)])
+            if p is not None:
+                start = prev = p
+
+    def flush(self) -> None:
+        for key in list(self._pending):
+            self._flush_key(key)
+
+    def close(self) -> None:
+        """Flush buffered positions and consolidate metadata of every store written."""
+        self.flush()
+        for path in sorted(self._touched):
+            zarr.consolidate_metadata(str(path))
+        self._groups.clear()
+        self._touched.clear()
+
+    def __enter__(self) -> "ZarrProjectionStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+def open_projection_store(output_root: Path, output_cfg) -> ZarrProjectionStore:
+    return ZarrProjectionStore(output_root, scope=output_cfg.zarr_scope,
+                               chunk_positions=output_cfg.zarr_chunk_positions)
+
+def read_projection(store_path: Path, nd2_stem: str, xy_index: int, channel: str = "egfp",
+                    reduction: str = "max") -> np.ndarray:
+    """Read one (stem, position, channel) plane back from a projection store."""
+    root = zarr.open_group(str(store_path), mode="r", zarr_format=2)
+    return np.asarray(root[f"{nd2_stem}/{reduction}"][xy_index, CHANNELS.index(channel)])
@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import pytest
+
+from microglia_pipeline.synthetic import SyntheticSpec, synthetic_nd2
+
+
+@pytest.fixture
+def fake_nd2(tmp_path):
+    """Serve a synthetic (P, Z, C, Y, X) stack as 'plate1.nd2'; returns (path, data)."""
+    from microglia_pipeline.synthetic import SyntheticND2File
+
+    spec = SyntheticSpec(positions=2, z=5, channel_names=["DAPI", "Cy5", "EGFP"], y=16, x=12,
+                         distinct_frames=10)
+    path = tmp_path / "plate1.nd2"
+    path.write_bytes(b"")
+    with synthetic_nd2({path.name: spec}):
+        yield path, SyntheticND2File(spec).asarray()
@@ -0,0 +1,46 @@
+import pytest
+
+from microglia_pipeline import io_nd2
+from microglia_pipeline.catalog import Catalog, collect_nd2_paths
+
+
+def test_describe_caches_headers_until_the_file_changes(fake_nd2, tmp_path, monkeypatch):
+    path, _ = fake_nd2
+    assert collect_nd2_paths([str(tmp_path)]) == [path]
+    with Catalog(tmp_path / "out") as cat:
+        info = cat.describe(path, ["egfp"], ["dapi"])
+    assert info["n_positions"] == 2 and info["sizes"]["Z"] == 5
+    assert (info["egfp_index"], info["nuc_index"]) == (2, 0)
+
+    def no_header(_):
+        raise AssertionError("header re-read for an unchanged file")
+    monkeypatch.setattr(io_nd2, "nd2_header", no_header)
+    with Catalog(tmp_path / "out") as cat:
+        assert cat.describe(path, ["cy5"], ["dapi"])["egfp_index"] == 1  # re-resolved from cached names
+        with pytest.raises(io_nd2.ND2ReadError):
+            cat.describe(path, ["tritc"], ["dapi"])
+        path.write_bytes(b"changed")
+        with pytest.raises(AssertionError):
+            cat.describe(path)
+
+
+def test_positions_roundtrip(tmp_path):
+    out = tmp_path / "out"
+    with Catalog(out) as cat:
+        cat.record_positions(tmp_path / "a.nd2", [(1, "done", [out / "egfp" / "a_XY001.tif"]), (0, "done", [])])
+        cat.record_positions(tmp_path / "a.nd2", [(0, "failed", [])])
+    with Catalog(out) as cat:
+        rows = cat.positions(stem="a")
+        assert [(r["xy"], r["status"]) for r in rows] == [(0, "failed"), (1, "done")]
+        assert cat.positions(status="done")[0]["outputs"] == ["egfp/a_XY001.tif"]
+
+
+def test_catalog_uses_rollback_journal(tmp_path):
+    import sqlite3
+
+    db = sqlite3.connect(str(tmp_path / "catalog.sqlite"))
+    db.execute("PRAGMA journal_mode=WAL")  # a catalog created by an older version
+    db.close()
+    with Catalog(tmp_path) as cat:
+        assert cat.db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert not list(tmp_path.glob("*-wal")) and not list(tmp_path.glob("*-shm"))
@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from microglia_pipeline.aggregate import aggregate_all, aggregate_per_nd2
+from microglia_pipeline.feature_store import FeatureStore
+
+
+def _features(root, stem, xy, **cols):
+    d = root / stem / f"XY_{xy:03d}"
+    d.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(cols).to_csv(d / "features.csv", index=False)
+
+
+def test_update_touches_only_changed_positions(tmp_path):
+    _features(tmp_path, "a", 0, area=[1, 2])
+    _features(tmp_path, "a", 1, area=[3], length=[0.5])
+    store = FeatureStore(tmp_path)
+    assert store.update("a") == ["XY_000", "XY_001"]
+    assert FeatureStore(tmp_path).update("a") == []
+
+    part = store.part_path("a", "XY_000")
+    before = os.stat(part).st_mtime_ns
+    _features(tmp_path, "a", 1, area=[4], length=[0.7])
+    assert FeatureStore(tmp_path).update("a") == ["XY_001"]
+    assert os.stat(part).st_mtime_ns == before
+
+    df = FeatureStore(tmp_path).read("a")
+    assert df["area"].tolist() == [1, 2, 4]
+    assert df["length"].isna().tolist() == [True, True, False]
+
+
+def test_export_csv_matches_csv_aggregation(tmp_path):
+    for stem in ("a", "b"):
+        _features(tmp_path, stem, 0, area=[1, 2])
+        _features(tmp_path, stem, 1, area=[3])
+    store = FeatureStore(tmp_path)
+    for stem in ("a", "b"):
+        store.update(stem)
+
+    csv_root = tmp_path / "csv"
+    for stem in ("a", "b"):
+        (csv_root / stem).mkdir(parents=True)
+        for xy in (0, 1):
+            src = tmp_path / stem / f"XY_{xy:03d}"
+            (csv_root / stem / src.name).mkdir()
+            (csv_root / stem / src.name / "features.csv").write_bytes((src / "features.csv").read_bytes())
+        aggregate_per_nd2(csv_root, stem)
+    expected = pd.read_csv(aggregate_all(csv_root)).sort_values(["nd2", "xy_dir"], kind="stable")
+    got = pd.read_csv(store.export_csv())
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_read_unifies_column_types_across_positions(tmp_path):
+    _features(tmp_path, "a", 0, area=[1, 2], label=["x", "y"])
+    _features(tmp_path, "a", 1, area=[3.5, None], label=[1, 2])  # NaN makes area float; label is numeric here
+    store = FeatureStore(tmp_path)
+    store.update("a")
+    df = store.read("a")
+    assert df["area"].tolist()[:3] == [1.0, 2.0, 3.5] and pd.isna(df["area"].iloc[3])
+    assert [str(v) for v in df["label"]] == ["x", "y", "1", "2"]
+
+    _features(tmp_path, "a", 1, area=[3.5, None])
+    store.update("a")
+    assert store.read("a")["area"].dtype == float
+    assert store.export_csv() is not None
@@ -0,0 +1,33 @@
+import importlib.util
+from pathlib import Path
+
+from microglia_pipeline.config import Config
+from microglia_pipeline.synthetic import SyntheticSpec, synthetic_nd2
+
+
+def _load_script():
+    path = Path(__file__).resolve().parents[1] / "scripts" / "generate_projections.py"
+    spec = importlib.util.spec_from_file_location("generate_projections", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_catalog_lists_positions_skipped_as_up_to_date(tmp_path):
+    from microglia_pipeline.catalog import Catalog
+
+    mod = _load_script()
+    specs = {"a.nd2": SyntheticSpec(positions=3, z=2, y=8, x=8), "b.nd2": SyntheticSpec(positions=2, z=2, y=8, x=8)}
+    for name in specs:
+        (tmp_path / name).write_bytes(b"")
+    out = tmp_path / "results"
+    with synthetic_nd2(specs):
+        cfg = Config(inputs=[str(tmp_path / "a.nd2")], output_root=str(out))
+        cfg.execution.catalog = False
+        mod.generate_from_config(cfg)
+        cfg = Config(inputs=[str(tmp_path / "a.nd2"), str(tmp_path / "b.nd2")], output_root=str(out))
+        mod.generate_from_config(cfg)  # a is up to date; only b is projected
+    with Catalog(out) as catalog:
+        rows = catalog.positions(status="done")
+    assert [(r["stem"], r["xy"]) for r in rows] == [("a", 0), ("a", 1), ("a", 2), ("b", 0), ("b", 1)]
+    assert rows[0]["outputs"] == ["egfp/a_XY000.tif", "nuc/a_XY000.tif"]
@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+import tifffile as tiff
+
+pytest.importorskip("npe2")
+
+from microglia_pipeline import headless, plugin_runner
+
+
+def widget(viewer, image):
+    """Viewer-bound command; must be skipped headlessly."""
+
+
+def segment(image, nuclei, output_dir):
+    labels = (image > image.mean()).astype(np.int64)
+    return [(labels, {"features": {"area": [int(labels.sum())]}}, "labels")]
+
+
+class _PluginManager:
+    def __init__(self):
+        self.commands = {
+            cid: SimpleNamespace(id=cid, python_name=f"{__name__}:{fn}")
+            for cid, fn in (("mg.widget", "widget"), ("mg.segment", "segment"))
+        }
+
+    def discover(self):
+        pass
+
+    def iter_manifests(self):
+        contrib = SimpleNamespace(commands=list(self.commands.values()))
+        return [SimpleNamespace(name="microglia-analyzer", contributions=contrib)]
+
+    def get_command(self, cid):
+        return self.commands[cid]
+
+
+def test_collect_outputs_normalizes_return_values():
+    labels = np.zeros((2, 2), np.int32)
+    assert set(headless.collect_outputs(labels)) == {"labels"}
+    assert set(headless.collect_outputs((labels, {"features": {"a": [1]}}, "labels"))) == {"labels", "features"}
+    assert set(headless.collect_outputs(pd.DataFrame({"a": [1]}))) == {"features"}
+    assert headless.collect_outputs(None) == {}
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_plugin_batch_saves_outputs_in_order(monkeypatch, tmp_path, workers):
+    monkeypatch.setattr(plugin_runner.PluginManager, "instance", staticmethod(lambda: _PluginManager()))
+    monkeypatch.setattr(plugin_runner, "_RESOLVERS", {})
+
+    rng = np.random.default_rng(0)
+    jobs = []
+    for xy in range(3):
+        xy_dir = tmp_path / f"XY_{xy:03d}"
+        xy_dir.mkdir()
+        jobs.append((xy_dir, rng.integers(0, 100, (8, 8), dtype=np.uint16), None))
+
+    results = list(headless.run_plugin_batch(iter(jobs), "microglia", workers=workers, max_pending=1))
+    assert [r["xy_dir"] for r in results] == [j[0] for j in jobs]
+    for (xy_dir, egfp, _), res in zip(jobs, results):
+        assert res["command"] == "mg.segment"
+        labels = tiff.imread(xy_dir / "segmentation_labels.tif")
+        assert np.array_equal(labels, egfp > egfp.mean())
+        assert pd.read_csv(xy_dir / "features.csv")["area"].tolist() == [int(labels.sum())]
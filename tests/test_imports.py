@@ -0,0 +1,23 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+LIGHT = ["config", "io_nd2", "parallel", "manifest", "catalog", "aggregate", "sharding", "orchestrate"]
+
+
+@pytest.mark.parametrize("module", LIGHT)
+def test_lightweight_modules_do_not_import_gui_stack(module):
+    code = (f"import sys, json; import microglia_pipeline.{module}; "
+            "print(json.dumps([m for m in ('napari', 'npe2', 'qtpy', 'vispy') if m in sys.modules]))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert json.loads(out.stdout) == []
+
+
+def test_package_attributes_load_lazily():
+    import microglia_pipeline
+
+    assert microglia_pipeline.preprocess.__name__ == "microglia_pipeline.preprocess"
+    with pytest.raises(AttributeError):
+        microglia_pipeline.missing_module
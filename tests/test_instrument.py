@@ -0,0 +1,55 @@
+import json
+
+from microglia_pipeline import instrument
+from microglia_pipeline.config import Config
+
+
+def test_recorder_attributes_reads_and_background_writes(fake_nd2, tmp_path):
+    from microglia_pipeline.io_nd2 import read_positions
+    from microglia_pipeline.preprocess import BackgroundWriter, save_flat_projections
+
+    path, data = fake_nd2
+    written = []
+    with instrument.activate(instrument.Recorder()) as rec:
+        with BackgroundWriter(2) as writer:
+            for item in read_positions(path, ["egfp"], ["dapi"], mode="stream"):
+                written += save_flat_projections(tmp_path, path.stem, item["xy_index"], item["projections"],
+                                                 writer=writer)
+    assert instrument.current() is instrument.NULL_RECORDER
+
+    report = rec.report("test")
+    assert [(u["stem"], u["xy"]) for u in report["positions"]] == [("plate1", 0), ("plate1", 1)]
+    for u in report["positions"]:
+        assert {"read", "reduce", "write"} <= set(u["stages"])
+        assert u["bytes_read"] == data[0].nbytes // 3 * 2  # EGFP + nuclei of 3 channels
+    assert report["totals"]["bytes_written"] == sum(p.stat().st_size for p in written)
+
+    out = rec.write_report(tmp_path, "test")
+    assert json.loads(out.read_text())["files"]["plate1"]["positions"] == 2
+
+
+def test_parallel_units_return_measurements(fake_nd2, tmp_path):
+    from microglia_pipeline.parallel import list_work_units, run_units
+
+    path, _ = fake_nd2
+    cfg = Config(inputs=[str(path)], output_root=str(tmp_path))
+    cfg.execution.instrument = True
+    rec = instrument.Recorder()
+    for res in run_units(list_work_units([path]), cfg, 2):
+        rec.merge(res["instrument"])
+    assert sorted(u["xy"] for u in rec.report("test")["positions"]) == [0, 1]
+
+
+def test_rss_growth_is_attributed_to_the_unit_that_allocated():
+    import numpy as np
+
+    rec = instrument.Recorder()
+    if instrument.peak_rss_mb() is None:  # pragma: no cover - no getrusage
+        return
+    rec.set_unit("a", 0)
+    big = np.ones(int(instrument.peak_rss_mb() + 64) * 10**6, dtype=np.uint8)  # raises the process peak
+    rec.set_unit("a", 1)
+    del big
+    units = {u["xy"]: u for u in rec.snapshot()}
+    assert units[0]["rss_growth_mb"] > 32
+    assert units[1]["rss_growth_mb"] == 0
@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+
+def test_read_positions_selects_channels(fake_nd2):
+    from microglia_pipeline.io_nd2 import read_positions
+
+    path, data = fake_nd2
+    items = list(read_positions(path, ["egfp"], ["dapi"]))
+    assert [it["xy_index"] for it in items] == [0, 1]
+    for it in items:
+        p = it["xy_index"]
+        np.testing.assert_array_equal(it["egfp_mip"], data[p, :, 2].max(axis=0))
+        np.testing.assert_array_equal(it["nuc_mip"], data[p, :, 0].max(axis=0))
+        meta = it["meta"]
+        per_channel = data[p, :, 0].nbytes
+        assert meta["bytes_read"] == 2 * per_channel
+        assert meta["bytes_skipped"] == per_channel
+
+
+def test_stream_mode_matches_volume(fake_nd2):
+    from microglia_pipeline.io_nd2 import read_positions
+
+    path, _ = fake_nd2
+    vol = list(read_positions(path, ["egfp"], ["dapi"]))
+    for z_chunk in (1, 2, 7):
+        stream = list(read_positions(path, ["egfp"], ["dapi"], mode="stream", z_chunk=z_chunk))
+        for a, b in zip(vol, stream):
+            np.testing.assert_array_equal(a["egfp_mip"], b["egfp_mip"])
+            np.testing.assert_array_equal(a["nuc_mip"], b["nuc_mip"])
+            assert b["egfp_mip"].dtype == a["egfp_mip"].dtype
+
+
+def test_frame_reader_matches_dask(fake_nd2):
+    from microglia_pipeline.io_nd2 import read_positions
+
+    path, _ = fake_nd2
+    ref = list(read_positions(path, ["egfp"], ["dapi"]))
+    for mode in ("volume", "stream"):
+        got = list(read_positions(path, ["egfp"], ["dapi"], mode=mode, z_chunk=2, reader="frames"))
+        for a, b in zip(ref, got):
+            np.testing.assert_array_equal(a["egfp_mip"], b["egfp_mip"])
+            np.testing.assert_array_equal(a["nuc_mip"], b["nuc_mip"])
+
+
+def test_corrupt_frame_skips_position_with_on_error(fake_nd2, monkeypatch):
+    from microglia_pipeline.io_nd2 import read_positions
+    from microglia_pipeline.synthetic import SyntheticND2File
+
+    path, _ = fake_nd2
+    good = SyntheticND2File.read_frame
+
+    def read_frame(self, index):
+        if index == 2:  # a Z plane of position 0
+            raise OSError("corrupt frame")
+        return good(self, index)
+
+    monkeypatch.setattr(SyntheticND2File, "read_frame", read_frame)
+    with pytest.raises(OSError):
+        list(read_positions(path, ["egfp"], ["dapi"], reader="frames"))
+    errors = []
+    items = list(read_positions(path, ["egfp"], ["dapi"], reader="frames", on_error=lambda p, e: errors.append(p)))
+    assert [it["xy_index"] for it in items] == [1] and errors == [0]
+
+
+def test_tiled_projection_matches_whole_frames(tmp_path):
+    import tifffile
+    from microglia_pipeline.io_nd2 import read_positions
+    from microglia_pipeline.preprocess import flat_mip_paths, save_flat_tiles
+    from microglia_pipeline.synthetic import SyntheticSpec, synthetic_nd2
+
+    path = tmp_path / "plate1.nd2"
+    path.write_bytes(b"")
+    reductions = ["max", "mean", "p50"]
+    spec = SyntheticSpec(positions=2, z=5, channel_names=["DAPI", "EGFP"], y=40, x=20)
+    with synthetic_nd2({path.name: spec}):
+        ref = list(read_positions(path, ["egfp"], ["dapi"], reader="frames", reductions=reductions))
+        tiled = read_positions(path, ["egfp"], ["dapi"], mode="stream", z_chunk=2, reader="frames",
+                               reductions=reductions, tile=16)  # 40 x 20 frames -> 3 x 2 tiles
+        for a, item in zip(ref, tiled):
+            assert "projections" not in item and item["shape"] == (40, 20)
+            xy = item["xy_index"]
+            paths = save_flat_tiles(tmp_path, "plate1", xy, item["shape"], item["tiles"], item["tile"])
+            assert len(paths) == 2 * len(reductions)
+            for name, pair in a["projections"].items():
+                for ref_arr, out in zip(pair, flat_mip_paths(tmp_path, "plate1", xy, name)):
+                    with tifffile.TiffFile(out) as tf:
+                        assert tf.pages[0].is_tiled
+                        np.testing.assert_array_equal(tf.asarray(), ref_arr)
+        # frames within the tile size take the whole-frame path
+        assert "projections" in next(read_positions(path, ["egfp"], ["dapi"], reader="frames", tile=48))
+        with pytest.raises(ValueError):
+            next(read_positions(path, ["egfp"], ["dapi"], tile=16))
+
+
+def test_tiled_projection_decodes_compressed_frames_once(tmp_path, monkeypatch):
+    from microglia_pipeline.io_nd2 import read_positions
+    from microglia_pipeline.synthetic import SyntheticND2File, SyntheticSpec, synthetic_nd2
+
+    path = tmp_path / "plate1.nd2"
+    path.write_bytes(b"")
+    reads = []
+    read_frame = SyntheticND2File.read_frame
+    monkeypatch.setattr(SyntheticND2File, "read_frame", lambda self, i: reads.append(i) or read_frame(self, i))
+    reductions = ["max", "mean", "p50"]
+    spec = SyntheticSpec(positions=2, z=5, channel_names=["DAPI", "EGFP"], y=40, x=20, compressed=True)
+    with synthetic_nd2({path.name: spec}):
+        (ref,) = read_positions(path, ["egfp"], ["dapi"], reader="frames", reductions=reductions, positions=[1])
+        reads.clear()
+        (item,) = read_positions(path, ["egfp"], ["dapi"], mode="stream", z_chunk=2, reader="frames",
+                                 reductions=reductions, positions=[1], tile=16)
+        tiles = list(item["tiles"])
+    assert sorted(reads) == list(range(5, 10))  # each of the position's 5 frames once, not once per tile
+    assert [origin for origin, _ in tiles] == [(y, x) for y in (0, 16, 32) for x in (0, 16)]
+    for name, pair in ref["projections"].items():
+        for k, ref_arr in enumerate(pair):
+            out = np.empty_like(ref_arr)
+            for (y0, x0), proj in tiles:
+                arr = proj[name][k]
+                out[y0:y0 + arr.shape[0], x0:x0 + arr.shape[1]] = arr
+            np.testing.assert_array_equal(out, ref_arr)
@@ -0,0 +1,63 @@
+import os
+
+from microglia_pipeline.config import Config
+
+
+def test_manifest_skips_up_to_date_positions(fake_nd2, tmp_path):
+    from microglia_pipeline.manifest import Manifest, plan_positions, projection_settings
+    from microglia_pipeline.preprocess import flat_mip_paths
+
+    path, _ = fake_nd2
+    out = tmp_path / "results"
+    settings = projection_settings(Config(inputs=[str(path)]))
+
+    m = Manifest(out)
+    ident, stale = plan_positions(m, path, settings)
+    assert stale == [0, 1]
+    for p in stale:
+        files = flat_mip_paths(out, path.stem, p)
+        for f in files:
+            f.parent.mkdir(parents=True, exist_ok=True)
+            f.write_bytes(b"x")
+        m.record(path.stem, p, ident, settings, files)
+    m.save()
+
+    m = Manifest(out)
+    assert plan_positions(m, path, settings)[1] == []
+    flat_mip_paths(out, path.stem, 1)[1].unlink()
+    assert plan_positions(m, path, settings)[1] == [1]
+    assert plan_positions(m, path, dict(settings, projection="mean"))[1] == [0, 1]
+    recompressed = Config(inputs=[str(path)])
+    recompressed.output.compression = "zlib"
+    assert plan_positions(m, path, projection_settings(recompressed))[1] == [0, 1]
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert plan_positions(m, path, settings)[1] == [0, 1]
+
+
+def test_manifest_journal_resumes_and_tracks_failures(fake_nd2, tmp_path):
+    from microglia_pipeline.manifest import Manifest, plan_positions, projection_settings
+    from microglia_pipeline.preprocess import flat_mip_paths
+
+    path, _ = fake_nd2
+    out = tmp_path / "results"
+    settings = projection_settings(Config(inputs=[str(path)]))
+
+    m = Manifest(out)
+    ident, stale = plan_positions(m, path, settings)
+    files = flat_mip_paths(out, path.stem, 0)
+    for f in files:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        f.write_bytes(b"x")
+    m.record(path.stem, 0, ident, settings, files)
+    m.record_failure(path.stem, 1, ident, "OSError: corrupt frame")
+    with open(m.journal_path, "a") as f:
+        f.write('{"kind": "done", "key"')  # torn write of a crashed run
+
+    # no save(): a new run replays the journal
+    m = Manifest(out)
+    assert plan_positions(m, path, settings)[1] == [1]
+    assert m.failures[f"{path.stem}_XY001"]["attempts"] == 1
+    m.save()
+    assert not m.journal_path.exists()
+    assert Manifest(out).failures[f"{path.stem}_XY001"]["error"] == "OSError: corrupt frame"
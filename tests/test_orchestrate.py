@@ -0,0 +1,128 @@
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("napari")
+
+from microglia_pipeline import instrument, orchestrate, plugin_runner
+from microglia_pipeline.config import Config
+
+
+class _Signal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in list(self.slots):
+            slot(*args)
+
+
+class _Timer:
+    def __init__(self, parent=None):
+        self.timeout, self.active = _Signal(), False
+
+    def setInterval(self, ms):
+        pass
+
+    def start(self):
+        self.active = True
+
+    def stop(self):
+        self.active = False
+
+
+class _Viewer:
+    def __init__(self, title=""):
+        self.status = ""
+        self.inserted = _Signal()
+        self.layers = SimpleNamespace(events=SimpleNamespace(inserted=self.inserted))
+        self.window = SimpleNamespace(_qt_window=SimpleNamespace(destroyed=_Signal()))
+
+    def add_image(self, data, **kw):
+        pass
+
+
+class Labels:
+    def __init__(self, name):
+        self.name, self.data = name, np.ones((4, 4), dtype=np.uint16)
+        self.events = SimpleNamespace(data=_Signal(), paint=_Signal())
+
+
+def _manual_session(monkeypatch):
+    viewers, timers, registered = [], [], []
+    monkeypatch.setattr(orchestrate, "_require_napari",
+                        lambda: SimpleNamespace(Viewer=lambda **kw: viewers.append(_Viewer()) or viewers[-1]))
+    monkeypatch.setitem(sys.modules, "qtpy", SimpleNamespace())
+    monkeypatch.setitem(sys.modules, "qtpy.QtCore",
+                        SimpleNamespace(QTimer=lambda parent: timers.append(_Timer()) or timers[-1]))
+    monkeypatch.setattr(orchestrate.atexit, "register", registered.append)
+    monkeypatch.setattr(orchestrate.atexit, "unregister", registered.remove)
+    return viewers, timers, registered
+
+
+def test_manual_mode_status_tracks_background_saves(fake_nd2, tmp_path, monkeypatch):
+    path, _ = fake_nd2
+    viewers, timers, registered = _manual_session(monkeypatch)
+    save = plugin_runner.save_layer_snapshot
+    calls = []
+
+    def flaky_save(snap, xy_dir, *args):
+        calls.append(xy_dir)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        save(snap, xy_dir, *args)
+
+    monkeypatch.setattr(plugin_runner, "save_layer_snapshot", flaky_save)
+    cfg = Config(inputs=[str(path)], output_root=str(tmp_path))
+    cfg.plugin.manual_mode = True
+    orchestrate._process_nd2_file(path, cfg, instrument.NULL_RECORDER)
+    (viewer,), (timer,) = viewers, timers
+
+    layer = Labels("plate1_XY000_labels")
+    viewer.inserted.emit(SimpleNamespace(value=layer))
+    assert timer.active and "pending" in viewer.status
+    saver = registered[0].__self__
+    saver.flush()
+    timer.timeout.emit()  # GUI-thread poll after the save finished
+    assert viewer.status == "[microglia] all saved" and not timer.active
+    assert (tmp_path / "plate1" / "XY_000" / "segmentation_labels.tif").exists()
+
+    layer.events.paint.emit(None)  # an edit whose save fails on the saver thread
+    saver.flush()
+    timer.timeout.emit()
+    assert "1 failed" in viewer.status and "disk full" in viewer.status
+
+    viewer.window._qt_window.destroyed.emit()
+    assert registered == []
+
+
+def test_painting_a_labels_layer_saves_it_again(fake_nd2, tmp_path, monkeypatch):
+    import napari.layers
+    import tifffile
+
+    path, _ = fake_nd2
+    viewers, _timers, registered = _manual_session(monkeypatch)
+    cfg = Config(inputs=[str(path)], output_root=str(tmp_path))
+    cfg.plugin.manual_mode = True
+    orchestrate._process_nd2_file(path, cfg, instrument.NULL_RECORDER)
+    (viewer,) = viewers
+    saver = registered[0].__self__
+
+    layer = napari.layers.Labels(np.zeros((16, 12), dtype=np.uint16), name="plate1_XY000_labels")
+    viewer.inserted.emit(SimpleNamespace(value=layer))
+    saver.flush()
+    out = tmp_path / "plate1" / "XY_000" / "segmentation_labels.tif"
+    assert tifffile.imread(out).max() == 0
+
+    layer.brush_size = 1
+    layer.paint((3, 4), 7)  # edits in place; napari fires events.paint, not events.data
+    layer.paint((5, 6), 9)
+    saver.flush()
+    saved = tifffile.imread(out)
+    assert saved[3, 4] == 7 and saved[5, 6] == 9
+    viewer.window._qt_window.destroyed.emit()
@@ -0,0 +1,96 @@
+from microglia_pipeline.config import Config
+
+
+def test_parallel_matches_serial(fake_nd2, tmp_path):
+    from microglia_pipeline.parallel import list_work_units, run_units
+
+    path, _ = fake_nd2
+    outputs = {}
+    for workers in (1, 2):
+        cfg = Config(inputs=[str(path)], output_root=str(tmp_path / f"w{workers}"))
+        units = list_work_units([path])
+        results = list(run_units(units, cfg, workers))
+        assert [r["xy_index"] for r in results] == [0, 1]
+        outputs[workers] = [[p.read_bytes() for p in r["paths"]] for r in results]
+    assert outputs[1] == outputs[2]
+
+
+def test_unit_peak_bytes_follows_mode_and_size():
+    from microglia_pipeline.parallel import unit_peak_bytes
+
+    sizes = dict(Z=20, C=3, Y=512, X=512)
+    cfg = Config(inputs=[])
+    volume = unit_peak_bytes(sizes, "uint16", cfg)
+    cfg.preprocessing.mode, cfg.preprocessing.z_chunk = "stream", 2
+    stream = unit_peak_bytes(sizes, "uint16", cfg)
+    assert volume >= 2 * 20 * 512 * 512 * 2 > stream
+    assert unit_peak_bytes(dict(sizes, Y=1024, X=1024), "uint16", cfg) == 4 * stream
+
+
+def test_budgeted_run_caps_concurrency(fake_nd2, tmp_path):
+    from microglia_pipeline.parallel import BudgetStats, list_work_units, run_units, run_units_budgeted
+
+    path, _ = fake_nd2
+    units = list_work_units([path]) * 2
+    for i, budget in enumerate((100, 250, 10)):
+        cfg = Config(inputs=[str(path)], output_root=str(tmp_path / f"b{i}"))
+        stats = BudgetStats(budget, 2)
+        results = list(run_units_budgeted(units, cfg, 2, lambda u: 100, budget, stats))
+        assert [r["xy_index"] for r in results] == [0, 1, 0, 1]
+        assert stats.units == 4 and stats.peak_bytes <= max(budget, 100)
+        assert stats.peak_concurrency == (2 if budget >= 200 else 1)
+        assert stats.over_budget == (4 if budget < 100 else 0)
+        assert "memory budget" in stats.summary()
+    serial = list(run_units(units[:2], Config(inputs=[str(path)], output_root=str(tmp_path / "s")), 1))
+    assert [p.read_bytes() for r in serial for p in r["paths"]] == \
+        [p.read_bytes() for r in results[:2] for p in r["paths"]]
+
+
+def test_budgeted_run_bounds_results_buffered_behind_a_slow_unit(monkeypatch, tmp_path):
+    import time
+
+    import numpy as np
+
+    from microglia_pipeline import parallel
+
+    def fake_project(unit, cfg):
+        if unit.xy_index == 0:
+            time.sleep(0.5)
+        plane = np.zeros(1000, dtype=np.uint8)
+        return dict(xy_index=unit.xy_index, projections={"max": (plane, plane)})
+
+    monkeypatch.setattr(parallel, "project_unit", fake_project)  # inherited by the forked workers
+    units = [parallel.WorkUnit(tmp_path / "a.nd2", p) for p in range(12)]
+    stats = parallel.BudgetStats(10_000, 2)
+    results = parallel.run_units_budgeted(units, Config(inputs=[]), 2, lambda u: 10, 10_000, stats)
+    assert next(results)["xy_index"] == 0
+    assert stats.units <= 4  # admission stops 2 * workers units ahead of the slow head
+    assert stats.peak_bytes >= 2 * 2000  # buffered projections count against the budget
+    assert [r["xy_index"] for r in results] == list(range(1, 12))
+
+
+def test_run_units_submits_a_bounded_window_behind_a_slow_unit(monkeypatch, tmp_path):
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    from microglia_pipeline import parallel
+
+    def fake_project(unit, cfg):
+        if unit.xy_index == 0:
+            time.sleep(0.3)
+        return dict(xy_index=unit.xy_index)
+
+    submitted = []
+
+    class CountingPool(ProcessPoolExecutor):
+        def submit(self, fn, *args):
+            submitted.append(args[0].xy_index)
+            return super().submit(fn, *args)
+
+    monkeypatch.setattr(parallel, "_project_unit", fake_project)  # inherited by the forked workers
+    monkeypatch.setattr(parallel, "ProcessPoolExecutor", CountingPool)
+    units = [parallel.WorkUnit(tmp_path / "a.nd2", p) for p in range(12)]
+    results = parallel.run_units(units, Config(inputs=[]), 2)
+    assert next(results)["xy_index"] == 0
+    assert len(submitted) <= 5  # 2 * workers ahead of the head, plus the next submission
+    assert [r["xy_index"] for r in results] == list(range(1, 12))
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("napari")
+
+from microglia_pipeline import plugin_runner
+
+
+def segment(viewer, image, output_dir):
+    """Stand-in plugin callable; only its signature is inspected."""
+
+
+class _Command:
+    def __init__(self, cid, fail=False):
+        self.id = cid
+        self.python_name = f"{__name__}:segment"
+        self.fail = fail
+        self.calls = []
+
+    def exec(self, kwargs):
+        self.calls.append(sorted(kwargs))
+        if self.fail:
+            raise RuntimeError("boom")
+        kwargs["viewer"].layers.append(SimpleNamespace(name=f"labels{len(self.calls)}"))
+
+
+class _PluginManager:
+    def __init__(self, commands):
+        self.commands = {c.id: c for c in commands}
+        self.discovered = 0
+
+    def discover(self):
+        self.discovered += 1
+
+    def iter_manifests(self):
+        contrib = SimpleNamespace(commands=list(self.commands.values()))
+        return [SimpleNamespace(name="microglia-analyzer", contributions=contrib)]
+
+    def get_command(self, cid):
+        return self.commands[cid]
+
+
+def test_resolver_discovers_once_and_prefers_last_good(monkeypatch, tmp_path):
+    bad, good = _Command("mg.bad", fail=True), _Command("mg.good")
+    pm = _PluginManager([bad, good])
+    monkeypatch.setattr(plugin_runner.PluginManager, "instance", staticmethod(lambda: pm))
+    monkeypatch.setattr(plugin_runner, "_RESOLVERS", {})
+
+    viewer = SimpleNamespace(layers=[SimpleNamespace(name="egfp")])
+    for _ in range(3):
+        assert plugin_runner.try_run_plugin(viewer, "egfp", None, tmp_path, plugin_name="microglia")
+
+    assert pm.discovered == 1
+    assert len(bad.calls) == 1  # tried once, then the cached good command goes first
+    assert good.calls == [["image", "output_dir", "viewer"]] * 3
+    assert plugin_runner.get_resolver("microglia").last_good == "mg.good"
+
+
+def test_shapes_and_labels_persistence(tmp_path):
+    import numpy as np
+    import pandas as pd
+    import tifffile as tiff
+
+    shapes = [np.array([[0, 1], [2, 3], [4, 5]]), np.array([[6, 7], [8, 9]])]
+    layer = SimpleNamespace(data=shapes, features=pd.DataFrame({"length": [1.5, 2.5]}), shape_type=["path", "line"])
+    plugin_runner.save_shapes_layer(layer, tmp_path / "shapes.csv")
+    df = pd.read_csv(tmp_path / "shapes.csv")
+    assert df.columns.tolist() == ["shape_index", "vertex_index", "y", "x", "length"]
+    assert df["shape_index"].tolist() == [0, 0, 0, 1, 1]
+    assert df["vertex_index"].tolist() == [0, 1, 2, 0, 1]
+    assert df["x"].tolist() == [1, 3, 5, 7, 9]
+    assert df["length"].tolist() == [1.5] * 3 + [2.5] * 2
+
+    plugin_runner.save_shapes_layer(layer, tmp_path / "shapes.npz", fmt="npz")
+    back = plugin_runner.load_shapes_npz(tmp_path / "shapes.npz")
+    assert [b.tolist() for b in back] == [s.tolist() for s in shapes]
+
+    labels = np.zeros((4, 4), np.int64)
+    labels[0, 0] = 300
+    plugin_runner.save_labels_layer(SimpleNamespace(data=labels), tmp_path / "l.tif",
+                                    tiff_opts=dict(compression="zlib", level=None, predictor=True))
+    back = tiff.imread(tmp_path / "l.tif")
+    assert back.dtype == np.uint16 and np.array_equal(back, labels)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+import tifffile as tiff
+
+
+def test_background_writer_writes_and_surfaces_errors(tmp_path):
+    from microglia_pipeline.preprocess import BackgroundWriter, save_flat_mips
+
+    mip = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    with BackgroundWriter(max_pending=1) as writer:
+        egfp_path, nuc_path = save_flat_mips(tmp_path, "plate", 3, mip, mip + 1, writer=writer)
+    np.testing.assert_array_equal(tiff.imread(egfp_path), mip)
+    np.testing.assert_array_equal(tiff.imread(nuc_path), mip + 1)
+
+    writer = BackgroundWriter()
+    writer.submit(lambda: 1 / 0)
+    with pytest.raises(RuntimeError, match="Background TIFF write failed"):
+        writer.close()
+
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.float32])
+@pytest.mark.parametrize("step", [1, 3, 7])
+def test_project_z_single_pass_matches_numpy(dtype, step):
+    from microglia_pipeline.preprocess import project_z
+
+    rng = np.random.default_rng(0)
+    stack = (rng.random((7, 2, 5, 6)) * 4000).astype(dtype)
+    chunks = (stack[z:z + step] for z in range(0, 7, step))
+    out = project_z(chunks, ["max", "mean", "sum", "std", "p10", "p90"], 7, dtype, axis=0)
+    ref = stack.astype(np.float64)
+    np.testing.assert_array_equal(out["max"], stack.max(axis=0))
+    assert out["max"].dtype == stack.dtype
+    np.testing.assert_allclose(out["sum"], ref.sum(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(out["mean"], ref.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(out["std"], ref.std(axis=0), rtol=1e-4, atol=1e-2)
+    for q in (10, 90):
+        np.testing.assert_allclose(out[f"p{q}"], np.percentile(ref, q, axis=0), rtol=1e-5)
+
+
+def test_parse_reductions_rejects_unknown():
+    from microglia_pipeline.preprocess import parse_reductions
+
+    assert parse_reductions("MAX") == ["max"]
+    assert parse_reductions(["max", "p99.5", "max"]) == ["max", "p99.5"]
+    with pytest.raises(ValueError):
+        parse_reductions(["median"])
+    with pytest.raises(ValueError):
+        parse_reductions("p101")
+
+
+def test_write_mip_compression_roundtrip(tmp_path):
+    from microglia_pipeline.preprocess import tiff_options, write_mip
+
+    mip = np.tile(np.arange(64, dtype=np.uint16), (64, 1))
+    opts = tiff_options("zlib", 6, predictor=True)
+    write_mip(tmp_path / "c.tif", mip, opts)
+    write_mip(tmp_path / "u.tif", mip)
+    np.testing.assert_array_equal(tiff.imread(tmp_path / "c.tif"), mip)
+    with tiff.TiffFile(tmp_path / "c.tif") as tf:
+        assert tf.pages[0].compression == 8 and tf.pages[0].predictor == 2
+    assert (tmp_path / "c.tif").stat().st_size < (tmp_path / "u.tif").stat().st_size
+    with pytest.raises(ValueError):
+        tiff_options("jpeg")
+
+
+def test_coalescing_writer_keeps_latest_job_and_records_errors():
+    import threading
+    from microglia_pipeline.preprocess import CoalescingWriter
+
+    gate = threading.Event()
+    done = []
+
+    def save(key, value):
+        gate.wait()
+        if value == "bad":
+            raise OSError("disk full")
+        done.append((key, value))
+
+    w = CoalescingWriter()
+    w.submit("blocker", save, "blocker", 0)  # occupies the thread until the gate opens
+    for v in range(5):
+        w.submit("xy0", save, "xy0", v)
+    w.submit("xy1", save, "xy1", "bad")
+    assert w.pending == 3
+    gate.set()
+    w.flush()
+    assert done == [("blocker", 0), ("xy0", 4)]
+    assert [k for k, _ in w.errors] == ["xy1"] and "1 failed" in w.status()
+    w.close()
+
+
+def test_atomic_path_leaves_no_partial_file(tmp_path):
+    from microglia_pipeline.preprocess import atomic_path
+
+    target = tmp_path / "a.tif"
+    with pytest.raises(RuntimeError):
+        with atomic_path(target) as tmp:
+            tmp.write_bytes(b"partial")
+            raise RuntimeError("interrupted")
+    assert list(tmp_path.iterdir()) == []
+    with atomic_path(target) as tmp:
+        tmp.write_bytes(b"ok")
+    assert target.read_bytes() == b"ok" and list(tmp_path.iterdir()) == [target]
+
+
+def test_save_flat_tiles_discards_outputs_on_error(tmp_path):
+    from microglia_pipeline.preprocess import save_flat_tiles
+
+    tile = np.ones((16, 16), dtype=np.uint16)
+
+    def tiles():
+        yield (0, 0), {"max": (tile, tile)}
+        raise RuntimeError("decode failed")
+
+    with pytest.raises(RuntimeError, match="decode failed"):
+        save_flat_tiles(tmp_path, "s", 0, (32, 16), tiles(), 16)
+    assert not [p for p in tmp_path.rglob("*") if p.is_file()]
+    with pytest.raises(RuntimeError, match="Tiled TIFF write"):
+        save_flat_tiles(tmp_path, "s", 0, (16, 16), iter([((0, 0), {"max": (tile, tile)})] * 2), 16)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+
+def _stack(rng, n_z=6, sharp=3):
+    """(C=2, Z, Y, X) uint16: flat-ish planes except a textured (in-focus) plane `sharp`."""
+    base = np.full((2, n_z, 64, 64), 100, dtype=np.uint16)
+    base += rng.integers(0, 3, size=base.shape, dtype=np.uint16)
+    base[:, sharp] += rng.integers(0, 800, size=(2, 64, 64), dtype=np.uint16)
+    base[0, 0, :4, :] = 65535  # saturated rows
+    return base
+
+
+@pytest.mark.parametrize("step", [1, 2, 6])
+def test_qc_metrics_and_chunking(step):
+    from microglia_pipeline.qc import QCAccumulator
+
+    stack = _stack(np.random.default_rng(0))
+    acc = QCAccumulator(6, stack.dtype, row_step=1)
+    for z0 in range(0, 6, step):
+        acc.update(stack[:, z0:z0 + step])
+    qc = acc.results()
+    sample = stack[..., ::2]
+    assert qc["egfp_focus_peak_z"] == 3 and qc["nuc_focus_peak_z"] == 3
+    assert qc["egfp_focus_ratio"] > 10
+    assert qc["egfp_sat_frac"] == pytest.approx(np.mean(sample[0] == 65535))
+    assert qc["nuc_sat_frac"] == 0
+    assert abs(qc["egfp_p50"] - np.percentile(sample[0], 50)) <= 1
+    assert 100 <= qc["nuc_background"] <= 102
+    assert len(qc["egfp_focus"].split(";")) == 6
+
+
+def test_read_positions_qc_and_table(fake_nd2, tmp_path):
+    from microglia_pipeline.io_nd2 import read_positions
+    from microglia_pipeline.qc import read_qc_table, write_qc_table
+
+    path, _ = fake_nd2
+    items = list(read_positions(path, ["egfp"], ["dapi"], mode="stream", qc={}))
+    assert all("egfp_sat_frac" in it["qc"] and "nuc_p99" in it["qc"] for it in items)
+    assert "qc" not in next(read_positions(path, ["egfp"], ["dapi"]))
+
+    rows = [dict(nd2=path.stem, xy_index=it["xy_index"], **it["qc"]) for it in items]
+    write_qc_table(tmp_path, rows)
+    write_qc_table(tmp_path, [dict(rows[1], egfp_p50=-1.0)])
+    table = read_qc_table(tmp_path / "qc.csv")
+    assert [(r["nd2"], r["xy_index"]) for r in table] == [(path.stem, "0"), (path.stem, "1")]
+    assert float(table[1]["egfp_p50"]) == -1.0
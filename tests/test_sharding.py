@@ -0,0 +1,108 @@
+import pytest
+
+from microglia_pipeline.synthetic import SyntheticSpec, synthetic_nd2
+
+
+def test_parse_shard():
+    from microglia_pipeline.sharding import parse_shard
+
+    assert parse_shard("2/4") == (2, 4)
+    for bad in ("0/4", "5/4", "1-4", "x"):
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def test_assign_shards_is_deterministic_and_balanced():
+    from microglia_pipeline.sharding import assign_shards
+
+    weights = [(f"k{i}", w) for i, w in enumerate([9, 7, 6, 5, 4, 3, 2, 2, 1])]
+    a = assign_shards(weights, 3)
+    assert a == assign_shards(list(reversed(weights)), 3)
+    loads = [sum(w for k, w in weights if a[k] == s) for s in (1, 2, 3)]
+    assert max(loads) - min(loads) <= 1
+
+
+def test_plan_and_merge_shards(tmp_path):
+    from microglia_pipeline.catalog import Catalog
+    from microglia_pipeline.manifest import Manifest, source_identity
+    from microglia_pipeline.sharding import merge_shards, plan_shards, shard_catalog_name, shard_manifest_name
+
+    specs = {"a.nd2": SyntheticSpec(positions=3, z=2, y=8, x=8),
+             "b.nd2": SyntheticSpec(positions=2, z=4, y=8, x=8)}
+    paths = []
+    for name in specs:
+        (tmp_path / name).write_bytes(b"")
+        paths.append(tmp_path / name)
+    out = tmp_path / "results"
+    with synthetic_nd2(specs), Catalog(out) as catalog:
+        plan = plan_shards(catalog, paths, 2)
+        assert plan == plan_shards(catalog, list(reversed(paths)), 2)
+        assert set(plan.values()) == {1, 2}
+        by_file = plan_shards(catalog, paths, 2, by_file=True)
+        assert len({by_file[u] for u in by_file if u.nd2_path.name == "a.nd2"}) == 1
+
+    def run_shard(s, units, count=2, tag=""):
+        m = Manifest(out, shard_manifest_name(s, count))
+        with Catalog(out, shard_catalog_name(s, count)) as cat:
+            for u in units:
+                f = out / f"{u.nd2_path.stem}_XY{u.xy_index:03d}{tag}.tif"
+                f.write_bytes(b"x")
+                m.record(u.nd2_path.stem, u.xy_index, source_identity(u.nd2_path), {}, [f])
+                cat.record_positions(u.nd2_path, [(u.xy_index, "done", [f])])
+        m.save()
+
+    units = sorted(plan, key=lambda u: (str(u.nd2_path), u.xy_index))
+    run_shard(1, [u for u in units if plan[u] == 1])
+    with pytest.raises(RuntimeError, match="missing"):
+        merge_shards(out, 2, plan)
+    # units completed by a shard that no longer owns them are accepted unless their results differ
+    run_shard(2, units[:1], count=3)
+    run_shard(3, units[:1], count=3, tag="-other")
+    with pytest.raises(RuntimeError, match="completed more than once"):
+        merge_shards(out, 3, {units[0]: 1})
+    run_shard(2, units)  # shard 2 also redoes shard 1's units, with identical records
+    summary = merge_shards(out, 2, plan)
+    assert summary["units"] == 5 and sum(summary["per_shard"].values()) == 5
+    assert len(Manifest(out).outputs) == 5
+    with Catalog(out) as cat:
+        assert len(cat.positions(status="done")) == 5
+
+
+def test_adding_inputs_between_sharded_runs(tmp_path):
+    import importlib.util
+    from pathlib import Path
+
+    from microglia_pipeline.catalog import Catalog
+    from microglia_pipeline.config import Config
+    from microglia_pipeline.manifest import Manifest, projection_settings
+    from microglia_pipeline.sharding import merge_shards, plan_shards
+
+    script = Path(__file__).resolve().parents[1] / "scripts" / "generate_projections.py"
+    spec = importlib.util.spec_from_file_location("generate_projections", script)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+    specs = {"a.nd2": SyntheticSpec(positions=3, z=2, y=8, x=8), "b.nd2": SyntheticSpec(positions=2, z=4, y=8, x=8),
+             "c.nd2": SyntheticSpec(positions=3, z=8, y=8, x=8)}
+    for name in specs:
+        (tmp_path / name).write_bytes(b"")
+    out = tmp_path / "results"
+
+    def run(names):
+        cfg = Config(inputs=[str(tmp_path / n) for n in names], output_root=str(out))
+        projected = []
+        for s in (1, 2):
+            mod.generate_from_config(cfg, shard=f"{s}/2")
+            projected += [k for k in Manifest(out, f"manifest.shard-{s}-of-2.json").outputs]
+        with Catalog(out) as catalog:
+            plan = plan_shards(catalog, [tmp_path / n for n in names], 2)
+        return projected, merge_shards(out, 2, plan, projection_settings(cfg))
+
+    with synthetic_nd2(specs):
+        run(["a.nd2", "b.nd2"])
+        before = {k: rec for k, rec in Manifest(out).outputs.items()}
+        mtimes = {f: (out / f).stat().st_mtime_ns for rec in before.values() for f in rec["files"]}
+        projected, summary = run(["a.nd2", "b.nd2", "c.nd2"])
+    assert summary["units"] == 8 and len(Manifest(out).outputs) == 8
+    assert {f: (out / f).stat().st_mtime_ns for f in mtimes} == mtimes  # nothing merged before was redone
+    assert sorted(set(projected) - set(before)) == ["c_XY000", "c_XY001", "c_XY002"]
@@ -0,0 +1,58 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tifffile as tiff
+
+pytest.importorskip("napari")
+
+
+def _load_script():
+    path = Path(__file__).resolve().parents[1] / "scripts" / "view_projections.py"
+    spec = importlib.util.spec_from_file_location("view_projections", path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_lazy_frame_stack_reads_on_demand(tmp_path):
+    mod = _load_script()
+    frames = [np.full((4, 5), i, dtype=np.uint16) for i in range(3)]
+    paths = []
+    for i, f in enumerate(frames):
+        paths.append(tmp_path / f"plate_XY{i:03d}.tif")
+        tiff.imwrite(paths[-1], f)
+    paths.insert(1, None)  # a position with no file for this channel
+
+    stack = mod.LazyFrameStack(paths, cache_frames=2)
+    assert stack.shape == (4, 4, 5) and stack.dtype == np.uint16
+    assert not stack._cache
+    np.testing.assert_array_equal(stack[2], frames[1])
+    assert not stack[1].any()
+    assert stack[0:4:3, 0, 0].tolist() == [0, 2]
+    assert len(stack._cache) == 2
+    assert mod.LazyFrameStack([None] + paths[2:]).first_index == 1
+
+
+def test_view_lazy_contrast_skips_missing_first_position(tmp_path):
+    from types import SimpleNamespace
+
+    mod = _load_script()
+    for xy in (1, 2):  # XY000 has an nuc file only
+        (tmp_path / "egfp").mkdir(exist_ok=True)
+        tiff.imwrite(tmp_path / "egfp" / f"plate_XY{xy:03d}.tif", np.full((4, 5), 100 * xy, dtype=np.uint16))
+    (tmp_path / "nuc").mkdir()
+    tiff.imwrite(tmp_path / "nuc" / "plate_XY000.tif", np.arange(20, dtype=np.uint16).reshape(4, 5))
+
+    layers = {}
+    v = SimpleNamespace(
+        add_image=lambda data, name, **kw: layers.__setitem__(name, kw),
+        dims=SimpleNamespace(ndim=3, current_step=(0, 0, 0), axis_labels=None,
+                             events=SimpleNamespace(current_step=SimpleNamespace(connect=lambda cb: None))),
+        text_overlay=SimpleNamespace(visible=False, text=""),
+        title="",
+    )
+    mod.view_lazy(v, tmp_path)
+    assert layers["EGFP_MIP"]["contrast_limits"] == (100.0, 101.0)
+    assert layers["NUC_MIP"]["contrast_limits"] == (0.0, 19.0)
@@ -0,0 +1,55 @@
+import os
+import threading
+
+
+def test_folder_watcher_waits_until_files_settle(tmp_path):
+    from microglia_pipeline.watch import FolderWatcher
+
+    now = [0.0]
+    w = FolderWatcher([str(tmp_path)], settle_seconds=30, clock=lambda: now[0])
+    a, b = tmp_path / "a.nd2", tmp_path / "b.nd2"
+    a.write_bytes(b"x")
+    b.write_bytes(b"")  # not written yet
+    assert w.poll() == []
+    now[0] = 20.0
+    with open(a, "ab") as f:  # still being written: settling restarts
+        f.write(b"y")
+    assert w.poll() == []
+    now[0] = 45.0
+    assert w.poll() == []
+    b.write_bytes(b"z")
+    st = a.stat()
+    os.utime(b, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    now[0] = 51.0
+    assert w.poll() == [a]
+    now[0] = 90.0
+    assert w.poll() == [b]
+    assert w.poll() == []  # each version is reported once
+
+
+def test_watch_processes_ready_files_through_bounded_queue(tmp_path):
+    from microglia_pipeline.watch import watch
+
+    class Watcher:
+        polls = [[tmp_path / f"f{i}.nd2" for i in range(5)], [tmp_path / "new.nd2"]]
+
+        def poll(self):
+            return self.polls.pop(0) if self.polls else []
+
+    stop = threading.Event()
+    handled, errors, sizes = [], [], []
+
+    def handle(path):
+        if path.name == "f1.nd2":
+            raise OSError("bad file")
+        handled.append(path.name)
+        if len(handled) == 5:
+            stop.set()
+
+    watch(Watcher(), handle, poll_seconds=0.01, queue_size=2, stop=stop,
+          on_error=lambda p, e: errors.append(p.name), on_poll=lambda q, b: sizes.append(q))
+    assert errors == ["f1.nd2"]
+    assert sorted(handled) == ["f0.nd2", "f2.nd2", "f3.nd2", "f4.nd2", "new.nd2"]
+    assert max(sizes) <= 2
+    # the file that became ready later overtakes the older backlog
+    assert handled.index("new.nd2") < handled.index("f4.nd2")
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("zarr")
+
+
+def test_zarr_store_roundtrip_and_chunking(tmp_path):
+    from microglia_pipeline.zarr_store import ZarrProjectionStore, read_projection
+
+    rng = np.random.default_rng(0)
+    planes = {p: rng.integers(0, 4000, size=(2, 8, 6)).astype(np.uint16) for p in range(5)}
+    with ZarrProjectionStore(tmp_path, scope="run", chunk_positions=2) as store:
+        for p in (0, 1, 2, 4):  # position 3 missing, as in an incremental run
+            paths = store.write("plate", p, 5, {"max": (planes[p][0], planes[p][1])})
+            assert paths == [store.chunk_path("plate", "max", p)]
+    store_path = tmp_path / "projections.zarr"
+    assert (store_path / ".zmetadata").exists()
+    for p in (0, 1, 2, 4):
+        np.testing.assert_array_equal(read_projection(store_path, "plate", p, "egfp"), planes[p][0])
+        np.testing.assert_array_equal(read_projection(store_path, "plate", p, "nuc"), planes[p][1])
+        assert store.chunk_path("plate", "max", p).exists()
+    assert not read_projection(store_path, "plate", 3).any()